@@ -0,0 +1,157 @@
+"""
+Memory benchmark for the Redash models.
+
+Builds the models of a synthetic Redash instance twice, and reports the memory retained by each:
+    1. `legacy`: plain dataclasses holding decoded `options` dicts, one query copy per widget
+       (how the models were built before they were made compact)
+    2. `compact`: the current slotted models, with interned strings, shared queries and lazy options
+
+Usage:
+    python benchmarks/model_memory.py [--dashboards 200] [--widgets 12]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from dataclasses import dataclass, field
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'redash2dqsql'))
+
+from redash import RedashClient, VisualizationType  # noqa: E402
+
+
+def _visualization(viz_id):
+    return {
+        'id': viz_id, 'type': 'CHART', 'name': f'Chart {viz_id}', 'description': '',
+        'options': {
+            'globalSeriesType': 'line',
+            'columnMapping': {f'col_{i}': 'y' for i in range(20)},
+            'seriesOptions': {f'col_{i}': {'type': 'line', 'yAxis': 0, 'zIndex': i, 'color': '#356AFF'} for i in range(20)},
+            'xAxis': {'type': '-', 'labels': {'enabled': True}},
+            'yAxis': [{'type': 'linear'}, {'type': 'linear', 'opposite': True}],
+        },
+    }
+
+
+def _query(query_id):
+    return {
+        'id': query_id, 'name': f'Query {query_id}', 'data_source_id': 1 + query_id % 3,
+        'query': f'SELECT day, count(*) FROM events_{query_id % 50} WHERE day >= {{{{start}}}} GROUP BY 1',
+        'tags': ['finance', 'daily', f'team_{query_id % 5}'],
+        'options': {'parameters': [
+            {'name': 'start', 'title': 'Start', 'type': 'date', 'value': 'd_last_7_days'},
+            {'name': 'region', 'title': 'Region', 'type': 'enum', 'enumOptions': '\n'.join(f'region_{i}' for i in range(50))},
+        ]},
+        'visualizations': [_visualization(query_id * 10 + i) for i in range(3)],
+    }
+
+
+class FakeRedash:
+    """
+    Serves the synthetic instance, decoding a fresh payload on every call like an HTTP client would
+    """
+
+    def __init__(self, dashboards, widgets):
+        self.payloads = {}
+        for d in range(dashboards):
+            query_ids = [(d * widgets + w) % (dashboards * 4) for w in range(widgets)]
+            self.payloads[('dashboard', d)] = json.dumps({
+                'id': d, 'name': f'Dashboard {d}', 'slug': f'dashboard-{d}', 'tags': ['finance'],
+                'widgets': [
+                    {'id': d * 100 + i, 'width': 1, 'text': '', 'options': {'position': {'col': 0, 'row': i, 'sizeX': 3, 'sizeY': 8}},
+                     'visualization': {'id': q * 10, 'query': {'id': q}}}
+                    for i, q in enumerate(query_ids)
+                ],
+            })
+            for q in query_ids:
+                self.payloads[('query', q)] = json.dumps(_query(q))
+
+    def get_dashboard(self, id):
+        return json.loads(self.payloads[('dashboard', id)])
+
+    def get_query(self, id):
+        return json.loads(self.payloads[('query', int(id))])
+
+    def get_data_sources(self):
+        return [{'id': i, 'name': f'source {i}', 'type': t} for i, t in ((1, 'athena'), (2, 'rds_mysql'), (3, 'pg'))]
+
+
+@dataclass
+class LegacyVisualization:
+    id: int
+    type: VisualizationType
+    name: str
+    description: str
+    options: dict
+
+
+@dataclass
+class LegacyQuery:
+    id: int
+    name: str
+    query_string: str
+    options: dict = field(default_factory=dict)
+    tags: list = field(default_factory=list)
+    visualizations: list = field(default_factory=list)
+
+
+@dataclass
+class LegacyWidget:
+    id: int
+    query: LegacyQuery | None
+    visualization: LegacyVisualization | None
+    options: dict | None = None
+
+
+def build_legacy(fake: FakeRedash, dashboard_ids):
+    dashboards = []
+    for dashboard_id in dashboard_ids:
+        widgets = []
+        for w in fake.get_dashboard(dashboard_id)['widgets']:
+            q = fake.get_query(w['visualization']['query']['id'])
+            query = LegacyQuery(q['id'], q['name'], q['query'], q['options'], q['tags'], [
+                LegacyVisualization(v['id'], VisualizationType(v['type']), v['name'], v['description'], v['options'])
+                for v in q['visualizations']
+            ])
+            viz = {v.id: v for v in query.visualizations}.get(w['visualization']['id'])
+            widgets.append(LegacyWidget(w['id'], query, viz, w['options']))
+        dashboards.append(widgets)
+    return dashboards
+
+
+def build_compact(fake: FakeRedash, dashboard_ids):
+    client = RedashClient('https://redash.example', 'key')
+    client.redash = fake
+    return [client.get_dashboard(d) for d in dashboard_ids]
+
+
+def measure(builder, fake, dashboard_ids) -> int:
+    tracemalloc.start()
+    models = builder(fake, dashboard_ids)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del models
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dashboards', type=int, default=200)
+    parser.add_argument('--widgets', type=int, default=12)
+    args = parser.parse_args()
+
+    fake = FakeRedash(args.dashboards, args.widgets)
+    dashboard_ids = range(args.dashboards)
+
+    legacy = measure(build_legacy, fake, dashboard_ids)
+    compact = measure(build_compact, fake, dashboard_ids)
+    print(f"dashboards: {args.dashboards}, widgets per dashboard: {args.widgets}")
+    print(f"legacy models:  {legacy / 2 ** 20:8.2f} MiB")
+    print(f"compact models: {compact / 2 ** 20:8.2f} MiB ({legacy / compact:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
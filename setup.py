@@ -15,6 +15,10 @@ setup(
         'python-dotenv',
         'databricks-sql-connector',
     ],
+    extras_require={
+        'inventory': ['pyarrow'],
+        'results': ['pyarrow'],
+    },
     entry_points={
         'console_scripts': [
             'redash2dqsql=redash2dqsql.cli:main',
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import json
+import os
+
+from lakeview import default_value, named_parameters
+from redash import Alert, Query
+from schedule import SchedulePlanner, quartz_expression
+from hlog import LOGGER
+
+
+# Redash alert operators -> Databricks alert comparison operators
+COMPARISON_OPERATORS = {
+    '>': 'GREATER_THAN',
+    'greater than': 'GREATER_THAN',
+    '>=': 'GREATER_THAN_OR_EQUAL',
+    '<': 'LESS_THAN',
+    'less than': 'LESS_THAN',
+    '<=': 'LESS_THAN_OR_EQUAL',
+    '==': 'EQUAL',
+    'equals': 'EQUAL',
+    '!=': 'NOT_EQUAL',
+}
+
+QUERIES_DIR = 'src/queries'
+JOBS_DIR = 'resources/jobs'
+ALERTS_DIR = 'resources/alerts'
+
+
+def _slug(name: str) -> str:
+    return ''.join(c if c.isalnum() else '_' for c in name.lower()).strip('_')
+
+
+def _document(data: dict) -> str:
+    # JSON is valid YAML, which spares a YAML dependency
+    return json.dumps(data, indent=2) + '\n'
+
+
+def _run_as(principal: str) -> dict:
+    return {'user_name': principal} if '@' in principal else {'service_principal_name': principal}
+
+
+class BundleWriter:
+    """
+    Writes a migration as a Databricks Asset Bundle, to be deployed with `databricks bundle deploy`:
+
+        databricks.yml                  bundle config, including every resource file
+        src/queries/<name>_<id>.sql     transformed queries, with named parameter markers
+        resources/jobs/query_<id>.yml   jobs running the scheduled queries on a SQL warehouse
+        resources/alerts/alert_<id>.yml alerts, with their schedules
+
+    Objects are written one at a time as they are added, so memory doesn't grow with the size of the migration.
+    Files are named after Redash ids and only rewritten when their content changes, and `close` removes the
+    files of the objects which weren't exported this time, so exporting again gives the same tree as a fresh
+    export (and a bundle deploy only applies the differences).
+    """
+
+    def __init__(self, root: str, name: str = 'redash_migration', warehouse_id: str | None = None,
+                 destination_id: str | None = None, run_as: str | None = None,
+                 schedule_planner: SchedulePlanner | None = None):
+        self.root = root
+        self.name = name
+        self.warehouse_id = warehouse_id
+        self.destination_id = destination_id
+        self.run_as = run_as
+        self.schedule_planner = schedule_planner
+        self.counts = {'written': 0, 'unchanged': 0, 'removed': 0}
+        # paths written (or left unchanged) by this export, relative to the root
+        self._paths: set[str] = set()
+
+    def write_config(self, targets: list | None = None, root_path: str | None = None):
+        """
+        Writes `databricks.yml`, with a deployment target per workspace (see `fanout.Target`), if given
+        """
+        variables = {'warehouse_id': {'description': 'SQL warehouse running the queries and alerts'}}
+        if self.warehouse_id:
+            variables['warehouse_id']['default'] = self.warehouse_id
+        bundle_targets = {}
+        for i, target in enumerate(targets or ()):
+            bundle_target = {'workspace': {'host': target.host}}
+            if i == 0:
+                bundle_target['default'] = True
+            if target.target_folder or root_path:
+                bundle_target['workspace']['root_path'] = target.target_folder or root_path
+            if target.warehouse_id:
+                bundle_target['variables'] = {'warehouse_id': target.warehouse_id}
+            if target.run_as:
+                bundle_target['run_as'] = _run_as(target.run_as)
+            bundle_targets[target.name] = bundle_target
+        if not bundle_targets:
+            bundle_targets['default'] = {'default': True}
+            if root_path:
+                bundle_targets['default']['workspace'] = {'root_path': root_path}
+
+        config = {
+            'bundle': {'name': self.name},
+            'include': [f"{JOBS_DIR}/*.yml", f"{ALERTS_DIR}/*.yml"],
+            'variables': variables,
+            'targets': bundle_targets,
+        }
+        if self.run_as:
+            config['run_as'] = _run_as(self.run_as)
+        self._write('databricks.yml', _document(config))
+
+    def add_query(self, query: Query, schedule: bool = True) -> str:
+        """
+        Writes the SQL file of a query and, if it is scheduled, the job refreshing it
+
+        :return: path of the SQL file, relative to the bundle root
+        """
+        sql, parameters = named_parameters(query)
+        sql_path = f"{QUERIES_DIR}/{_slug(query.name)}_{query.id}.sql"
+        self._write(sql_path, f"-- {query.name} (Redash query {query.id})\n{sql.rstrip()}\n")
+        if not schedule or not query.schedule:
+            return sql_path
+
+        sql_task = {
+            'warehouse_id': '${var.warehouse_id}',
+            'file': {'path': os.path.relpath(sql_path, JOBS_DIR)},
+        }
+        if parameters:
+            sql_task['parameters'] = {k: default_value(p) or '' for k, p in parameters.items()}
+        job = {
+            'name': f"Query `{query.name}` schedule",
+            'description': f"Schedule of Redash query {query.id}",
+            'tags': {'migrated_from_redash': 'true', 'original_id': str(query.id)},
+            'schedule': {
+                'quartz_cron_expression': quartz_expression(query.schedule, self.schedule_planner, query_id=query.id),
+                'timezone_id': 'UTC',
+            },
+            'tasks': [{'task_key': 'sql', 'sql_task': sql_task}],
+        }
+        self._write(f"{JOBS_DIR}/query_{query.id}.yml", _document({'resources': {'jobs': {f"query_{query.id}": job}}}))
+        return sql_path
+
+    def add_alert(self, alert: Alert):
+        """
+        Writes the definition of an alert, evaluated on the schedule of the alert (or of its query)
+        """
+        options = alert.options or {}
+        operator = COMPARISON_OPERATORS.get(options.get('op'))
+        if operator is None:
+            raise ValueError(f"Unsupported operator `{options.get('op')}` of alert {alert.id}")
+        value = options.get('value')
+        try:
+            threshold = {'double_value': float(value)}
+        except (TypeError, ValueError):
+            threshold = {'string_value': str(value)}
+
+        evaluation = {
+            'source': {'name': options.get('column')},
+            'comparison_operator': operator,
+            'threshold': {'value': threshold},
+        }
+        notification = {}
+        if alert.rearm:
+            notification['retrigger_seconds'] = alert.rearm
+        if self.destination_id:
+            notification['subscriptions'] = [{'destination_id': self.destination_id}]
+        if notification:
+            evaluation['notification'] = notification
+
+        schedule = alert.schedule or alert.query.schedule
+        if schedule and schedule.get('interval'):
+            cron = {'quartz_cron_schedule': quartz_expression(schedule, self.schedule_planner,
+                                                              query_id=alert.query.id),
+                    'timezone_id': 'UTC'}
+        else:
+            LOGGER.warning(f"Alert `{alert.name}` has no schedule, it is exported paused with an hourly schedule")
+            cron = {'quartz_cron_schedule': '0 0 * * * ?', 'timezone_id': 'UTC', 'pause_status': 'PAUSED'}
+
+        sql, _ = named_parameters(alert.query)
+        definition = {
+            'display_name': alert.name,
+            'query_text': sql,
+            'warehouse_id': '${var.warehouse_id}',
+            'evaluation': evaluation,
+            'schedule': cron,
+        }
+        if options.get('custom_subject'):
+            definition['custom_summary'] = options['custom_subject']
+        if options.get('custom_body'):
+            definition['custom_description'] = options['custom_body']
+        self._write(f"{ALERTS_DIR}/alert_{alert.id}.yml",
+                    _document({'resources': {'alerts': {f"alert_{alert.id}": definition}}}))
+
+    def _write(self, relative_path: str, content: str):
+        self._paths.add(relative_path)
+        path = os.path.join(self.root, relative_path)
+        if os.path.exists(path):
+            with open(path) as f:
+                if f.read() == content:
+                    self.counts['unchanged'] += 1
+                    return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        self.counts['written'] += 1
+
+    def close(self):
+        """
+        Removes the query, job and alert files of previous exports which this export didn't write
+        """
+        for directory in (QUERIES_DIR, JOBS_DIR, ALERTS_DIR):
+            if not os.path.isdir(os.path.join(self.root, directory)):
+                continue
+            for file_name in os.listdir(os.path.join(self.root, directory)):
+                relative_path = f"{directory}/{file_name}"
+                path = os.path.join(self.root, relative_path)
+                if relative_path not in self._paths and os.path.isfile(path):
+                    os.remove(path)
+                    self.counts['removed'] += 1
+
+    def report(self) -> str:
+        return (f"Bundle `{self.root}`: {self.counts['written']} files written, "
+                f"{self.counts['unchanged']} unchanged, {self.counts['removed']} removed")
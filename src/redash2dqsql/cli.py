@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import traceback
+from datetime import datetime
 
 import click
 
@@ -11,20 +12,74 @@ import click
 @click.option('--redash-api-key', help='Redash API Key', envvar='REDASH_API_KEY')
 @click.option('--databricks-host', help='Databricks Host', envvar='DATABRICKS_HOST')
 @click.option('--databricks-token',  help='Databricks Token', envvar='DATABRICKS_TOKEN')
+@click.option('--state-db', help='SQLite database shared by workers, enables sharded execution', envvar='REDASH2DQSQL_STATE_DB',
+              type=click.Path(dir_okay=False, path_type=str), default=None)
+@click.option('--worker-id', help='Worker name used for leases (defaults to host and PID)', envvar='REDASH2DQSQL_WORKER_ID', default=None)
+@click.option('--lease-seconds', help='Seconds a claimed item stays leased without heartbeats', default=300, type=int)
+@click.option('--run-id', help='ID recorded on the migrated objects, to roll them back (defaults to the start time); '
+                               'sharded workers of a migration share it',
+              envvar='REDASH2DQSQL_RUN_ID', default=None)
+@click.option('--http-cache', help='SQLite database caching Redash API responses between runs', envvar='REDASH2DQSQL_HTTP_CACHE',
+              type=click.Path(dir_okay=False, path_type=str), default=None)
+@click.option('--cache-max-age', help='Reuse cached responses of URLs matching PATTERN for SECONDS without revalidating '
+                                      'them, eg `api/data_sources=3600`', metavar='PATTERN=SECONDS', multiple=True)
+@click.option('--pool-size', help='Connections kept alive per host, to match the number of concurrent workers',
+              envvar='REDASH2DQSQL_POOL_SIZE', type=click.IntRange(min=1), default=None)
+@click.option('--targets', 'targets_file', help='JSON file of Databricks workspaces to migrate to concurrently, '
+                                                 'instead of --databricks-host', envvar='REDASH2DQSQL_TARGETS',
+              type=click.Path(exists=True, dir_okay=False, path_type=str), default=None)
+@click.option('--snapshot', help='Read Redash objects from this snapshot file (see the snapshot command) instead of the API',
+              envvar='REDASH2DQSQL_SNAPSHOT', type=click.Path(exists=True, dir_okay=False, path_type=str), default=None)
+@click.option('--profile', help='Profile the run (CPU samples and allocations by phase), writing the profile to this directory',
+              type=click.Path(file_okay=False, path_type=str), default=None)
+@click.option('--profile-top', help='Number of allocating functions in the profile report', default=25, type=int)
 @click.pass_context
-def cli(ctx, redash_url, redash_api_key, databricks_host, databricks_token):
+def cli(ctx, redash_url, redash_api_key, databricks_host, databricks_token, state_db, worker_id, lease_seconds, run_id,
+        http_cache, cache_max_age, pool_size, targets_file, snapshot, profile, profile_top):
     ctx.ensure_object(dict)
+    if profile:
+        from profiling import Profiler
+        profiler = Profiler(profile, top=profile_top)
+        profiler.start()
+        ctx.call_on_close(lambda: click.echo(profiler.stop()))
+    # generated once, so that the migrated objects and the work items of the state database share it
+    ctx.obj['run_id'] = run_id or datetime.now().strftime('%Y%m%d-%H%M%S')
+    ctx.obj['run_id_given'] = run_id is not None
+    ctx.obj['pool_size'] = pool_size
+    ctx.obj['http_cache'] = http_cache
+    try:
+        from httpcache import parse_max_age
+        ctx.obj['cache_max_age'] = parse_max_age(cache_max_age)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--cache-max-age')
     ctx.obj['redash_url'] = redash_url
     ctx.obj['redash_api_key'] = redash_api_key
+    ctx.obj['snapshot'] = snapshot
     ctx.obj['databricks_host'] = databricks_host
     ctx.obj['databricks_token'] = databricks_token
+    ctx.obj['targets'] = None
+    if targets_file:
+        from fanout import load_targets
+        try:
+            ctx.obj['targets'] = load_targets(targets_file)
+        except (ValueError, TypeError) as e:
+            raise click.BadParameter(str(e), param_hint='--targets')
+    ctx.obj['lease_store'] = None
+    if state_db:
+        from shard import LeaseStore
+        ctx.obj['lease_store'] = LeaseStore(state_db, worker_id=worker_id, lease_seconds=lease_seconds,
+                                             run_id=ctx.obj['run_id'])
 
 
-def check_required_options(ctx):
+def check_required_options(ctx, databricks=True, redash=True):
     """
-    Extract check for required options into a function to enable --help function to work
+    Extract check for required options into a function to enable --help function to work.
+    Commands which only read from Redash pass `databricks=False`, the ones only using Databricks `redash=False`.
     """
-    if not all([ctx.obj['redash_url'], ctx.obj['redash_api_key'], ctx.obj['databricks_host'], ctx.obj['databricks_token']]):
+    required = [ctx.obj['redash_url'], ctx.obj['redash_api_key']] if redash and not ctx.obj.get('snapshot') else []
+    if databricks and not ctx.obj.get('targets'):
+        required += [ctx.obj['databricks_host'], ctx.obj['databricks_token']]
+    if not all(required):
         click.echo("""
         Missing required options to connect to redash and databricks:
         --redash-url
@@ -42,6 +97,225 @@ def check_required_options(ctx):
         raise click.Abort()
 
 
+def build_redash_client(ctx):
+    """
+    Returns the Redash client of a command, reporting the use of the HTTP cache (if any) when the command ends
+    """
+    from redash import RedashClient
+
+    if ctx.obj['snapshot']:
+        return RedashClient.from_snapshot(ctx.obj['snapshot'])
+    redash = RedashClient(ctx.obj['redash_url'], ctx.obj['redash_api_key'], http_cache=ctx.obj['http_cache'],
+                          cache_max_age=ctx.obj['cache_max_age'], pool_size=ctx.obj['pool_size'])
+    if redash.http_cache is not None:
+        ctx.call_on_close(lambda: click.echo(redash.http_cache.report()))
+    return redash
+
+
+def build_targets(ctx, make_client):
+    """
+    Returns the fan-out over the workspaces of a command: the ones of the targets file, or --databricks-host.
+    `make_client(target, id_store, run_id)` creates the `DBXClient` of a target.
+    """
+    from fanout import FanOut, NamespacedStore, Target
+
+    targets = ctx.obj['targets'] or [Target('default', ctx.obj['databricks_host'], ctx.obj['databricks_token'])]
+    # a single run id across the workspaces, so that the run can be rolled back from any of them
+    run_id = ctx.obj['run_id']
+    lease_store = ctx.obj['lease_store']
+    if lease_store is not None and not ctx.obj['run_id_given']:
+        # a generated run id is the start time of this worker: the workers of a run wouldn't share their work
+        raise click.UsageError("Migrating with --state-db needs a --run-id, shared by the workers of the migration")
+    clients = []
+    for target in targets:
+        # each workspace has its own id map
+        id_store = NamespacedStore(lease_store, target.name) if lease_store and len(targets) > 1 else lease_store
+        clients.append((target, make_client(target, id_store, run_id)))
+    fanout = FanOut(clients)
+    ctx.call_on_close(fanout.close)
+    click.echo(f"Migration run {run_id}" + (f" to {', '.join(t.name for t in targets)}" if len(targets) > 1 else ""))
+    return fanout
+
+
+def check_single_target(ctx, option, value):
+    """
+    Rejects options naming objects of a single workspace (eg warehouses) when migrating to several
+    """
+    if value and ctx.obj['targets'] and len(ctx.obj['targets']) > 1:
+        raise click.UsageError(f"{option} applies to a single workspace, it can't be used with several --targets")
+
+
+def build_schedule_planner(stagger_schedules, runtimes_file):
+    """
+    Returns a planner staggering migrated schedules, if asked for
+    """
+    if not stagger_schedules:
+        return None
+    import json
+    from schedule import SchedulePlanner
+
+    runtimes = {}
+    if runtimes_file:
+        with open(runtimes_file) as f:
+            runtimes = {int(k): float(v) for k, v in json.load(f).items()}
+    return SchedulePlanner(runtimes=runtimes)
+
+
+def build_router(routing_rules, redash, warehouse_id=None):
+    """
+    Returns a router assigning queries to warehouses, if rules are given
+    """
+    if not routing_rules:
+        return None
+    from routing import WarehouseRouter
+    return WarehouseRouter.from_file(routing_rules, warehouse_id, runtime_of=redash.query_runtime)
+
+
+def quarantine_options(command):
+    """
+    Adds the options quarantining the objects which fail to migrate to a migration command
+    """
+    options = [
+        click.option('--continue-on-error', help='Quarantine the objects failing to migrate (and their dependents) '
+                                                 'and carry on', default=False, is_flag=True),
+        click.option('--retry-quarantine', help='Only migrate the quarantined objects', default=False, is_flag=True),
+        click.option('--quarantine-file', help='JSON lines file of the quarantined objects (with --state-db, they are '
+                                               'kept in the state database instead)', default='quarantine.jsonl',
+                     type=click.Path(dir_okay=False, path_type=str)),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def build_quarantine(continue_on_error, retry_quarantine, quarantine_file, lease_store=None):
+    """
+    Returns the quarantine of the objects which failed to migrate, when failures are quarantined or retried.
+    Sharded workers share the quarantine of their state database.
+    """
+    if not (continue_on_error or retry_quarantine):
+        return None
+    from quarantine import Quarantine
+    return Quarantine(quarantine_file, store=lease_store)
+
+
+def fail_item(work, item_id, error, quarantine=None, continue_on_error=False):
+    """
+    Records the failure of a work item. In continue-on-error mode the item is quarantined and the run carries on,
+    otherwise the run is aborted.
+    """
+    work.failed(item_id, error)
+    if continue_on_error:
+        quarantine.add(work.kind, item_id, error)
+        return
+    traceback.print_tb(error.__traceback__)
+    click.echo(error)
+    raise click.Abort(error)
+
+
+def block_item(work, item_id, quarantine, blocking_query):
+    """
+    Quarantines a work item without attempting it, as a query it needs failed
+    """
+    work.failed(item_id, f"query {blocking_query.id} failed")
+    quarantine.add(work.kind, item_id, blocked_by=('query', blocking_query.id))
+
+
+def index_existing(targets, existing):
+    """
+    Indexes the objects migrated to the workspaces by previous runs, so that they are reused instead of duplicated
+    """
+    if existing == 'duplicate':
+        return
+    from workspace_index import WorkspaceIndex
+
+    for _, dbx in targets:
+        dbx.index = WorkspaceIndex.build(dbx.client)
+        dbx.update_existing = existing == 'update'
+
+
+def build_optimizer(optimize_schema, optimize_passes):
+    """
+    Returns the optimizer applying performance rewrites to transformed queries, if a schema file is given
+    """
+    if not optimize_schema:
+        return None
+    from optimize import DEFAULT_PASSES, QueryOptimizer
+
+    passes = [p.strip() for p in optimize_passes.split(',') if p.strip()] if optimize_passes else DEFAULT_PASSES
+    try:
+        return QueryOptimizer.from_file(optimize_schema, passes)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--optimize-passes')
+
+
+def report_optimizations(optimizer, report_path):
+    """
+    Writes the diffs of the optimized queries to the report file, or prints their summary
+    """
+    if optimizer is None:
+        return
+    report = optimizer.report()
+    if report_path:
+        with open(report_path, 'w') as f:
+            f.write(report)
+    click.echo(report.splitlines()[0])
+
+
+def collect_queries(redash, source_dialect=None, no_sqlglot=False, query_ids=(), dashboard_ids=(), optimizer=None):
+    """
+    Fetches and transforms the queries of a run up-front, for the stages which need to see all of them.
+    Query models are shared, so later fetches of the same queries (or dashboards) see the changes of these stages.
+
+    :return: list of (query, ID of the dashboard showing it, if any)
+    """
+    from transform import transform_query
+
+    collected = [(redash.get_query(i), None) for i in query_ids]
+    for dashboard_id in dashboard_ids:
+        dashboard = redash.get_dashboard(dashboard_id)
+        collected.extend((w.query, dashboard.id) for w in dashboard.widgets if w.query)
+    if not no_sqlglot:
+        for query, _ in collected:
+            transform_query(query, source_dialect, optimizer)
+    return collected
+
+
+def apply_dedup(targets, queries):
+    """
+    Migrates equivalent (transformed) queries as a single Databricks query and reports the removed work
+    """
+    from dedup import find_duplicates, merge_duplicates
+
+    report = find_duplicates(queries)
+    for redash_id, canonical in merge_duplicates(report).items():
+        for _, dbx in targets:
+            dbx.alias_query(redash_id, canonical)
+    click.echo(report.summary())
+
+
+def apply_materialization(redash, targets, collected, output_path, schema, min_runs_per_day, create_views=False,
+                          rewrite=False):
+    """
+    Writes materialized views for hot scheduled queries, and rewrites those queries to read from them once the views
+    are created in every workspace (or when asked to)
+    """
+    from materialize import MaterializationAdvisor
+
+    advisor = MaterializationAdvisor(schema, min_runs_per_day=min_runs_per_day, runtime_of=redash.query_runtime)
+    for query, dashboard_id in collected:
+        advisor.add(query, dashboard_id)
+    create_view = None
+    if create_views:
+        def create_view(ddl):
+            targets.run(lambda target, dbx: dbx.execute_statement(ddl))
+    selected = advisor.apply(output_path, create_view, rewrite=rewrite)
+    click.echo(advisor.report(selected))
+    if selected and not (create_views or rewrite):
+        click.echo(f"WARNING: the materialized views were only written to `{output_path}`, the queries keep their SQL. "
+                   f"Run the file and migrate again with --rewrite-materialized, or use --create-views", err=True)
+
+
 @cli.command()
 @click.pass_context
 @click.argument('target-folder', type=click.Path(file_okay=False, dir_okay=True, path_type=str))
@@ -52,35 +326,155 @@ def check_required_options(ctx):
 @click.option('--run-as', help='User or the service principle to run the alert job as.', default=None)
 @click.option('--source-dialect', help='Source query SQL dialect', default=None)
 @click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
-def alerts(ctx, target_folder, alert_id, tags, destination_id, warehouse_id, run_as, source_dialect, no_sqlglot):
+@click.option('--group-alerts', help='Share one Databricks query (and job, per schedule) between alerts on the same query',
+              default=False, is_flag=True)
+@click.option('--batch-schedules', help='Batch alert schedules sharing an interval, warehouse and run-as into shared jobs',
+              default=False, is_flag=True)
+@click.option('--max-tasks-per-job', help='Maximum number of alerts per batched job', default=100, type=int)
+@click.option('--stagger-schedules', help='Spread schedules over time to flatten warehouse load', default=False, is_flag=True)
+@click.option('--runtimes-file', help='JSON file of query runtimes in seconds, by Redash query id', default=None,
+              type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--routing-rules', help='JSON file of rules routing queries (and their alerts) to warehouses', default=None,
+              type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-schema', help='JSON file of table columns and partitions, enables performance rewrites of the queries',
+              default=None, type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-passes', help='Comma separated rewrite passes (unnest, pushdown, partitions, approx, prune)',
+              default=None)
+@click.option('--optimize-report', help='Write the diffs of the rewritten queries to this file', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+@click.option('--existing', help='What to do with objects migrated by previous runs: reuse them (skip), reuse and '
+                                   'update their SQL (update), or migrate them again (duplicate)',
+              type=click.Choice(['skip', 'update', 'duplicate']), default='duplicate')
+@quarantine_options
+def alerts(ctx, target_folder, alert_id, tags, destination_id, warehouse_id, run_as, source_dialect, no_sqlglot,
+           group_alerts, batch_schedules, max_tasks_per_job, stagger_schedules, runtimes_file, routing_rules,
+           optimize_schema, optimize_passes, optimize_report, existing, continue_on_error, retry_quarantine,
+           quarantine_file):
     check_required_options(ctx)
-    from redash import RedashClient
+    check_single_target(ctx, '--routing-rules', routing_rules)
     from dbsql import DBXClient
+
+    redash = build_redash_client(ctx)
+    targets = build_targets(ctx, lambda target, id_store, run_id: DBXClient(
+        target.host, target.token, warehouse_id=target.warehouse_id, id_store=id_store, run_id=run_id,
+        pool_size=ctx.obj['pool_size'], max_alerts_per_job=max_tasks_per_job if batch_schedules else None,
+        schedule_planner=build_schedule_planner(stagger_schedules, runtimes_file),
+        router=build_router(routing_rules, redash, warehouse_id)))
+    index_existing(targets, existing)
+    optimizer = build_optimizer(optimize_schema, optimize_passes)
+    quarantine = build_quarantine(continue_on_error, retry_quarantine, quarantine_file, ctx.obj['lease_store'])
+    try:
+        _migrate_alerts(redash, targets, target_folder, alert_id, tags, destination_id, warehouse_id, run_as,
+                        source_dialect, no_sqlglot, group_alerts, ctx.obj['lease_store'], optimizer,
+                        quarantine, continue_on_error, retry_quarantine)
+    finally:
+        report_optimizations(optimizer, optimize_report)
+        if quarantine is not None:
+            click.echo(quarantine.summary())
+        for target, dbx in targets:
+            if dbx.router:
+                click.echo(dbx.router.report())
+            if dbx.pending_alert_schedules:
+                job_ids = dbx.flush_alert_schedules()
+                click.echo(f"Created {len(job_ids)} batched alert schedule jobs{targets.label(target)}")
+
+
+def _migrate_alerts(redash, targets, target_folder, alert_id, tags, destination_id, warehouse_id, run_as, source_dialect,
+                    no_sqlglot, group_alerts, lease_store, optimizer=None, quarantine=None, continue_on_error=False,
+                    retry_quarantine=False):
     from transform import transform_query
+    from shard import WorkQueue
 
-    redash = RedashClient(ctx.obj['redash_url'], ctx.obj['redash_api_key'])
-    dbx = DBXClient(ctx.obj['databricks_host'], ctx.obj['databricks_token'])
+    # without workers to share them with, the alerts are built from the response listing them, instead of being
+    # fetched one at a time
+    listed = {a.id: a for a in redash.alerts(tags=tags)} if lease_store is None and not alert_id else None
 
-    alerts_list = redash.alerts(tags=tags, alert_id=alert_id)
-    for alert in alerts_list:
-        if not no_sqlglot:
-            if source_dialect:
-                transform_query(alert.query, source_dialect)
-            else:
-                transform_query(alert.query)
+    def get_alert(item_id):
+        alert = listed.get(int(item_id)) if listed is not None else None
+        return alert or redash.get_alert(item_id)
+
+    if group_alerts and not alert_id:
+        if listed is not None:
+            alert_groups = {}
+            for a in listed.values():
+                alert_groups.setdefault(a.query.id, []).append(a.id)
+        else:
+            alert_groups = redash.alert_ids_by_query(tags=tags)
+        if retry_quarantine:
+            retried = set(quarantine.ids('alert_query'))
+            alert_groups = {k: v for k, v in alert_groups.items() if str(k) in retried}
+        work = WorkQueue(lease_store, 'alert_query', alert_groups, retry=retry_quarantine)
+        for item_id in work:
+            group = None
+            try:
+                group = [get_alert(i) for i in alert_groups[int(item_id)]]
+                if continue_on_error and quarantine.blocking(group[0].query):
+                    block_item(work, item_id, quarantine, quarantine.blocking(group[0].query))
+                    continue
+                if not no_sqlglot:
+                    transform_query(group[0].query, source_dialect, optimizer)
+
+                def create_group(target, dbx):
+                    dbx_ids = dbx.create_alert_group(
+                        group,
+                        target.target_folder or target_folder,
+                        destination_id=target.destination_id or destination_id,
+                        warehouse_id=target.warehouse_id or warehouse_id,
+                        run_as=target.run_as or run_as
+                    )
+                    click.echo(f"Created alerts {', '.join(dbx_ids.values())} on query {item_id}{targets.label(target)}")
+                    return dbx_ids
+
+                work.done(item_id, targets.run(create_group))
+                if quarantine is not None:
+                    quarantine.release(work.kind, item_id)
+            except Exception as e:
+                if continue_on_error and group is not None and any(
+                        dbx.read_cache(group[0].query.id) is None for _, dbx in targets):
+                    quarantine.mark_failed('query', group[0].query.id)
+                fail_item(work, item_id, e, quarantine, continue_on_error)
+        return
+
+    if retry_quarantine:
+        alert_ids = quarantine.ids('alert')
+    elif alert_id:
+        alert_ids = [alert_id]
+    else:
+        alert_ids = list(listed) if listed is not None else redash.alert_ids(tags=tags)
+    work = WorkQueue(lease_store, 'alert', alert_ids, retry=retry_quarantine)
+    for item_id in work:
+        alert = None
         try:
-            dbx_id = dbx.create_alert(
-                alert,
-                target_folder,
-                destination_id=destination_id,
-                warehouse_id=warehouse_id,
-                run_as=run_as
-            )
-            click.echo(f"Created alert {dbx_id}")
+            alert = get_alert(item_id)
+            if continue_on_error and quarantine.blocking(alert.query):
+                block_item(work, item_id, quarantine, quarantine.blocking(alert.query))
+                continue
+            if not no_sqlglot:
+                if source_dialect:
+                    transform_query(alert.query, source_dialect, optimizer=optimizer)
+                else:
+                    transform_query(alert.query, optimizer=optimizer)
+
+            def create_alert(target, dbx):
+                dbx_id = dbx.create_alert(
+                    alert,
+                    target.target_folder or target_folder,
+                    destination_id=target.destination_id or destination_id,
+                    warehouse_id=target.warehouse_id or warehouse_id,
+                    run_as=target.run_as or run_as
+                )
+                click.echo(f"Created alert {dbx_id}{targets.label(target)}")
+                return dbx_id
+
+            work.done(item_id, targets.run(create_alert))
+            if quarantine is not None:
+                quarantine.release(work.kind, item_id)
         except Exception as e:
-            traceback.print_tb(e.__traceback__)
-            click.echo(e)
-            raise click.Abort(e)
+            if continue_on_error and alert is not None and any(
+                    dbx.read_cache(alert.query.id) is None for _, dbx in targets):
+                # the query failed, the other alerts on it would fail the same way
+                quarantine.mark_failed('query', alert.query.id)
+            fail_item(work, item_id, e, quarantine, continue_on_error)
 
 
 @cli.command
@@ -93,32 +487,114 @@ def alerts(ctx, target_folder, alert_id, tags, destination_id, warehouse_id, run
 @click.option('--source-dialect', help='Source query SQL dialect', default=None)
 @click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
 @click.option('--create-folder', help='Create a dedicated folder.', default=False, is_flag=True)
-def queries(ctx, target_folder, query_id, tags, warehouse_id, run_as, source_dialect, no_sqlglot, create_folder):
+@click.option('--dedup', help='Migrate equivalent queries as a single Databricks query', default=False, is_flag=True)
+@click.option('--create-schedules', help='Create jobs refreshing scheduled queries (requires --warehouse-id)',
+              default=False, is_flag=True)
+@click.option('--stagger-schedules', help='Spread schedules over time to flatten warehouse load', default=False, is_flag=True)
+@click.option('--runtimes-file', help='JSON file of query runtimes in seconds, by Redash query id', default=None,
+              type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--routing-rules', help='JSON file of rules routing queries to warehouses', default=None,
+              type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--materialize', help='Write materialized views for hot scheduled queries to this SQL file; the queries '
+                                     'keep their SQL unless the views are created (--create-views)', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+@click.option('--materialize-schema', help='Catalog and schema of the materialized views, eg `main.redash`', default=None)
+@click.option('--min-runs-per-day', help='Minimum refreshes per day of materialized queries', default=24.0, type=float)
+@click.option('--create-views', help='Create the materialized views on the SQL warehouse, and migrate their queries '
+                                     'reading from them', default=False, is_flag=True)
+@click.option('--rewrite-materialized', help='Migrate the materialized queries reading from the views without creating '
+                                             'them (the --materialize file was run beforehand)', default=False, is_flag=True)
+@click.option('--optimize-schema', help='JSON file of table columns and partitions, enables performance rewrites of the queries',
+              default=None, type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-passes', help='Comma separated rewrite passes (unnest, pushdown, partitions, approx, prune)',
+              default=None)
+@click.option('--optimize-report', help='Write the diffs of the rewritten queries to this file', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+@click.option('--existing', help='What to do with objects migrated by previous runs: reuse them (skip), reuse and '
+                                   'update their SQL (update), or migrate them again (duplicate)',
+              type=click.Choice(['skip', 'update', 'duplicate']), default='duplicate')
+@quarantine_options
+def queries(ctx, target_folder, query_id, tags, warehouse_id, run_as, source_dialect, no_sqlglot, create_folder, dedup,
+            create_schedules, stagger_schedules, runtimes_file, routing_rules, materialize, materialize_schema,
+            min_runs_per_day, create_views, rewrite_materialized, optimize_schema, optimize_passes, optimize_report, existing, continue_on_error,
+            retry_quarantine, quarantine_file):
     check_required_options(ctx)
-    from redash import RedashClient
+    if materialize and not materialize_schema:
+        raise click.UsageError("--materialize requires --materialize-schema")
+    if (create_views or rewrite_materialized) and not materialize:
+        raise click.UsageError("--create-views and --rewrite-materialized require --materialize")
+    if create_schedules and not warehouse_id and not all(t.warehouse_id for t in ctx.obj['targets'] or ()):
+        raise click.UsageError("--create-schedules requires --warehouse-id")
+    check_single_target(ctx, '--routing-rules', routing_rules)
     from dbsql import DBXClient
     from transform import transform_query
+    from shard import WorkQueue
 
-    redash = RedashClient(ctx.obj['redash_url'], ctx.obj['redash_api_key'])
-    dbx = DBXClient(ctx.obj['databricks_host'], ctx.obj['databricks_token'], warehouse_id=warehouse_id)
+    redash = build_redash_client(ctx)
+    targets = build_targets(ctx, lambda target, id_store, run_id: DBXClient(
+        target.host, target.token, warehouse_id=target.warehouse_id or warehouse_id, id_store=id_store,
+        run_id=run_id, pool_size=ctx.obj['pool_size'],
+        schedule_planner=build_schedule_planner(stagger_schedules, runtimes_file),
+        router=build_router(routing_rules, redash, warehouse_id)))
+    index_existing(targets, existing)
+    optimizer = build_optimizer(optimize_schema, optimize_passes)
+    quarantine = build_quarantine(continue_on_error, retry_quarantine, quarantine_file, ctx.obj['lease_store'])
 
-    queries_list = redash.queries(tags=list(tags), query_id=query_id)
-    for query in queries_list:
-        if not no_sqlglot:
-            if source_dialect:
-                transform_query(query, source_dialect)
-            else:
-                transform_query(query)
+    if retry_quarantine:
+        query_ids = quarantine.ids('query')
+    else:
+        query_ids = [query_id] if query_id else redash.query_ids(tags=list(tags))
+    if dedup or materialize:
+        collected = collect_queries(redash, source_dialect, no_sqlglot, query_ids=query_ids, optimizer=optimizer)
+        if dedup:
+            apply_dedup(targets, [q for q, _ in collected])
+        if materialize:
+            apply_materialization(redash, targets, collected, materialize, materialize_schema, min_runs_per_day,
+                                  create_views, rewrite_materialized)
+
+    work = WorkQueue(ctx.obj['lease_store'], 'query', query_ids, retry=retry_quarantine)
+    for item_id in work:
+        query = None
         try:
-            dbx_id = dbx.create_query_ex(
-                query,
-                target_folder,
-                should_create_folder=create_folder
-            )
+            query = redash.get_query(item_id)
+            blocking = quarantine.blocking(query) if continue_on_error else None
+            if blocking is not None:
+                block_item(work, item_id, quarantine, blocking)
+                continue
+            if not no_sqlglot:
+                if source_dialect:
+                    transform_query(query, source_dialect, optimizer=optimizer)
+                else:
+                    transform_query(query, optimizer=optimizer)
+
+            def create_query(target, dbx):
+                dbx_id = dbx.create_query_ex(
+                    query,
+                    target.target_folder or target_folder,
+                    should_create_folder=create_folder
+                )
+                if create_schedules and query.schedule:
+                    dbx.create_query_schedule(dbx_id[0], query.schedule,
+                                              dbx.warehouse_for(query, target.warehouse_id or warehouse_id),
+                                              target.run_as or run_as, redash_query_id=query.id)
+                return dbx_id
+
+            work.done(item_id, targets.run(create_query))
+            if quarantine is not None:
+                quarantine.release(work.kind, item_id)
         except Exception as e:
-            traceback.print_tb(e.__traceback__)
-            click.echo(e)
-            raise click.Abort(e)
+            if continue_on_error and query is not None:
+                # dependencies which couldn't be created either
+                for q in query.depends_on:
+                    if any(dbx.read_cache(q.id) is None for _, dbx in targets):
+                        quarantine.mark_failed('query', q.id)
+            fail_item(work, item_id, e, quarantine, continue_on_error)
+    for _, dbx in targets:
+        if dbx.router:
+            click.echo(dbx.router.report())
+    report_optimizations(optimizer, optimize_report)
+    if quarantine is not None:
+        click.echo(quarantine.summary())
 
 
 @cli.command
@@ -130,39 +606,483 @@ def queries(ctx, target_folder, query_id, tags, warehouse_id, run_as, source_dia
 @click.option('--run-as', help='User or the service principle to run the alert job as.', default=None)
 @click.option('--source-dialect', help='Source query SQL dialect', default=None)
 @click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
-def dashboards(ctx, target_folder, dashboard_id, tags, warehouse_id, run_as, source_dialect, no_sqlglot):
+@click.option('--dedup', help='Migrate equivalent queries as a single Databricks query', default=False, is_flag=True)
+@click.option('--routing-rules', help='JSON file of rules routing queries to warehouses', default=None,
+              type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--materialize', help='Write materialized views for hot scheduled queries to this SQL file; the queries '
+                                     'keep their SQL unless the views are created (--create-views)', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+@click.option('--materialize-schema', help='Catalog and schema of the materialized views, eg `main.redash`', default=None)
+@click.option('--min-runs-per-day', help='Minimum refreshes per day of materialized queries', default=24.0, type=float)
+@click.option('--create-views', help='Create the materialized views on the SQL warehouse, and migrate their queries '
+                                     'reading from them', default=False, is_flag=True)
+@click.option('--rewrite-materialized', help='Migrate the materialized queries reading from the views without creating '
+                                             'them (the --materialize file was run beforehand)', default=False, is_flag=True)
+@click.option('--optimize-schema', help='JSON file of table columns and partitions, enables performance rewrites of the queries',
+              default=None, type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-passes', help='Comma separated rewrite passes (unnest, pushdown, partitions, approx, prune)',
+              default=None)
+@click.option('--optimize-report', help='Write the diffs of the rewritten queries to this file', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+@click.option('--existing', help='What to do with objects migrated by previous runs: reuse them (skip), reuse and '
+                                   'update their SQL (update), or migrate them again (duplicate)',
+              type=click.Choice(['skip', 'update', 'duplicate']), default='duplicate')
+@quarantine_options
+def dashboards(ctx, target_folder, dashboard_id, tags, warehouse_id, run_as, source_dialect, no_sqlglot, dedup,
+               routing_rules, materialize, materialize_schema, min_runs_per_day, create_views, rewrite_materialized,
+               optimize_schema, optimize_passes, optimize_report, existing, continue_on_error, retry_quarantine, quarantine_file):
     check_required_options(ctx)
-    from redash import RedashClient
+    if materialize and not materialize_schema:
+        raise click.UsageError("--materialize requires --materialize-schema")
+    if (create_views or rewrite_materialized) and not materialize:
+        raise click.UsageError("--create-views and --rewrite-materialized require --materialize")
+    check_single_target(ctx, '--routing-rules', routing_rules)
     from dbsql import DBXClient
     from transform import transform_query
+    from shard import WorkQueue
 
-    redash = RedashClient(ctx.obj['redash_url'], ctx.obj['redash_api_key'])
-    dbx = DBXClient(ctx.obj['databricks_host'], ctx.obj['databricks_token'])
+    redash = build_redash_client(ctx)
+    targets = build_targets(ctx, lambda target, id_store, run_id: DBXClient(
+        target.host, target.token, warehouse_id=target.warehouse_id, id_store=id_store, run_id=run_id,
+        pool_size=ctx.obj['pool_size'], router=build_router(routing_rules, redash, warehouse_id)))
+    index_existing(targets, existing)
+    optimizer = build_optimizer(optimize_schema, optimize_passes)
+    quarantine = build_quarantine(continue_on_error, retry_quarantine, quarantine_file, ctx.obj['lease_store'])
 
-    if dashboard_id:
-        dashboards_list = [redash.get_dashboard(dashboard_id)]
+    if retry_quarantine:
+        dashboard_ids = quarantine.ids('dashboard')
     else:
-        dashboards_list = redash.dashboards(tags=tags)
-    for dashboard in dashboards_list:
-        if not no_sqlglot:
-            if source_dialect:
-                for widget in dashboard.widgets:
-                    if widget.visualization and widget.query:
-                        transform_query(widget.query, source_dialect)
-            else:
+        dashboard_ids = [dashboard_id] if dashboard_id else redash.dashboard_ids(tags=tags)
+    if dedup or materialize:
+        collected = collect_queries(redash, source_dialect, no_sqlglot, dashboard_ids=dashboard_ids,
+                                    optimizer=optimizer)
+        if dedup:
+            apply_dedup(targets, [q for q, _ in collected])
+        if materialize:
+            apply_materialization(redash, targets, collected, materialize, materialize_schema, min_runs_per_day,
+                                  create_views, rewrite_materialized)
+
+    work = WorkQueue(ctx.obj['lease_store'], 'dashboard', dashboard_ids, retry=retry_quarantine)
+    for item_id in work:
+        try:
+            dashboard = redash.get_dashboard(item_id)
+            if continue_on_error:
+                blocking = next(filter(None, (quarantine.blocking(w.query) for w in dashboard.widgets)), None)
+                if blocking is not None:
+                    block_item(work, item_id, quarantine, blocking)
+                    continue
+            if not no_sqlglot:
+                if source_dialect:
+                    for widget in dashboard.widgets:
+                        if widget.visualization and widget.query:
+                            transform_query(widget.query, source_dialect, optimizer=optimizer)
+                else:
+                    for widget in dashboard.widgets:
+                        if widget.visualization and widget.query:
+                            transform_query(widget.query, optimizer=optimizer)
+
+            def create_dashboard(target, dbx):
+                dbx_id = dbx.create_dashboard_ex(
+                    dashboard,
+                    target.target_folder or target_folder,
+                )
+                click.echo(f"Created dashboard {dbx_id}{targets.label(target)}")
+                return dbx_id
+
+            work.done(item_id, targets.run(create_dashboard))
+            if quarantine is not None:
+                quarantine.release(work.kind, item_id)
+        except Exception as e:
+            fail_item(work, item_id, e, quarantine, continue_on_error)
+    for _, dbx in targets:
+        if dbx.router:
+            click.echo(dbx.router.report())
+    report_optimizations(optimizer, optimize_report)
+    if quarantine is not None:
+        click.echo(quarantine.summary())
+
+
+@cli.command
+@click.pass_context
+@click.argument('output-dir', type=click.Path(file_okay=False, dir_okay=True, writable=True, path_type=str))
+@click.option('--dashboard-id', help='Dashboard ID', default=None)
+@click.option('--tags', help='Tags to filter on', multiple=True, default=None)
+@click.option('--source-dialect', help='Source query SQL dialect', default=None)
+@click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
+@click.option('--upload', 'target_folder', help='Import the dashboard files into this workspace folder', default=None)
+@click.option('--optimize-schema', help='JSON file of table columns and partitions, enables performance rewrites of the queries',
+              default=None, type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-passes', help='Comma separated rewrite passes (unnest, pushdown, partitions, approx, prune)',
+              default=None)
+@click.option('--optimize-report', help='Write the diffs of the rewritten queries to this file', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+def lakeview(ctx, output_dir, dashboard_id, tags, source_dialect, no_sqlglot, target_folder, optimize_schema,
+             optimize_passes, optimize_report):
+    """
+    Writes dashboards as Lakeview dashboard files, and optionally imports them with one call per dashboard
+    """
+    check_required_options(ctx, databricks=bool(target_folder))
+    from lakeview import write_dashboard
+    from transform import transform_query
+    from shard import WorkQueue
+
+    redash = build_redash_client(ctx)
+    optimizer = build_optimizer(optimize_schema, optimize_passes)
+    targets = None
+    if target_folder:
+        from dbsql import DBXClient
+        targets = build_targets(ctx, lambda target, id_store, run_id: DBXClient(
+            target.host, target.token, warehouse_id=target.warehouse_id, id_store=id_store, run_id=run_id,
+            pool_size=ctx.obj['pool_size']))
+        targets.run(lambda target, dbx: dbx.client.workspace.mkdirs(target.target_folder or target_folder))
+
+    dashboard_ids = [dashboard_id] if dashboard_id else redash.dashboard_ids(tags=tags)
+    work = WorkQueue(ctx.obj['lease_store'], 'lakeview', dashboard_ids)
+    for item_id in work:
+        try:
+            dashboard = redash.get_dashboard(item_id)
+            if not no_sqlglot:
                 for widget in dashboard.widgets:
                     if widget.visualization and widget.query:
-                        transform_query(widget.query)
-        try:
-            dbx_id = dbx.create_dashboard_ex(
-                dashboard,
-                target_folder,
-            )
-            click.echo(f"Created dashboard {dbx_id}")
+                        transform_query(widget.query, source_dialect, optimizer)
+            path = write_dashboard(dashboard, output_dir)
+            if targets is None:
+                work.done(item_id, path)
+                click.echo(f"Wrote dashboard {path}")
+                continue
+
+            def import_dashboard(target, dbx):
+                workspace_path = dbx.import_lakeview_dashboard(path, target.target_folder or target_folder)
+                click.echo(f"Imported dashboard {workspace_path}{targets.label(target)}")
+                return workspace_path
+
+            work.done(item_id, targets.run(import_dashboard))
         except Exception as e:
-            traceback.print_tb(e.__traceback__)
-            click.echo(e)
-            raise click.Abort(e)
+            fail_item(work, item_id, e)
+    report_optimizations(optimizer, optimize_report)
+
+
+@cli.command
+@click.pass_context
+@click.argument('output-dir', type=click.Path(file_okay=False, dir_okay=True, writable=True, path_type=str))
+@click.option('--name', help='Name of the bundle', default='redash_migration')
+@click.option('--query-id', help='Query ID', default=None)
+@click.option('--tags', help='Tags to filter on', multiple=True, default=None)
+@click.option('--no-alerts', help='Don\'t export alerts', default=False, is_flag=True)
+@click.option('--no-schedules', help='Don\'t export jobs for scheduled queries', default=False, is_flag=True)
+@click.option('--warehouse-id', help='Default SQL Warehouse ID of the bundle', default=None)
+@click.option('--destination-id', help='Destination ID notified by the alerts', default=None)
+@click.option('--run-as', help='User or the service principle to run the bundle resources as.', default=None)
+@click.option('--root-path', help='Workspace folder the bundle is deployed to', default=None)
+@click.option('--source-dialect', help='Source query SQL dialect', default=None)
+@click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
+@click.option('--stagger-schedules', help='Spread schedules over time to flatten warehouse load', default=False, is_flag=True)
+@click.option('--runtimes-file', help='JSON file of query runtimes in seconds, by Redash query id', default=None,
+              type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-schema', help='JSON file of table columns and partitions, enables performance rewrites of the queries',
+              default=None, type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-passes', help='Comma separated rewrite passes (unnest, pushdown, partitions, approx, prune)',
+              default=None)
+@click.option('--optimize-report', help='Write the diffs of the rewritten queries to this file', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+def bundle(ctx, output_dir, name, query_id, tags, no_alerts, no_schedules, warehouse_id, destination_id, run_as,
+           root_path, source_dialect, no_sqlglot, stagger_schedules, runtimes_file, optimize_schema, optimize_passes,
+           optimize_report):
+    """
+    Writes queries, their schedules and alerts as a Databricks Asset Bundle, instead of creating them
+    """
+    check_required_options(ctx, databricks=False)
+    from bundle import BundleWriter
+    from transform import transform_query
+
+    redash = build_redash_client(ctx)
+    optimizer = build_optimizer(optimize_schema, optimize_passes)
+    writer = BundleWriter(output_dir, name, warehouse_id=warehouse_id, destination_id=destination_id, run_as=run_as,
+                          schedule_planner=build_schedule_planner(stagger_schedules, runtimes_file))
+    # the workspaces of --targets become the deployment targets of the bundle
+    writer.write_config(ctx.obj['targets'], root_path)
+
+    # objects are fetched, transformed and written one at a time
+    query_ids = [query_id] if query_id else redash.query_ids(tags=list(tags))
+    for item_id in query_ids:
+        query = redash.get_query(item_id)
+        if not no_sqlglot:
+            transform_query(query, source_dialect, optimizer)
+        writer.add_query(query, schedule=not no_schedules)
+    if not no_alerts and not query_id:
+        for item_id in redash.alert_ids(tags=tags):
+            alert = redash.get_alert(item_id)
+            if not no_sqlglot:
+                transform_query(alert.query, source_dialect, optimizer)
+            try:
+                writer.add_alert(alert)
+            except ValueError as e:
+                click.echo(f"Skipped alert {item_id}: {e}")
+    writer.close()
+    report_optimizations(optimizer, optimize_report)
+    click.echo(writer.report())
+
+
+@cli.command
+@click.pass_context
+@click.argument('target-folder', type=click.Path(file_okay=False, dir_okay=True, path_type=str))
+@click.option('--tags', help='Tags to filter on', multiple=True, default=None)
+@click.option('--kind', 'kinds', help='Kinds of objects to sync (defaults to all)', multiple=True,
+              type=click.Choice(['query', 'alert', 'dashboard']), default=('query', 'alert', 'dashboard'))
+@click.option('--interval', help='Seconds between polls of Redash', default=300.0, type=click.FloatRange(min=1))
+@click.option('--once', help='Sync the current changes and exit', default=False, is_flag=True)
+@click.option('--state-file', help='JSON file of the synced versions, to resume after a restart',
+              default='sync_state.json', type=click.Path(dir_okay=False, path_type=str))
+@click.option('--metrics-port', help='Port of the Prometheus metrics endpoint (0 disables it)', default=9464, type=int)
+@click.option('--destination-id', help='Destination ID', default=None)
+@click.option('--warehouse-id', help='SQL Warehouse ID', default=None)
+@click.option('--run-as', help='User or the service principle to run the alert job as.', default=None)
+@click.option('--source-dialect', help='Source query SQL dialect', default=None)
+@click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
+@click.option('--optimize-schema', help='JSON file of table columns and partitions, enables performance rewrites of the queries',
+              default=None, type=click.Path(exists=True, dir_okay=False, path_type=str))
+@click.option('--optimize-passes', help='Comma separated rewrite passes (unnest, pushdown, partitions, approx, prune)',
+              default=None)
+@click.option('--existing', help='What to do with objects migrated by other runs (eg the `queries` command): update '
+                                   'them (update), reuse them as they are (skip), or create them again (duplicate)',
+              type=click.Choice(['skip', 'update', 'duplicate']), default='update')
+def sync(ctx, target_folder, tags, kinds, interval, once, state_file, metrics_port, destination_id, warehouse_id,
+         run_as, source_dialect, no_sqlglot, optimize_schema, optimize_passes, existing):
+    """
+    Keeps the workspace in sync with Redash, pushing the objects changed since the last poll
+    """
+    check_required_options(ctx)
+    check_single_target(ctx, 'sync', True)
+    import signal
+    import threading
+    from dbsql import DBXClient
+    from sync import SyncDaemon, serve_metrics
+
+    redash = build_redash_client(ctx)
+    targets = build_targets(ctx, lambda target, id_store, run_id: DBXClient(
+        target.host, target.token, warehouse_id=target.warehouse_id or warehouse_id, id_store=id_store,
+        run_id=run_id, pool_size=ctx.obj['pool_size']))
+    index_existing(targets, existing)
+    daemon = SyncDaemon(redash, targets.clients[0][1], target_folder, interval=interval, tags=list(tags), kinds=kinds,
+                        source_dialect=source_dialect, transform=not no_sqlglot,
+                        optimizer=build_optimizer(optimize_schema, optimize_passes), destination_id=destination_id,
+                        warehouse_id=warehouse_id, run_as=run_as, state_path=state_file)
+    if once:
+        failed = daemon.cycle()
+        click.echo(f"Synced, {failed} objects failed")
+        if failed:
+            raise click.Abort()
+        return
+
+    server = serve_metrics(daemon.metrics, metrics_port) if metrics_port else None
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    click.echo(f"Syncing every {interval:.0f}s" +
+               (f", metrics on http://localhost:{server.server_port}/metrics" if server else ""))
+    try:
+        daemon.run(stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+@cli.command
+@click.pass_context
+@click.argument('output-dir', type=click.Path(file_okay=False, dir_okay=True, writable=True, path_type=str))
+@click.option('--tags', help='Tags to filter on', multiple=True, default=None)
+@click.option('--source-dialect', help='Source query SQL dialect', default=None)
+@click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
+@click.option('--batch-size', help='Rows per Arrow record batch', default=10000, type=click.IntRange(min=1))
+def inventory(ctx, output_dir, tags, source_dialect, no_sqlglot, batch_size):
+    """
+    Writes the queries, dashboards, widgets and alerts, with transform results and timings, as Parquet files
+    """
+    check_required_options(ctx, databricks=False)
+    from inventory import Inventory, InventoryWriter
+
+    try:
+        writer = InventoryWriter(output_dir, batch_size=batch_size)
+    except ImportError as e:
+        raise click.UsageError(str(e))
+    redash = build_redash_client(ctx)
+    collector = Inventory(redash, writer, source_dialect=source_dialect, transform=not no_sqlglot)
+    try:
+        collector.add_queries(redash.query_ids(tags=list(tags)))
+        collector.add_dashboards(redash.dashboard_ids(tags=tags))
+        collector.add_alerts(redash.alert_ids(tags=tags))
+    finally:
+        writer.close()
+    click.echo(writer.report())
+
+
+@cli.command
+@click.pass_context
+@click.argument('output-dir', type=click.Path(file_okay=False, dir_okay=True, writable=True, path_type=str))
+@click.option('--query-id', help='Query ID', multiple=True, type=int)
+@click.option('--tags', help='Tags to filter on', multiple=True, default=None)
+@click.option('--parallel', help='Concurrent downloads (see also --pool-size)', default=4, type=click.IntRange(min=1))
+@click.option('--block-size', help='MiB of CSV converted at a time, per download', default=1, type=click.IntRange(min=1))
+@click.option('--schema', help='Catalog and schema of the Delta tables loaded from the files, eg `main.redash`, '
+                               'writes their COPY INTO statements to OUTPUT_DIR/copy_into.sql', default=None)
+@click.option('--location', help='Location the files are uploaded to for COPY INTO, eg `/Volumes/main/redash/results` '
+                                 '(defaults to OUTPUT_DIR)', default=None)
+def results(ctx, output_dir, query_id, tags, parallel, block_size, schema, location):
+    """
+    Exports the cached results of queries to Parquet files, to load them into Delta tables with COPY INTO
+    """
+    if ctx.obj['snapshot']:
+        raise click.UsageError("Snapshots don't hold query results, results can't be used with --snapshot")
+    check_required_options(ctx, databricks=False)
+    import os
+    from results import ResultExporter, copy_into_statements
+
+    try:
+        exporter = ResultExporter(build_redash_client(ctx), output_dir, parallel=parallel, block_size=block_size << 20)
+    except ImportError as e:
+        raise click.UsageError(str(e))
+    redash = exporter.redash
+    if query_id:
+        queries = [redash.get_query(i) for i in query_id]
+    else:
+        queries = redash.queries(tags=list(tags) or None)
+    exported = exporter.export(queries)
+    for result in exported:
+        if result.ok:
+            click.echo(f"Exported {result.rows} rows of query {result.query.id}"
+                       + (" (as strings)" if result.as_strings else ""))
+        else:
+            click.echo(f"Failed to export the result of query {result.query.id}: {result.error}")
+    if schema:
+        sql_path = os.path.join(output_dir, 'copy_into.sql')
+        with open(sql_path, 'w') as f:
+            f.write(copy_into_statements(exported, location or os.path.abspath(output_dir), schema))
+        click.echo(f"Wrote {sql_path}")
+    if not all(r.ok for r in exported):
+        raise click.Abort()
+
+
+@cli.command
+@click.pass_context
+@click.argument('output', type=click.Path(dir_okay=False, writable=True, path_type=str))
+@click.option('--tags', help='Only snapshot the objects with these tags', multiple=True, default=None)
+def snapshot(ctx, output, tags):
+    """
+    Writes the queries, dashboards and alerts of Redash to an indexed snapshot file, to migrate from with --snapshot
+    """
+    if ctx.obj['snapshot']:
+        raise click.UsageError("snapshot reads from the Redash API, it can't be used with --snapshot")
+    check_required_options(ctx, databricks=False)
+    from snapshot import write_snapshot
+
+    redash = build_redash_client(ctx)
+    writer = write_snapshot(redash.redash, output, list(tags) or None)
+    click.echo(f"Wrote {output}: " + ', '.join(f"{n} {kind}s" for kind, n in writer.counts.items()))
+
+
+@cli.command
+@click.pass_context
+@click.option('--tags', help='Tags to filter on', multiple=True, default=None)
+@click.option('--threshold', help='Minimum estimated similarity of clustered queries', default=0.8, type=click.FloatRange(0, 1))
+@click.option('--num-perm', help='Size of the MinHash signatures', default=128, type=int)
+@click.option('--shingle-size', help='Number of tokens per shingle', default=5, type=int)
+@click.option('--ast', help='Shingle AST paths instead of SQL tokens', default=False, is_flag=True)
+@click.option('--source-dialect', help='Source query SQL dialect', default=None)
+@click.option('--no-sqlglot', help='Disable SQL glot based query transformations', default=False, is_flag=True)
+@click.option('--output', help='Write the report as JSON to this file', default=None,
+              type=click.Path(dir_okay=False, writable=True, path_type=str))
+@click.option('--top', help='Number of clusters to print', default=20, type=int)
+def similar(ctx, tags, threshold, num_perm, shingle_size, ast, source_dialect, no_sqlglot, output, top):
+    """
+    Reports clusters of near-duplicate queries, ranked by the warehouse load consolidating them would save
+    """
+    check_required_options(ctx, databricks=False)
+    import json
+    from transform import transform_query
+    from similarity import SimilarityIndex
+
+    redash = build_redash_client(ctx)
+    index = SimilarityIndex(threshold=threshold, num_perm=num_perm, shingle_size=shingle_size, ast=ast)
+    for query_id in redash.query_ids(tags=list(tags)):
+        query = redash.get_query(query_id)
+        if not no_sqlglot:
+            transform_query(query, source_dialect)
+        index.add(query)
+
+    clusters = index.clusters()
+    click.echo(f"{len(index.queries)} queries, {len(clusters)} clusters of similar queries "
+               f"({sum(len(c.queries) for c in clusters)} queries)")
+    for rank, cluster in enumerate(clusters[:top], start=1):
+        click.echo(f"{rank:>3}. score {cluster.score:.1f}, {len(cluster.queries)} queries, "
+                   f"similarity {cluster.similarity:.2f}, {cluster.runs_per_day:.0f} runs/day")
+        for q in cluster.queries:
+            click.echo(f"       {q.id} `{q.name}`")
+    if output:
+        with open(output, 'w') as f:
+            json.dump([c.as_dict() for c in clusters], f, indent=2)
+
+
+@cli.command
+@click.pass_context
+@click.option('--run', 'run_ids', help='ID of a migration run to roll back', multiple=True)
+@click.option('--tags', help='Roll back the objects migrated with these Redash tags', multiple=True)
+@click.option('--query-id', 'query_ids', help='Roll back a migrated Redash query', multiple=True, type=int)
+@click.option('--dashboard-id', 'dashboard_ids', help='Roll back a migrated Redash dashboard, with the queries (and their '
+                                                      'alerts and jobs) no other migrated dashboard shows',
+              multiple=True, type=int)
+@click.option('--workers', help='Number of concurrent deletions', default=8, type=int)
+@click.option('--rate', help='Maximum deletions per second', default=10.0, type=float)
+@click.option('--dry-run', help='Only list the objects which would be deleted', default=False, is_flag=True)
+@click.option('--yes', help='Don\'t ask for confirmation', default=False, is_flag=True)
+def rollback(ctx, run_ids, tags, query_ids, dashboard_ids, workers, rate, dry_run, yes):
+    """
+    Deletes the jobs, dashboards, alerts and queries migrated by a run, or with given Redash tags or IDs.
+    Alerts don't record their run: they are deleted with their query. Folders created for dashboards are kept.
+    With --targets, the objects are deleted from every workspace of the targets file.
+    """
+    check_required_options(ctx, redash=False)
+    from dbsql import workspace_client
+    from fanout import NamespacedStore, Target
+    from rollback import Teardown, migrated_resources, select_resources
+
+    targets = ctx.obj['targets'] or [Target('default', ctx.obj['databricks_host'], ctx.obj['databricks_token'])]
+    selections = []
+    for target in targets:
+        label = f" in `{target.name}`" if len(targets) > 1 else ""
+        # one keep-alive connection per worker
+        client = workspace_client(target.host, target.token, pool_size=max(workers, ctx.obj['pool_size'] or 0))
+        try:
+            selected = select_resources(migrated_resources(client, workers=workers), run_ids, tags, query_ids,
+                                        dashboard_ids)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        for kind, resources in selected.items():
+            click.echo(f"{len(resources)} {kind}s{label}")
+            if dry_run:
+                for r in resources:
+                    click.echo(f"  {r.id} `{r.name}`" + (f" (Redash {r.redash_id})" if r.redash_id else ""))
+        selections.append((target, client, selected, label))
+    if dry_run or not any(any(selected.values()) for _, _, selected, _ in selections):
+        return
+    if not yes:
+        click.confirm("Delete them?", abort=True)
+
+    lease_store = ctx.obj['lease_store']
+    failed = False
+    for target, client, selected, label in selections:
+        teardown = Teardown(client, workers=workers, rate=rate)
+        teardown.run(selected)
+        if lease_store is not None:
+            # the id maps of several targets are kept apart, as in `build_targets`
+            id_store = NamespacedStore(lease_store, target.name) if len(targets) > 1 else lease_store
+            for resource in teardown.deleted:
+                if resource.kind in ('query', 'dashboard') and resource.redash_id is not None:
+                    id_store.forget(resource.kind, resource.redash_id)
+        click.echo(teardown.report() + label)
+        failed = failed or bool(teardown.failed)
+    if failed:
+        raise click.Abort()
 
 
 def main():
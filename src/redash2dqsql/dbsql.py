@@ -1,20 +1,30 @@
 from __future__ import annotations
 
+import base64
+import json
+import os
+import time
 from datetime import datetime
 from typing import Any
 
-from databricks.sdk import WorkspaceClient, DashboardsAPI, QueriesAPI, QueryVisualizationsAPI, DashboardWidgetsAPI
+from databricks.sdk import WorkspaceClient
+from databricks.sdk.config import Config
 from databricks.sdk.service.sql import (
     RunAsRole,
+    StatementState,
     WidgetOptions,
 )
 from databricks.sdk.service.jobs import (
     CronSchedule,
+    JobSettings,
+    PauseStatus,
     SqlTask,
     Task,
     SqlTaskAlert,
     SqlTaskSubscription,
     JobRunAs, SqlTaskQuery,
+    TaskDependency,
+    RunIf,
 )
 from databricks.sdk.service.sql import (
     QueryOptions,
@@ -22,20 +32,32 @@ from databricks.sdk.service.sql import (
     ParameterType,
     AlertOptions,
 )
-from databricks.sdk.service.workspace import ObjectType
+from databricks.sdk.service.workspace import ImportFormat, ObjectType
 
 from redash import Query, Alert, Dashboard
+from schedule import quartz_expression
+from profiling import phase
 from redash2dqsql.hlog import LOGGER
 
 
-class DBXClient:
-    def __init__(self, url, token, warehouse_id=None):
-        self.client = WorkspaceClient(host=url, token=token)
+def workspace_client(url, token, pool_size: int | None = None) -> WorkspaceClient:
+    """
+    Creates a workspace client, keeping up to `pool_size` keep-alive connections to the workspace
+    (the client can be shared by that many threads without opening new connections)
+    """
+    if not pool_size:
+        return WorkspaceClient(host=url, token=token)
+    # the SDK swaps the two settings when building its HTTP adapter, so both are set
+    return WorkspaceClient(config=Config(host=url, token=token, max_connection_pools=pool_size,
+                                         max_connections_per_pool=pool_size))
+
 
-        self.dashboard_api = DashboardsAPI(self.client)
-        self.queries_api = QueriesAPI(self.client)
-        self.query_visualizations_api = QueryVisualizationsAPI(self.client)
-        self.dashboard_widgets_api = DashboardWidgetsAPI(self.client)
+class DBXClient:
+    def __init__(self, url, token, warehouse_id=None, id_store=None, max_alerts_per_job=None, schedule_planner=None,
+                 router=None, index=None, update_existing=False, run_id=None, pool_size=None):
+        self.client = workspace_client(url, token, pool_size)
+        # recorded on every migrated object, so that a run can be rolled back (see rollback.py)
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d-%H%M%S')
 
         if not warehouse_id:
             warehouse = list(self.client.data_sources.list())[0]
@@ -45,6 +67,21 @@ class DBXClient:
 
         # TODO: ideally this should be external eg a Delta table
         self.cache: dict[int, tuple[str, dict[int, str]]] = dict()
+        # optional store shared between workers (see shard.LeaseStore), backing the in-memory cache
+        self.id_store = id_store
+        # duplicate Redash queries, migrated as their canonical query (see dedup.merge_duplicates)
+        self.aliases: dict[int, Query] = dict()
+        # when set, alert schedules are batched into shared jobs of up to this many tasks (see flush_alert_schedules)
+        self.max_alerts_per_job = max_alerts_per_job
+        self.pending_alert_schedules: dict[tuple, list[tuple[Alert, str]]] = dict()
+        # optional schedule.SchedulePlanner staggering the migrated schedules
+        self.schedule_planner = schedule_planner
+        # optional routing.WarehouseRouter, assigning queries to warehouses instead of `warehouse_id`
+        self.router = router
+        # optional workspace_index.WorkspaceIndex of the objects migrated by previous runs, which are reused
+        # (and, for queries, updated with `update_existing`) instead of being created again
+        self.index = index
+        self.update_existing = update_existing
 
     def get_query(self, id: str):
         return self.client.queries.get(id)
@@ -56,20 +93,27 @@ class DBXClient:
         If the query depends on other queries (see https://docs.databricks.com/en/sql/user/queries/query-parameters.html#query-based-dropdown-list),
         those dependencies are created first.
 
-        Also, caches mapping of migrated queries to enable re-use
+        Also, caches mapping of migrated queries to enable re-use.
+        Duplicate queries registered with `alias_query` resolve to their canonical query, and queries migrated
+        by a previous run (see `index`) are reused.
         """
+        query = self.aliases.get(query.id, query)
         for q in query.depends_on:
             self.create_query(q, target_folder)
 
         cached_data = self.read_cache(query.id)
         if cached_data:
-            return cached_data
+            return self._complete_visualizations(query, cached_data)
+
+        indexed = self.index.query(query.id) if self.index else None
+        if indexed:
+            return self._reuse_query(query, indexed)
 
         # currently, API doesn't support attaching tags!
         created = self.client.queries.create(
             name=query.name,
-            data_source_id=self.warehouse_id,
-            description=f"Migrated from Redash on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, tags: {','.join(query.tags)}",
+            data_source_id=self.warehouse_for(query, self.warehouse_id),
+            description=self._query_description(query),
             query=query.query_string,
             parent=target_folder,
             options=self._build_options(query),
@@ -84,22 +128,101 @@ class DBXClient:
         self.update_cache(query.id, (created.id, viz_id_map))
         return created.id, viz_id_map
 
+    def _query_description(self, query: Query) -> str:
+        """
+        Description of a migrated query, carrying its provenance (see `workspace_index.WorkspaceIndex`)
+        """
+        return (f"Migrated from Redash on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, "
+                f"original_id:{query.id}, run_id:{self.run_id}, tags: {','.join(query.tags)}")
+
+    def _reuse_query(self, query: Query, indexed) -> tuple[str, dict[int, str]]:
+        """
+        Maps a query to the Databricks query of a previous run, updating it if asked to.
+        Visualizations are matched by name and type; missing ones are created.
+        """
+        if self.update_existing:
+            self._update_query_api_call(indexed.id, query)
+        viz_id_map = {}
+        for v in query.visualizations:
+            viz_id = indexed.visualizations.get((v.name, v.type.value))
+            if viz_id is None:
+                viz_id = self.create_visualization(indexed.id, v.type.value, self._update_visualization_options(v.options),
+                                                   v.description, v.name)
+            viz_id_map[v.id] = viz_id
+        self.update_cache(query.id, (indexed.id, viz_id_map))
+        return indexed.id, viz_id_map
+
+    @phase('create')
+    def update_query(self, query: Query, target_folder: str) -> tuple[str, dict[int, str]]:
+        """
+        Updates the Databricks query of a query migrated before, creating the visualizations it lacks,
+        or creates it if it wasn't migrated yet
+        """
+        cached = self.read_cache(query.id)
+        if cached is None:
+            return self.create_query_ex(query, target_folder)
+
+        self._update_query_api_call(cached[0], query)
+        return self._complete_visualizations(query, cached)
+
+    def _complete_visualizations(self, query: Query, cached: tuple[str, dict[int, str]]) -> tuple[str, dict[int, str]]:
+        """
+        Creates the visualizations of a migrated query which its cached mapping lacks,
+        e.g. the ones `dedup.merge_duplicates` moved onto it after it was migrated
+        """
+        dbx_id, viz_id_map = cached[0], dict(cached[1])
+        missing = [v for v in query.visualizations if v.id not in viz_id_map]
+        if not missing:
+            return cached
+        for v in missing:
+            viz_id_map[v.id] = self.create_visualization(dbx_id, v.type.value,
+                                                         self._update_visualization_options(v.options),
+                                                         v.description, v.name)
+        self.update_cache(query.id, (dbx_id, viz_id_map))
+        return dbx_id, viz_id_map
+
+    def _update_query_api_call(self, dbx_id: str, query: Query):
+        self.client.queries.update(
+            dbx_id,
+            name=query.name,
+            data_source_id=self.warehouse_for(query, self.warehouse_id),
+            description=self._query_description(query),
+            query=query.query_string,
+            options=self._build_options(query),
+        )
+
+    def alias_query(self, redash_id: int, canonical: Query):
+        """
+        Migrates the given Redash query as the (equivalent) canonical query
+        """
+        self.aliases[redash_id] = canonical
+
     def _update_visualization_options(self, options: dict) -> dict:
         """
         Updates visualization options to match Databricks API
         """
         return options
 
-    def create_query_schedule(self, query_id: str, schedule: dict, warehouse_id: str, run_as: str | None = None):
+    def create_query_schedule(self, query_id: str, schedule: dict, warehouse_id: str, run_as: str | None = None,
+                              runtime: float | None = None, redash_query_id: int | None = None):
         """
-        Creates a Databricks query schedule
+        Creates a Databricks query schedule.
+        The runtime (in seconds) of the query, or its Redash id to look it up, helps staggering schedules.
+        The Redash id is also recorded as provenance, so that a schedule migrated by a previous run is reused.
         """
+        if self.index and redash_query_id in self.index.query_jobs:
+            return self.index.query_jobs[redash_query_id]
+
+        tags = {"migrated_from_redash": "true", "run_id": self.run_id}
+        if redash_query_id is not None:
+            tags["original_id"] = str(redash_query_id)
         run_as_obj = self.create_job_run_as(run_as)
         response = self.client.jobs.create(
             name=f"Query `{query_id}` schedule",
             description=f"Schedule for query `{query_id}` with warehouse `{warehouse_id}`",
-            schedule=self._create_cron_schedule(schedule),
+            schedule=self._create_cron_schedule(schedule, runtime, redash_query_id),
             run_as=run_as_obj,
+            tags=tags,
             tasks=[
                 Task(
                     task_key="sql",
@@ -111,9 +234,29 @@ class DBXClient:
             ],
         )
         if response:
+            if self.index is not None and redash_query_id is not None:
+                self.index.query_jobs[redash_query_id] = response.job_id
             return response.job_id
         return None
 
+    def update_query_schedule(self, query: Query) -> int | None:
+        """
+        Applies the (changed) Redash schedule of a migrated query to the job refreshing it (see
+        `create_query_schedule`), found through the index. The job is paused when the query isn't scheduled anymore.
+
+        :return: ID of the job refreshing the query, if any
+        """
+        job_id = self.index.query_jobs.get(query.id) if self.index else None
+        if job_id is None:
+            return None
+        if query.schedule:
+            schedule = self._create_cron_schedule(query.schedule, query_id=query.id)
+        else:
+            schedule = self.client.jobs.get(job_id).settings.schedule
+            schedule.pause_status = PauseStatus.PAUSED
+        self.client.jobs.update(job_id, new_settings=JobSettings(schedule=schedule))
+        return job_id
+
     def create_dashboard(
         self,
         dashboard_name: str,
@@ -275,18 +418,33 @@ class DBXClient:
         # Call the get_dashboard API
         return self.client.dashboards.get(dashboard_id)
 
+    def warehouse_for(self, query: Query, warehouse_id: str | None = None) -> str | None:
+        """
+        Returns the warehouse a query (and its schedule or alerts) runs on: the routed one when queries are
+        routed, otherwise `warehouse_id`
+        """
+        return self.router.route(query) if self.router else warehouse_id
+
     def read_cache(self, redash_query_id: int) -> tuple[str, dict[int, str]] | None:
         """
         Looks up a cache to see if this query has been already migrated
         """
 
-        return self.cache.get(redash_query_id)
+        cached = self.cache.get(redash_query_id)
+        if cached is None and self.id_store is not None:
+            stored = self.id_store.read_mapping('query', redash_query_id)
+            if stored:
+                cached = (stored[0], {int(k): v for k, v in stored[1].items()})
+                self.cache[redash_query_id] = cached
+        return cached
 
     def update_cache(self, redash_id: int, dbx_data: tuple[str, dict[int, str]]):
         """
         Update the cache, so we can find the ID later
         """
         self.cache[redash_id] = dbx_data
+        if self.id_store is not None:
+            self.id_store.write_mapping('query', redash_id, dbx_data)
 
     def _build_options(self, query) -> dict:
         """
@@ -315,6 +473,7 @@ class DBXClient:
             ]
         ).as_dict()
 
+    @phase('create')
     def create_alert(
         self,
         alert: Alert,
@@ -336,17 +495,171 @@ class DBXClient:
         target_folder_path = f"folders/{self.get_path_object_id(target_folder)}"
 
         query = alert.query
+        warehouse_id = self.warehouse_for(query, warehouse_id)
 
         # We always create the query irrespective of whether it is cached or not to keep it as a dedicated resource
         # for the alert
         query_id = self.create_query(query, target_folder_path)[0]
 
-        result = self._create_alert_api_call(query_id, alert, target_folder_path)
-        if alert.schedule and destination_id and warehouse_id:
-            self._create_alert_schedule_api_call(
-                alert, result.id, destination_id, warehouse_id, run_as
-            )
-        return result.id
+        alert_id = self._existing_alert(query_id, alert) or \
+            self._create_alert_api_call(query_id, alert, target_folder_path).id
+        if alert.schedule and destination_id and warehouse_id and not self._is_scheduled(alert_id):
+            if self.max_alerts_per_job:
+                self._queue_alert_schedules([(alert, alert_id)], destination_id, warehouse_id, run_as)
+            else:
+                self._create_alert_schedule_api_call(
+                    alert, alert_id, destination_id, warehouse_id, run_as
+                )
+        return alert_id
+
+    @phase('create')
+    def update_alert(self, alert: Alert, alert_id: str, target_folder: str) -> str:
+        """
+        Updates a Databricks alert (and its query) after the Redash alert changed
+        """
+        query_id = self.update_query(alert.query, target_folder)[0]
+        self.client.alerts.update(
+            alert_id,
+            name=alert.name,
+            options=AlertOptions.from_dict(self._sanitize_alert_options(alert.options)),
+            query_id=query_id,
+            rearm=alert.rearm,
+        )
+        return alert_id
+
+    @phase('create')
+    def update_alert_schedule(self, alert: Alert, alert_id: str, destination_id: str | None = None,
+                              warehouse_id: str | None = None, run_as: str | None = None) -> int | None:
+        """
+        Applies the (changed) Redash schedule of a migrated alert to the job evaluating it, found through the index.
+        A job evaluating only this alert is rescheduled (or deleted if the alert isn't scheduled anymore);
+        a batched job shared with other alerts drops the task of the alert, which gets a job of its own.
+
+        :return: ID of the job evaluating the alert, if any
+        """
+        if self.index is None:
+            return None
+        job_id = self.index.alert_jobs.get(alert_id)
+        if job_id is not None:
+            settings = self.client.jobs.get(job_id).settings
+            if all(t.sql_task.alert.alert_id == alert_id for t in settings.tasks if t.sql_task and t.sql_task.alert):
+                if alert.schedule:
+                    self.client.jobs.update(job_id, new_settings=JobSettings(
+                        schedule=self._create_cron_schedule(alert.schedule, query_id=alert.query.id)
+                    ))
+                    return job_id
+                self.client.jobs.delete(job_id)
+            else:
+                self._remove_alert_task(job_id, settings, alert_id)
+            del self.index.alert_jobs[alert_id]
+
+        warehouse_id = self.warehouse_for(alert.query, warehouse_id)
+        if not (alert.schedule and destination_id and warehouse_id):
+            return None
+        return self._create_alert_schedule_api_call(alert, alert_id, destination_id, warehouse_id, run_as).job_id
+
+    def _remove_alert_task(self, job_id: int, settings: JobSettings, alert_id: str):
+        """
+        Removes the task of an alert from a batched alert job, chaining the tasks which ran after it
+        to the task it ran after, and dropping it from the `alert_id` tag of the job
+        """
+        removed = next(t for t in settings.tasks if t.sql_task and t.sql_task.alert
+                       and t.sql_task.alert.alert_id == alert_id)
+        relinked = []
+        for task in settings.tasks:
+            if any(d.task_key == removed.task_key for d in task.depends_on or []):
+                task.depends_on = removed.depends_on
+                task.run_if = removed.run_if
+                relinked.append(task)
+        tags = dict(settings.tags or {})
+        if tags.get('alert_id'):
+            tags['alert_id'] = ','.join(i for i in tags['alert_id'].split(',') if i != alert_id)
+        self.client.jobs.update(job_id, fields_to_remove=[f"tasks/{removed.task_key}"],
+                                new_settings=JobSettings(tags=tags, tasks=relinked or None))
+
+    @phase('create')
+    def create_alert_group(
+        self,
+        alerts: list[Alert],
+        target_folder: str,
+        destination_id: str | None = None,
+        warehouse_id: str | None = None,
+        run_as: str | None = None,
+    ) -> dict[int, str]:
+        """
+        Given Redash alerts on the same query, creates one shared Databricks query and attaches every alert to it.
+        Alerts with the same schedule are evaluated by a single job (see `_create_alerts_schedule_api_call`).
+
+        :param alerts: Redash alert models, all on the same Redash query
+        :param target_folder: target folder to create the query and alerts in
+        :param destination_id: optional ID of the destination if schedule is set
+        :param warehouse_id: optional ID of the SQL warehouse to refresh query
+        :param run_as: optional user or service principle to run the alert jobs as
+        :return: Databricks alert IDs, by Redash alert ID
+        """
+        if len({a.query.id for a in alerts}) > 1:
+            raise ValueError("Alerts of a group must share the same query")
+
+        target_folder_path = f"folders/{self.get_path_object_id(target_folder)}"
+        warehouse_id = self.warehouse_for(alerts[0].query, warehouse_id)
+        query_id = self.create_query(alerts[0].query, target_folder_path)[0]
+
+        created = {}
+        by_schedule: dict[str, list[tuple[Alert, str]]] = {}
+        for alert in alerts:
+            created[alert.id] = self._existing_alert(query_id, alert) or \
+                self._create_alert_api_call(query_id, alert, target_folder_path).id
+            if alert.schedule and not self._is_scheduled(created[alert.id]):
+                key = json.dumps(alert.schedule, sort_keys=True)
+                by_schedule.setdefault(key, []).append((alert, created[alert.id]))
+
+        if destination_id and warehouse_id:
+            for scheduled in by_schedule.values():
+                if self.max_alerts_per_job:
+                    self._queue_alert_schedules(scheduled, destination_id, warehouse_id, run_as)
+                else:
+                    self._create_alerts_schedule_api_call(scheduled, destination_id, warehouse_id, run_as)
+        return created
+
+    def _existing_alert(self, query_id: str, alert: Alert) -> str | None:
+        """
+        Returns the ID of the Databricks alert a previous run created for this alert, if any
+        """
+        return self.index.alert(query_id, alert.name) if self.index else None
+
+    def _is_scheduled(self, alert_id: str) -> bool:
+        return self.index is not None and alert_id in self.index.alert_jobs
+
+    def _queue_alert_schedules(self, alerts: list[tuple[Alert, str]], destination_id: str, warehouse_id: str,
+                               run_as: str | None = None):
+        """
+        Defers the creation of alert schedules until `flush_alert_schedules`
+        """
+        key = (json.dumps(alerts[0][0].schedule, sort_keys=True), destination_id, warehouse_id, run_as)
+        self.pending_alert_schedules.setdefault(key, []).extend(alerts)
+
+    def flush_alert_schedules(self) -> list[int]:
+        """
+        Creates jobs for the queued alert schedules: alerts sharing a schedule, destination, warehouse and run-as
+        identity are batched into multi-task jobs of up to `max_alerts_per_job` tasks, so that they wake up the
+        warehouse together instead of in hundreds of separate job runs.
+
+        :return: IDs of the created jobs
+        """
+        job_ids = []
+        while self.pending_alert_schedules:
+            key, alerts = next(iter(self.pending_alert_schedules.items()))
+            _, destination_id, warehouse_id, run_as = key
+            batch_size = self.max_alerts_per_job or len(alerts)
+            while alerts:
+                created = self._create_alerts_schedule_api_call(
+                    alerts[:batch_size], destination_id, warehouse_id, run_as
+                )
+                # only forget the alerts once their job exists, so a failed flush can be retried
+                del alerts[:batch_size]
+                job_ids.append(created.job_id)
+            del self.pending_alert_schedules[key]
+        return job_ids
 
     def _create_alert_api_call(self, query_id: str, alert: Alert, parent_folder: str):
         """
@@ -396,73 +709,101 @@ class DBXClient:
         """
         Creates an alert schedule in Databricks
         """
+        return self._create_alerts_schedule_api_call(
+            [(alert, alert_id)], destination_id, warehouse_id, run_as, tags
+        )
+
+    def _create_alerts_schedule_api_call(
+        self,
+        alerts: list[tuple[Alert, str]],
+        destination_id: str,
+        warehouse_id: str,
+        run_as: str | None = None,
+        tags: dict[str, str] = None,
+    ):
+        """
+        Creates a Databricks job evaluating one or more alerts sharing the same schedule.
+
+        The alerts are given as (Redash alert, Databricks alert ID) pairs. Tasks of alerts on the same query
+        run one after the other, so that they are served from the warehouse result cache after the first evaluation
+        instead of each executing the query; alerts on different queries run in parallel.
+        """
 
         run_as_obj = self.create_job_run_as(run_as)
+        first_alert, first_alert_id = alerts[0]
+        alert_ids = [alert_id for _, alert_id in alerts]
 
         tags_clone = dict()
         if tags:
             tags_clone.update(tags)
-        if alert.query.tags:
-            tags_clone.update(alert.query.tags)
+        for alert, _ in alerts:
+            # Redash tags have no value
+            tags_clone.update({t: "" for t in alert.query.tags})
         tags_clone["type"] = "alert"
-        tags_clone["alert_id"] = alert_id
+        if len(",".join(alert_ids)) <= 255:  # job tag values are limited in size, tasks list all the alerts anyway
+            tags_clone["alert_id"] = ",".join(alert_ids)
         tags_clone["destination_id"] = destination_id
         tags_clone["warehouse_id"] = warehouse_id
         tags_clone["migrated_from_redash"] = "true"
+        tags_clone["run_id"] = self.run_id
+
+        if len(alerts) == 1:
+            name = f"Alert `{first_alert.name}` schedule"
+            description = f"Schedule for alert `{first_alert.name}` ({first_alert_id}) with destination `{destination_id}`"
+        elif len({alert.query.id for alert, _ in alerts}) == 1:
+            name = f"Alerts on query `{first_alert.query.name}` schedule"
+            description = (f"Schedule for {len(alerts)} alerts on query `{first_alert.query.name}` "
+                           f"({', '.join(alert_ids)}) with destination `{destination_id}`")
+        else:
+            name = f"Alerts `{first_alert.name}` and {len(alerts) - 1} more schedule"
+            description = (f"Schedule for {len(alerts)} alerts ({', '.join(alert_ids)}) "
+                           f"with destination `{destination_id}`")
+
+        tasks = []
+        last_task_of_query: dict[int, str] = {}
+        for i, (alert, alert_id) in enumerate(alerts):
+            task_key = "alert" if len(alerts) == 1 else f"alert_{i}"
+            previous = last_task_of_query.get(alert.query.id)
+            last_task_of_query[alert.query.id] = task_key
+            tasks.append(Task(
+                task_key=task_key,
+                depends_on=[TaskDependency(task_key=previous)] if previous else None,
+                run_if=RunIf.ALL_DONE if previous else None,
+                sql_task=SqlTask(
+                    alert=SqlTaskAlert(
+                        alert_id=alert_id,
+                        subscriptions=[
+                            SqlTaskSubscription(destination_id=destination_id)
+                        ],
+                    ),
+                    warehouse_id=warehouse_id,
+                ),
+            ))
 
-        return self.client.jobs.create(
-            name=f"Alert `{alert.name}` schedule",
-            description=f"Schedule for alert `{alert.name}` ({alert_id}) with destination `{destination_id}`",
-            schedule=self._create_cron_schedule(alert.schedule),
+        created = self.client.jobs.create(
+            name=name,
+            description=description,
+            schedule=self._create_cron_schedule(first_alert.schedule, query_id=first_alert.query.id),
             run_as=run_as_obj,
             tags=tags_clone,
-            tasks=[
-                Task(
-                    task_key="alert",
-                    sql_task=SqlTask(
-                        alert=SqlTaskAlert(
-                            alert_id=alert_id,
-                            subscriptions=[
-                                SqlTaskSubscription(destination_id=destination_id)
-                            ],
-                        ),
-                        warehouse_id=warehouse_id,
-                    ),
-                )
-            ],
+            tasks=tasks,
         )
+        if self.index is not None:
+            for alert_id in alert_ids:
+                self.index.alert_jobs[alert_id] = created.job_id
+        return created
 
-    def _create_cron_schedule(self, schedule: dict) -> CronSchedule:
-        """
-        Creates a cron schedule from Redash schedule
-        """
-        if schedule["interval"]:
-            quarts_expression = self._build_quartz_expression(schedule["interval"])
-            return CronSchedule(
-                quartz_cron_expression=quarts_expression, timezone_id="UTC"
-            )
-        raise ValueError("Only interval-based schedules are supported")
-
-    def _build_quartz_expression(self, interval: int) -> str:
-        """
-        Builds a quartz expression from an interval
-        """
-        if interval < 60:
-            seconds = f"*/{interval}"
-            minutes = "*"
-            hours = "*"
-        elif interval < 3600:
-            seconds = f"{interval % 60}"
-            minutes = f"*/{interval // 60}"
-            hours = "*"
-        elif interval < 86400:
-            seconds = f"{interval % 60}"
-            minutes = f"{(interval // 60) % 60}"
-            hours = f"*/{(interval // 60) // 60}"
-        else:
-            raise ValueError("Interval is too large")
-
-        return f"{seconds} {minutes} {hours} ? * * *"
+    def _create_cron_schedule(self, schedule: dict, runtime: float | None = None,
+                              query_id: int | None = None) -> CronSchedule:
+        """
+        Creates a cron schedule from Redash schedule.
+        With a schedule planner, interval schedules are staggered according to the runtime of the query
+        (given, or known to the planner by Redash query id).
+        """
+        return CronSchedule(
+            quartz_cron_expression=quartz_expression(schedule, self.schedule_planner, runtime, query_id),
+            timezone_id="UTC"
+        )
 
     def get_path_object_id(self, path: str) -> int:
         """
@@ -490,6 +831,29 @@ class DBXClient:
         else:
             return None
 
+    def execute_statement(self, statement: str, warehouse_id: str | None = None, timeout: float = 3600,
+                          poll_interval: float = 10) -> str:
+        """
+        Runs a SQL statement (eg DDL) on a SQL warehouse, and waits for it to finish
+
+        :return: ID of the statement
+        :raises ValueError: if the statement failed, or didn't finish within `timeout` seconds (it is then canceled)
+        """
+        api = self.client.statement_execution
+        response = api.execute_statement(statement, warehouse_id or self.warehouse_id, wait_timeout='50s')
+        deadline = time.monotonic() + timeout
+        while response.status.state in (StatementState.PENDING, StatementState.RUNNING):
+            if time.monotonic() > deadline:
+                api.cancel_execution(response.statement_id)
+                raise ValueError(f"Statement {response.statement_id} didn't finish within {timeout:.0f}s")
+            time.sleep(poll_interval)
+            response = api.get_statement(response.statement_id)
+        if response.status.state != StatementState.SUCCEEDED:
+            error = response.status.error
+            raise ValueError(f"Statement {response.statement_id} {response.status.state.value.lower()}: "
+                             f"{error.message if error else 'no details'}")
+        return response.statement_id
+
     def create_directory(self, path: str) -> int:
         """
         Creates a directory in the workspace
@@ -497,7 +861,21 @@ class DBXClient:
         self.client.workspace.mkdirs(path)
         return self.get_path_object_id(path)
 
+    def import_lakeview_dashboard(self, path: str, target_folder: str) -> str:
+        """
+        Imports a Lakeview dashboard file (see `lakeview.write_dashboard`) into an existing workspace folder with a
+        single call, replacing the dashboard of a previous import
+
+        :return: workspace path of the dashboard
+        """
+        workspace_path = f"{target_folder.rstrip('/')}/{os.path.basename(path)}"
+        with open(path, 'rb') as f:
+            content = base64.b64encode(f.read()).decode()
+        self.client.workspace.import_(workspace_path, content=content, format=ImportFormat.AUTO, overwrite=True)
+        return workspace_path
 
+
+    @phase('create')
     def create_dashboard_ex(self, dashboard: Dashboard, target_folder: str, run_as_role: str = "viewer", tags: list[str] = None, is_favorite: bool = False, dashboard_filters_enabled: bool = True) -> str:
         """
         Create a Databricks dashboard using a Redash dashboard object.
@@ -518,6 +896,11 @@ class DBXClient:
             ApiException: If there is an error calling the Databricks API.
         """
 
+        existing_id = self.index.dashboard(dashboard.id) if self.index else None
+        if existing_id:
+            LOGGER.info(f"Dashboard `{dashboard.name}` was already migrated as {existing_id}")
+            return existing_id
+
         name_slug = dashboard.name.replace(" ", "_").lower()
         dashboard_folder = f"{target_folder}/{name_slug}"
         dashboard_folder_id = self.create_directory(dashboard_folder)
@@ -528,7 +911,7 @@ class DBXClient:
         created_dashboard = self.client.dashboards.create(
             name=dashboard.name,
             parent=f"folders/{dashboard_folder_id}",
-            tags=["migrated_from_redash", "original_id:" + str(dashboard.id), *dashboard.tags],
+            tags=["migrated_from_redash", "original_id:" + str(dashboard.id), "run_id:" + self.run_id, *dashboard.tags],
             dashboard_filters_enabled=dashboard.dashboard_filters_enabled,
         )
 
@@ -551,7 +934,9 @@ class DBXClient:
                     width=widget.width,
                     title=widget.visualization.name,
                 )
+        return created_dashboard.id
 
+    @phase('create')
     def create_query_ex(self, query: Query, target_folder: str, should_create_folder: bool = None) -> (str, dict[int, str]):
         """
         Given a Query model, creates a Databricks query at the target location.
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+
+import sqlglot.errors
+from sqlglot import exp, parse_one
+from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+from sqlglot.optimizer.scope import traverse_scope
+
+from redash import Query
+from transform import TARGET_DIALECT, mask_query_params
+
+_QUOTED = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)""")
+
+
+@dataclass
+class DuplicateGroup:
+    fingerprint: str
+    canonical: Query
+    duplicates: list[Query] = field(default_factory=list)
+
+    @property
+    def runs_per_day_saved(self) -> float:
+        return sum(q.runs_per_day for q in self.duplicates)
+
+
+@dataclass
+class DedupReport:
+    total: int
+    groups: list[DuplicateGroup]
+
+    @property
+    def removed(self) -> int:
+        return sum(len(g.duplicates) for g in self.groups)
+
+    @property
+    def runs_per_day_saved(self) -> float:
+        return sum(g.runs_per_day_saved for g in self.groups)
+
+    def summary(self) -> str:
+        lines = [
+            f"{self.total} queries, {self.total - self.removed} unique, {self.removed} duplicates "
+            f"in {len(self.groups)} groups; {self.runs_per_day_saved:.0f} scheduled executions/day removed"
+        ]
+        for g in self.groups:
+            lines.append(f"  {g.canonical.id} `{g.canonical.name}` <- {', '.join(str(q.id) for q in g.duplicates)}")
+        return '\n'.join(lines)
+
+
+def normalize_sql(sql: str, dialect=TARGET_DIALECT) -> str:
+    """
+    Normalizes a query so that copies differing only in whitespace, comments, casing or table aliases are equal:
+        1. params are masked, comments dropped and unquoted identifiers lower-cased
+        2. single-table scopes drop their table alias and column qualifiers
+        3. other table and subquery aliases are renamed to positional names (`_t0`, `_t1`, ...)
+    Queries which can't be parsed are only normalized for whitespace and casing outside of quotes.
+    """
+    masked, _ = mask_query_params(sql.strip().rstrip(';'))
+    try:
+        tree = parse_one(masked, read=dialect)
+    except sqlglot.errors.SqlglotError:
+        parts = _QUOTED.split(masked)
+        # odd parts are quoted: literals and quoted identifiers keep their case and whitespace
+        return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part).lower() for i, part in enumerate(parts)).strip()
+    if tree is None:
+        return ''
+
+    tree = normalize_identifiers(tree, dialect=dialect)
+
+    # in a scope selecting from a single table, `t.col` and `col` are the same column
+    for scope in traverse_scope(tree):
+        if len(scope.sources) != 1:
+            continue
+        name, source = next(iter(scope.sources.items()))
+        if not isinstance(source, exp.Table):
+            continue
+        for column in scope.columns:
+            if column.table == name:
+                column.set('table', None)
+        source.set('alias', None)
+
+    aliases = {}
+    for node in tree.find_all(exp.Table, exp.Subquery):
+        alias = node.args.get('alias')
+        if alias is not None and alias.name and alias.name not in aliases:
+            aliases[alias.name] = f"_t{len(aliases)}"
+
+    def rename(node):
+        if isinstance(node, exp.TableAlias) and node.name in aliases:
+            node.set('this', exp.to_identifier(aliases[node.name]))
+        elif isinstance(node, exp.Column) and node.table in aliases:
+            node.set('table', exp.to_identifier(aliases[node.table]))
+        return node
+
+    return tree.transform(rename).sql(dialect=dialect, comments=False)
+
+
+def fingerprint(query: Query, dialect=TARGET_DIALECT) -> str:
+    """
+    Fingerprints a (transformed) query by its data source, normalized AST and parameter signature.
+    Params are masked by position, so the names of the params, in the order they appear, are part of it too:
+    `x = {{a}} and y = {{b}}` and `x = {{b}} and y = {{a}}` filter differently.
+    The default value and options of the params are part of the signature, as they change what the query returns.
+    """
+    signature = sorted(
+        ((p['name'], p.get('type'), p.get('queryId'), p.get('value'), p.get('enumOptions'))
+         for p in query.options.get('parameters', [])),
+        key=lambda p: p[0],
+    )
+    _, mapping = mask_query_params(query.query_string)
+    source = query.source.id if query.source else None
+    payload = json.dumps([source, normalize_sql(query.query_string, dialect), list(mapping.values()), signature],
+                         default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def find_duplicates(queries: list[Query], dialect=TARGET_DIALECT) -> DedupReport:
+    """
+    Groups equivalent queries; the query with the lowest id of each group is its canonical query
+    """
+    by_fingerprint: dict[str, list[Query]] = {}
+    unique = {q.id: q for q in queries}
+    for query in unique.values():
+        by_fingerprint.setdefault(fingerprint(query, dialect), []).append(query)
+
+    groups = []
+    for fp, members in by_fingerprint.items():
+        if len(members) > 1:
+            canonical, *duplicates = sorted(members, key=lambda q: q.id)
+            groups.append(DuplicateGroup(fp, canonical, duplicates))
+    return DedupReport(total=len(unique), groups=groups)
+
+
+def merge_duplicates(report: DedupReport) -> dict[int, Query]:
+    """
+    Moves the visualizations of duplicate queries onto their canonical query.
+    Returns canonical queries by the id of each duplicate, to be registered with `DBXClient.alias_query`.
+    """
+    aliases = {}
+    for group in report.groups:
+        known = {v.id for v in group.canonical.visualizations}
+        for duplicate in group.duplicates:
+            group.canonical.visualizations.extend(v for v in duplicate.visualizations if v.id not in known)
+            known.update(v.id for v in duplicate.visualizations)
+            aliases[duplicate.id] = group.canonical
+    return aliases
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from hlog import LOGGER
+
+
+@dataclass
+class Target:
+    """
+    Databricks workspace receiving a migration.
+    Settings left unset fall back to the options of the command (eg `--warehouse-id`).
+    """
+    name: str
+    host: str
+    token: str | None = None
+    # environment variable holding the token, to keep it out of the targets file
+    token_env: str | None = None
+    warehouse_id: str | None = None
+    target_folder: str | None = None
+    destination_id: str | None = None
+    run_as: str | None = None
+
+    def __post_init__(self):
+        if self.token is None and self.token_env:
+            self.token = os.environ.get(self.token_env)
+        if not self.host or not self.token:
+            raise ValueError(f"Target `{self.name}` needs a host and a token (or token_env)")
+
+
+def load_targets(path: str) -> list[Target]:
+    """
+    Loads the targets of a fan-out migration from a JSON file:
+        [{"name": "dev", "host": "https://...", "token_env": "DEV_TOKEN", "warehouse_id": "..."}, ...]
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, list) or not data:
+        raise ValueError(f"`{path}` should hold a non-empty list of targets")
+    targets = [Target(**t) for t in data]
+    names = [t.name for t in targets]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate target names in `{path}`")
+    return targets
+
+
+class NamespacedStore:
+    """
+    View of a shared id store (see shard.LeaseStore) keeping the id map of one target apart from the others'
+    """
+
+    def __init__(self, store, namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    def read_mapping(self, kind: str, redash_id) -> tuple | None:
+        return self.store.read_mapping(f"{self.namespace}:{kind}", redash_id)
+
+    def write_mapping(self, kind: str, redash_id, dbx_data):
+        self.store.write_mapping(f"{self.namespace}:{kind}", redash_id, dbx_data)
+
+    def forget(self, kind: str, redash_id):
+        # work items are shared by the targets, only the id map is namespaced
+        self.store.forget(kind, redash_id, mapping_kind=f"{self.namespace}:{kind}")
+
+
+class FanOutError(Exception):
+    """
+    Raised when creating an object failed on some of the targets
+    """
+
+    def __init__(self, errors: dict[str, Exception]):
+        self.errors = errors
+        super().__init__('; '.join(f"{name}: {e}" for name, e in errors.items()))
+
+
+class FanOut:
+    """
+    Applies each migration step to every target workspace concurrently, each target having its own `DBXClient`
+    (and so its own id map, connections and API rate limits).
+
+    Redash objects are fetched and transformed once by the caller, and shared by the steps: relations of queries
+    loaded on first access (see `redash.Query.depends_on`) are loaded under a lock, steps may run concurrently.
+    With a single target, steps run in the calling thread and return the result of that target,
+    so that single workspace runs behave as before.
+    """
+
+    def __init__(self, clients: list[tuple[Target, object]]):
+        self.clients = clients
+        self._executor = ThreadPoolExecutor(max_workers=len(clients)) if len(clients) > 1 else None
+
+    def __iter__(self):
+        return iter(self.clients)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def label(self, target: Target) -> str:
+        """
+        Suffix naming the target in messages, when there are several
+        """
+        return f" in `{target.name}`" if len(self.clients) > 1 else ""
+
+    def run(self, step: Callable):
+        """
+        Calls `step(target, dbx)` for every target.
+
+        :return: the result of the single target, or the results by target name
+        :raises FanOutError: after all targets are done, if the step failed on any of them
+        """
+        if self._executor is None:
+            target, dbx = self.clients[0]
+            return step(target, dbx)
+
+        futures = {target.name: self._executor.submit(step, target, dbx) for target, dbx in self.clients}
+        results, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                LOGGER.error(f"Failed on target `{name}`: {e}")
+                errors[name] = e
+        if errors:
+            raise FanOutError(errors)
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from hlog import LOGGER
+
+
+# headers describing the encoding of the body on the wire, cached bodies are stored decoded
+_TRANSPORT_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+
+class HTTPCache:
+    """
+    On-disk store of GET responses, by URL (and credentials), backed by a SQLite database
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def key(request: requests.PreparedRequest) -> str:
+        # responses depend on who asks for them
+        credentials = request.headers.get('Authorization', '')
+        return hashlib.sha256(f"{request.url}\n{credentials}".encode()).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, headers, body, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, headers, body, stored_at = row
+        return {'etag': etag, 'last_modified': last_modified, 'headers': json.loads(headers), 'body': body,
+                'stored_at': stored_at}
+
+    def put(self, key: str, url: str, response: requests.Response):
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _TRANSPORT_HEADERS}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, url, etag, last_modified, headers, body, stored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, response.headers.get('ETag'), response.headers.get('Last-Modified'), json.dumps(headers),
+                 response.content, time.time())
+            )
+
+    def touch(self, key: str):
+        with self._lock:
+            self._conn.execute("UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), key))
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    Transport adapter answering GET requests from an `HTTPCache`:
+        - responses of URLs matching a max-age override are served from the cache, without any request,
+          until they are older than the max-age
+        - other cached responses are revalidated with a conditional request (`If-None-Match` / `If-Modified-Since`),
+          and a `304 Not Modified` is answered with the cached body
+        - successful responses carrying an `ETag` or a `Last-Modified` header (or matching an override) are stored
+
+    Mount it on a `requests.Session` to make the cache transparent to its users.
+    """
+
+    def __init__(self, cache: HTTPCache, max_age: dict[str, float] | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        # URL pattern (regular expression searched in the URL) -> seconds during which responses are reused as they are
+        self.max_age = [(re.compile(pattern), seconds) for pattern, seconds in (max_age or {}).items()]
+        self.stats = {'fresh': 0, 'revalidated': 0, 'miss': 0}
+        self._stats_lock = threading.Lock()
+
+    def _max_age(self, url: str) -> float | None:
+        return next((seconds for pattern, seconds in self.max_age if pattern.search(url)), None)
+
+    def _count(self, outcome: str):
+        with self._stats_lock:
+            self.stats[outcome] += 1
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        # streamed responses (eg query results) are read as they are downloaded, storing them would buffer them
+        if request.method != 'GET' or kwargs.get('stream'):
+            return super().send(request, **kwargs)
+
+        key = self.cache.key(request)
+        cached = self.cache.get(key)
+        max_age = self._max_age(request.url)
+        if cached is not None and max_age is not None and time.time() - cached['stored_at'] < max_age:
+            self._count('fresh')
+            return self._cached_response(request, cached)
+
+        if cached is not None:
+            if cached['etag']:
+                request.headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                request.headers['If-Modified-Since'] = cached['last_modified']
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            self.cache.touch(key)
+            self._count('revalidated')
+            return self._cached_response(request, cached)
+
+        self._count('miss')
+        if response.status_code == 200 and (
+                max_age is not None or 'ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.put(key, request.url, response)
+        return response
+
+    @staticmethod
+    def _cached_response(request: requests.PreparedRequest, cached: dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(cached['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = cached['body']
+        response.url = request.url
+        response.request = request
+        response.from_cache = True
+        return response
+
+    def report(self) -> str:
+        return (f"Redash HTTP cache: {self.stats['fresh']} fresh hits, {self.stats['revalidated']} revalidated, "
+                f"{self.stats['miss']} downloads")
+
+
+def parse_max_age(values) -> dict[str, float]:
+    """
+    Parses `PATTERN=SECONDS` overrides, eg `api/data_sources=3600`
+    """
+    result = {}
+    for value in values or ():
+        pattern, _, seconds = value.rpartition('=')
+        if not pattern:
+            raise ValueError(f"Invalid max-age override `{value}`, expected PATTERN=SECONDS")
+        result[pattern] = float(seconds)
+    return result
+
+
+def install_cache(session: requests.Session, path: str, max_age: dict[str, float] | None = None,
+                  **adapter_kwargs) -> CachingAdapter:
+    """
+    Mounts a caching adapter, backed by the given database file, on a session
+    (`adapter_kwargs` are passed to `HTTPAdapter`, eg pool sizes)
+    """
+    adapter = CachingAdapter(HTTPCache(path), max_age, **adapter_kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    LOGGER.info(f"Caching Redash responses in `{path}`")
+    return adapter
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import os
+import time
+
+from redash import Alert, Dashboard, Query
+from transform import parse_error, transform_query
+from hlog import LOGGER
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The inventory needs pyarrow, install it with `pip install redash2dqsql[inventory]`")
+    return pyarrow
+
+
+def schemas(pa) -> dict:
+    """
+    Arrow schemas of the inventory tables
+    """
+    tags = pa.list_(pa.string())
+    return {
+        'queries': pa.schema([
+            ('id', pa.int64()),
+            ('name', pa.string()),
+            ('data_source_id', pa.int64()),
+            ('data_source_type', pa.string()),
+            ('dialect', pa.string()),
+            ('tags', tags),
+            ('parameter_count', pa.int32()),
+            ('dependency_count', pa.int32()),
+            ('dependency_depth', pa.int32()),
+            ('visualization_count', pa.int32()),
+            ('sql_bytes', pa.int64()),
+            ('transformed_sql_bytes', pa.int64()),
+            ('transform_seconds', pa.float64()),
+            ('transform_error', pa.string()),
+            ('schedule_interval', pa.int64()),
+            ('schedule_time', pa.string()),
+            ('runs_per_day', pa.float64()),
+        ]),
+        'dashboards': pa.schema([
+            ('id', pa.int64()),
+            ('name', pa.string()),
+            ('slug', pa.string()),
+            ('tags', tags),
+            ('widget_count', pa.int32()),
+            ('text_widget_count', pa.int32()),
+            ('query_count', pa.int32()),
+            ('fetch_seconds', pa.float64()),
+        ]),
+        'widgets': pa.schema([
+            ('id', pa.int64()),
+            ('dashboard_id', pa.int64()),
+            ('query_id', pa.int64()),
+            ('visualization_id', pa.int64()),
+            ('visualization_type', pa.string()),
+            ('width', pa.int32()),
+        ]),
+        'alerts': pa.schema([
+            ('id', pa.int64()),
+            ('name', pa.string()),
+            ('query_id', pa.int64()),
+            ('column', pa.string()),
+            ('op', pa.string()),
+            ('rearm', pa.int64()),
+            ('schedule_interval', pa.int64()),
+        ]),
+    }
+
+
+def dependency_depth(query: Query) -> int:
+    """
+    Length of the longest chain of queries the query (transitively) takes its parameters from
+    """
+    return 1 + max((dependency_depth(q) for q in query.depends_on), default=0) if query.depends_on else 0
+
+
+def query_row(query: Query, sql_bytes: int, transform_seconds: float | None = None,
+              transform_error: str | None = None) -> dict:
+    schedule = query.schedule or {}
+    return {
+        'id': query.id,
+        'name': query.name,
+        'data_source_id': query.source.id if query.source else None,
+        'data_source_type': query.source.type if query.source else None,
+        'dialect': query.source.dialect if query.source else None,
+        'tags': list(query.tags),
+        'parameter_count': len(query.params),
+        'dependency_count': len(query.depends_on),
+        'dependency_depth': dependency_depth(query),
+        'visualization_count': len(query.visualizations),
+        'sql_bytes': sql_bytes,
+        'transformed_sql_bytes': len(query.query_string.encode()) if query.transformed else None,
+        'transform_seconds': transform_seconds,
+        'transform_error': transform_error,
+        'schedule_interval': schedule.get('interval'),
+        'schedule_time': schedule.get('time'),
+        'runs_per_day': query.runs_per_day,
+    }
+
+
+def dashboard_rows(dashboard: Dashboard, fetch_seconds: float | None = None) -> tuple[dict, list[dict]]:
+    widgets = dashboard.widgets or []
+    row = {
+        'id': dashboard.id,
+        'name': dashboard.name,
+        'slug': dashboard.slug,
+        'tags': list(dashboard.tags or ()),
+        'widget_count': len(widgets),
+        'text_widget_count': sum(1 for w in widgets if not w.query),
+        'query_count': len({w.query.id for w in widgets if w.query}),
+        'fetch_seconds': fetch_seconds,
+    }
+    widget_rows = [{
+        'id': w.id,
+        'dashboard_id': dashboard.id,
+        'query_id': w.query.id if w.query else None,
+        'visualization_id': w.visualization.id if w.visualization else None,
+        'visualization_type': w.visualization.type.value if w.visualization else None,
+        'width': w.width,
+    } for w in widgets]
+    return row, widget_rows
+
+
+def alert_row(alert: Alert) -> dict:
+    options = alert.options or {}
+    return {
+        'id': alert.id,
+        'name': alert.name,
+        'query_id': alert.query.id,
+        'column': options.get('column'),
+        'op': options.get('op'),
+        'rearm': alert.rearm,
+        'schedule_interval': (alert.schedule or {}).get('interval'),
+    }
+
+
+class InventoryWriter:
+    """
+    Streams inventory rows to one Parquet file per table, as Arrow record batches of `batch_size` rows,
+    so memory doesn't grow with the size of the corpus
+    """
+
+    def __init__(self, output_dir: str, batch_size: int = 10000):
+        self.pa = _require_pyarrow()
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.schemas = schemas(self.pa)
+        self.counts = {table: 0 for table in self.schemas}
+        self._rows: dict[str, list[dict]] = {table: [] for table in self.schemas}
+        self._writers = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def add(self, table: str, row: dict):
+        rows = self._rows[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self._flush(table)
+
+    def _flush(self, table: str):
+        rows = self._rows[table]
+        if not rows:
+            return
+        schema = self.schemas[table]
+        if table not in self._writers:
+            import pyarrow.parquet as pq
+            self._writers[table] = pq.ParquetWriter(os.path.join(self.output_dir, f"{table}.parquet"), schema)
+        batch = self.pa.RecordBatch.from_pylist(rows, schema=schema)
+        self._writers[table].write_batch(batch)
+        self.counts[table] += len(rows)
+        self._rows[table] = []
+
+    def close(self):
+        for table in self.schemas:
+            self._flush(table)
+            if table not in self._writers:
+                # empty tables are written too, so that readers find every table
+                import pyarrow.parquet as pq
+                pq.write_table(self.schemas[table].empty_table(), os.path.join(self.output_dir, f"{table}.parquet"))
+        for writer in self._writers.values():
+            writer.close()
+
+    def report(self) -> str:
+        return f"Inventory `{self.output_dir}`: " + ', '.join(f"{n} {table}" for table, n in self.counts.items())
+
+
+class Inventory:
+    """
+    Collects the inventory of a Redash corpus: fetches and transforms every object, timing the transforms,
+    and hands the rows to a writer.
+
+    Queries are dropped from the client's cache (see `RedashClient.forget_query`) once their rows are written,
+    so memory doesn't grow with the size of the corpus: a query used by several others (for their parameters)
+    or shown on several dashboards is fetched again for each of them.
+    """
+
+    def __init__(self, redash, writer: InventoryWriter, source_dialect: str | None = None, transform: bool = True):
+        self.redash = redash
+        self.writer = writer
+        self.source_dialect = source_dialect
+        self.transform = transform
+
+    def _transform(self, query: Query, transformed: dict[int, tuple]) -> tuple[int, float | None, str | None]:
+        """
+        Transforms a query, after its dependencies, so that the timing only covers this query
+
+        :param transformed: size of the original SQL and transform seconds and error of the queries transformed
+            so far, by id (a query may be a dependency of several queries of the chain)
+        """
+        if query.id in transformed:
+            return transformed[query.id]
+        for q in query.depends_on:
+            self._transform(q, transformed)
+        sql_bytes, seconds, error = len(query.query_string.encode()), None, None
+        if self.transform and not query.transformed:
+            sql = query.query_string
+            start = time.perf_counter()
+            try:
+                transform_query(query, self.source_dialect)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            seconds = time.perf_counter() - start
+            if error is None:
+                # queries sqlglot can't parse are "transformed" as they are: report them as failed too
+                dialect = self.source_dialect or (query.source.dialect if query.source else None) or 'presto'
+                error = parse_error(sql, dialect)
+            if error is not None:
+                LOGGER.error(f"Failed to transform query {query.id}: {error}")
+        transformed[query.id] = (sql_bytes, seconds, error)
+        return transformed[query.id]
+
+    def add_queries(self, query_ids):
+        for query_id in query_ids:
+            query = self.redash.get_query(query_id)
+            transformed = {}
+            self.writer.add('queries', query_row(query, *self._transform(query, transformed)))
+            for evicted in transformed:
+                self.redash.forget_query(evicted)
+
+    def add_dashboards(self, dashboard_ids):
+        for dashboard_id in dashboard_ids:
+            start = time.perf_counter()
+            dashboard = self.redash.get_dashboard(dashboard_id)
+            row, widget_rows = dashboard_rows(dashboard, time.perf_counter() - start)
+            self.writer.add('dashboards', row)
+            for widget_row in widget_rows:
+                self.writer.add('widgets', widget_row)
+            for evicted in {w.query.id for w in dashboard.widgets or [] if w.query}:
+                self.redash.forget_query(evicted)
+
+    def add_alerts(self, alert_ids):
+        for alert_id in alert_ids:
+            self.writer.add('alerts', alert_row(self.redash.get_alert(alert_id)))
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+
+from redash import Dashboard, Query, VisualizationType, Widget
+from hlog import LOGGER
+
+
+LAKEVIEW_SUFFIX = '.lvdash.json'
+
+# Redash chart series types -> Lakeview widget types
+CHART_TYPES = {
+    'column': 'bar',
+    'bar': 'bar',
+    'line': 'line',
+    'area': 'area',
+    'scatter': 'scatter',
+    'pie': 'pie',
+}
+
+# Redash parameter types -> Lakeview parameter data types (others are passed as strings)
+PARAMETER_TYPES = {
+    'number': 'DECIMAL',
+    'date': 'DATE',
+    'datetime-local': 'DATETIME',
+    'datetime-with-seconds': 'DATETIME',
+}
+
+# `{{ name }}` and, for date ranges, `{{ name.start }}` / `{{ name.end }}`, with the quotes around them
+# (Lakeview parameters are typed, so they aren't quoted)
+_PARAM_PATTERN = re.compile(r'([\'"]?){{\s*([^{}]+?)(?:\.(start|end))?\s*}}\1')
+
+
+def _keyword(name: str) -> str:
+    return re.sub(r'\W', '_', name)
+
+
+def named_parameters(query: Query) -> tuple[str, dict[str, dict]]:
+    """
+    Replaces the Redash `{{ param }}` placeholders of a (transformed) query with `:param` named parameter markers
+
+    :return: the SQL, and the Lakeview definitions of its parameters by keyword
+    """
+    types = {p['name']: p for p in query.options.get('parameters', [])}
+    parameters = {}
+
+    def replace(match):
+        name, bound = match.group(2), match.group(3)
+        keyword = _keyword(f"{name}_{bound}" if bound else name)
+        if keyword not in parameters:
+            redash_param = types.get(name, {})
+            data_type = 'DATE' if bound else PARAMETER_TYPES.get(redash_param.get('type'), 'STRING')
+            value = redash_param.get('value')
+            if isinstance(value, dict):
+                value = value.get(bound)
+            parameter = {'displayName': keyword, 'keyword': keyword, 'dataType': data_type}
+            if value is not None and not isinstance(value, list):
+                parameter['defaultSelection'] = {
+                    'values': {'dataType': data_type, 'values': [{'value': str(value)}]}
+                }
+            parameters[keyword] = parameter
+        return f":{keyword}"
+
+    return _PARAM_PATTERN.sub(replace, query.query_string), parameters
+
+
+def default_value(parameter: dict) -> str | None:
+    """
+    Default value of a parameter returned by `named_parameters`
+    """
+    values = parameter.get('defaultSelection', {}).get('values', {}).get('values')
+    return values[0]['value'] if values else None
+
+
+def dataset(query: Query) -> dict:
+    """
+    Lakeview dataset of a (transformed) query, Redash `{{ param }}` placeholders becoming `:param` parameters
+    """
+    sql, parameters = named_parameters(query)
+    result = {
+        'name': f"q{query.id}",
+        'displayName': query.name,
+        'queryLines': sql.splitlines(keepends=True),
+    }
+    if parameters:
+        result['parameters'] = list(parameters.values())
+    return result
+
+
+def _field(column: str) -> dict:
+    return {'name': column, 'expression': f"`{column}`"}
+
+
+def _encoding(column: str, **kwargs) -> dict:
+    return {'fieldName': column, 'displayName': column, **kwargs}
+
+
+def _visualization_spec(widget: Widget) -> tuple[list[str], dict] | None:
+    """
+    Fields and spec of the Lakeview widget showing a Redash visualization, if the visualization can be converted
+    """
+    viz = widget.visualization
+    options = viz.options or {}
+    if viz.type == VisualizationType.TABLE:
+        columns = [c['name'] for c in options.get('columns', []) if c.get('visible', True)]
+        if not columns:
+            return None
+        return columns, {'version': 1, 'widgetType': 'table',
+                         'encodings': {'columns': [_encoding(c) for c in columns]}}
+
+    if viz.type == VisualizationType.COUNTER:
+        column = options.get('counterColName')
+        if not column:
+            return None
+        return [column], {'version': 2, 'widgetType': 'counter', 'encodings': {'value': _encoding(column)}}
+
+    if viz.type == VisualizationType.CHART:
+        widget_type = CHART_TYPES.get(options.get('globalSeriesType'))
+        mapping = options.get('columnMapping', {})
+        x = next((c for c, role in mapping.items() if role == 'x'), None)
+        ys = [c for c, role in mapping.items() if role == 'y']
+        series = next((c for c, role in mapping.items() if role == 'series'), None)
+        if widget_type is None or x is None or not ys:
+            return None
+        if widget_type == 'pie':
+            return [x, ys[0]], {'version': 3, 'widgetType': 'pie',
+                                'encodings': {'angle': _encoding(ys[0]), 'color': _encoding(x)}}
+        encodings = {
+            'x': _encoding(x, scale={'type': 'quantitative' if widget_type == 'scatter' else 'categorical'}),
+            'y': _encoding(ys[0], scale={'type': 'quantitative'}) if len(ys) == 1 else
+            {'scale': {'type': 'quantitative'}, 'fields': [_encoding(y) for y in ys]},
+        }
+        fields = [x, *ys]
+        if series:
+            encodings['color'] = _encoding(series, scale={'type': 'categorical'})
+            fields.append(series)
+        return fields, {'version': 3, 'widgetType': widget_type, 'encodings': encodings}
+
+    return None
+
+
+def _position(widget: Widget, next_row: int) -> dict:
+    """
+    Position of a widget on the 6 columns grid shared by Redash and Lakeview
+    """
+    position = (widget.options or {}).get('position') or {}
+    return {
+        'x': position.get('col', 0),
+        'y': position.get('row', next_row),
+        'width': position.get('sizeX', 6),
+        'height': position.get('sizeY', 6),
+    }
+
+
+def _text(lines: list[str]) -> dict:
+    return {'multilineTextboxSpec': {'lines': lines}}
+
+
+def dashboard_document(dashboard: Dashboard) -> dict:
+    """
+    Serialized Lakeview dashboard (the content of a `.lvdash.json` file) of a Redash dashboard:
+    one dataset per query, one widget per Redash widget.
+    Visualizations which can't be converted are replaced by a text widget naming them.
+    """
+    datasets = {}
+    layout = []
+    next_row = 0
+    for widget in dashboard.widgets or ():
+        position = _position(widget, next_row)
+        next_row = max(next_row, position['y'] + position['height'])
+        if not widget.query or not widget.visualization:
+            layout.append({'widget': {'name': f"w{widget.id}", **_text([widget.text or ''])}, 'position': position})
+            continue
+
+        query = widget.query
+        datasets.setdefault(query.id, dataset(query))
+        converted = _visualization_spec(widget)
+        if converted is None:
+            LOGGER.warning(f"Visualization `{widget.visualization.name}` ({widget.visualization.type.value}) of "
+                           f"dashboard `{dashboard.name}` can't be converted to Lakeview")
+            content = _text([f"**{widget.visualization.name}** ({widget.visualization.type.value} visualization "
+                             f"of query `{query.name}`) isn't supported by Lakeview yet"])
+        else:
+            fields, spec = converted
+            spec['frame'] = {'showTitle': True, 'title': widget.visualization.name}
+            content = {
+                'queries': [{
+                    'name': 'main_query',
+                    'query': {'datasetName': f"q{query.id}", 'fields': [_field(f) for f in dict.fromkeys(fields)],
+                              'disaggregated': True},
+                }],
+                'spec': spec,
+            }
+        layout.append({'widget': {'name': f"w{widget.id}", **content}, 'position': position})
+
+    return {
+        'datasets': list(datasets.values()),
+        'pages': [{'name': f"p{dashboard.id}", 'displayName': dashboard.name, 'layout': layout}],
+    }
+
+
+def file_name(dashboard: Dashboard) -> str:
+    slug = dashboard.slug or dashboard.name.replace(' ', '_').lower()
+    return f"{_keyword(slug)}_{dashboard.id}{LAKEVIEW_SUFFIX}"
+
+
+def write_dashboard(dashboard: Dashboard, output_dir: str) -> str:
+    """
+    Writes the Lakeview file of a dashboard to a directory, returns its path
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, file_name(dashboard))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(dashboard_document(dashboard), f, indent=2)
+    os.replace(tmp_path, path)
+    return path
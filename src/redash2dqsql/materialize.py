@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable
+
+import sqlglot.errors
+from sqlglot import exp, parse_one
+
+from redash import Query
+from schedule import fixed_time_quartz_expression, interval_quartz_expression, is_fixed_time
+from transform import TARGET_DIALECT
+from hlog import LOGGER
+
+
+# results of these change with every execution, a materialized view would freeze them at refresh time
+_NON_DETERMINISTIC = (exp.CurrentDate, exp.CurrentTimestamp, exp.CurrentTime, exp.Rand)
+
+
+@dataclass
+class Candidate:
+    query: Query
+    view_name: str
+    definition: str
+    rewritten: str
+    dashboards: set[int] = field(default_factory=set)
+    runtime: float | None = None
+    # the query was rewritten to read from the view
+    applied: bool = False
+    # the view couldn't be created
+    error: Exception | None = None
+
+    @property
+    def score(self) -> float:
+        """
+        Warehouse seconds per day spent recomputing the query for every dashboard showing it
+        (runtimes default to 1 second when unknown)
+        """
+        return self.query.runs_per_day * (self.runtime or 1.0) * max(len(self.dashboards), 1)
+
+
+class MaterializationAdvisor:
+    """
+    Picks hot scheduled queries to migrate as Databricks materialized views.
+
+    Queries refreshed at least `min_runs_per_day` times a day, without parameters nor non-deterministic functions,
+    are candidates; they are ranked by the compute they repeat (schedule frequency x runtime x number of dashboards
+    sharing the query). Each candidate becomes a materialized view refreshed on the query's schedule, which
+    Databricks refreshes incrementally where possible, and the query is rewritten to read from the view.
+    """
+
+    def __init__(self, schema: str, min_runs_per_day: float = 24, min_score: float = 0,
+                 runtime_of: Callable[[Query], float | None] | None = None, dialect=TARGET_DIALECT):
+        self.schema = schema
+        self.min_runs_per_day = min_runs_per_day
+        self.min_score = min_score
+        self.runtime_of = runtime_of
+        self.dialect = dialect
+        self.candidates: dict[int, Candidate] = {}
+        self.rejected: dict[int, str] = {}
+
+    def add(self, query: Query, dashboard_id: int | None = None):
+        """
+        Considers a (transformed) query, optionally shown on the given dashboard
+        """
+        if query.id in self.candidates:
+            if dashboard_id is not None:
+                self.candidates[query.id].dashboards.add(dashboard_id)
+            return
+        if query.id in self.rejected:
+            return
+
+        reason = self._check(query)
+        if reason:
+            self.rejected[query.id] = reason
+            return
+
+        tree = parse_one(query.query_string, read=self.dialect)
+        view_name = f"{self.schema}.mv_redash_{query.id}"
+        order = tree.args.get('order')
+        tree.set('order', None)
+        outer = exp.select('*').from_(view_name)
+        if order is not None:
+            outer.set('order', order)
+
+        self.candidates[query.id] = Candidate(
+            query=query,
+            view_name=view_name,
+            definition=tree.sql(dialect=self.dialect, pretty=True),
+            rewritten=outer.sql(dialect=self.dialect, pretty=True),
+            dashboards={dashboard_id} if dashboard_id is not None else set(),
+            runtime=self.runtime_of(query) if self.runtime_of else None,
+        )
+
+    def _check(self, query: Query) -> str | None:
+        """
+        Returns why a query can't be materialized, if it can't
+        """
+        if query.runs_per_day < self.min_runs_per_day:
+            return "not refreshed often enough"
+        if query.params or re.search(r'\{\{.*?\}\}', query.query_string):
+            return "has parameters"
+        try:
+            tree = parse_one(query.query_string, read=self.dialect)
+        except sqlglot.errors.SqlglotError:
+            return "can't be parsed"
+        if not isinstance(tree, exp.Query):
+            return "isn't a SELECT"
+        if tree.find(*_NON_DETERMINISTIC):
+            return "uses non-deterministic functions"
+        if tree.args.get('limit'):
+            return "uses LIMIT"
+        order = tree.args.get('order')
+        if order is not None:
+            outputs = set(tree.named_selects)
+            if not all(isinstance(o.this, exp.Column) and not o.this.table and o.this.name in outputs
+                       for o in order.expressions):
+                return "orders by expressions that aren't output columns"
+        return None
+
+    def selected(self) -> list[Candidate]:
+        """
+        Returns the candidates worth materializing, most expensive first
+        """
+        return sorted(
+            (c for c in self.candidates.values() if c.score >= self.min_score),
+            key=lambda c: -c.score
+        )
+
+    def view_ddl(self, candidate: Candidate) -> str:
+        schedule = candidate.query.schedule
+        if is_fixed_time(schedule):
+            cron = fixed_time_quartz_expression(schedule)
+        else:
+            cron = interval_quartz_expression(schedule['interval'])
+        return (f"-- Redash query {candidate.query.id}: {candidate.query.name}\n"
+                f"CREATE OR REPLACE MATERIALIZED VIEW {candidate.view_name}\n"
+                f"SCHEDULE CRON '{cron}' AT TIME ZONE 'UTC'\n"
+                f"AS\n{candidate.definition};\n")
+
+    def apply(self, output_path: str, create_view: Callable[[str], None] | None = None,
+              rewrite: bool = False) -> list[Candidate]:
+        """
+        Writes the materialized views of the selected candidates to a SQL file, and rewrites their queries to read
+        from the views: once `create_view(ddl)` created each view, if given, otherwise only when `rewrite` is set,
+        as the rewritten queries fail until the views exist. Queries whose view couldn't be created keep their SQL.
+        """
+        selected = self.selected()
+        with open(output_path, 'w') as f:
+            for candidate in selected:
+                f.write(self.view_ddl(candidate))
+                f.write('\n')
+        for candidate in selected:
+            if create_view is not None:
+                try:
+                    create_view(self.view_ddl(candidate))
+                except Exception as e:
+                    LOGGER.error(f"Failed to create {candidate.view_name}, query {candidate.query.id} keeps its SQL: {e}")
+                    candidate.error = e
+                    continue
+            elif not rewrite:
+                continue
+            candidate.query.query_string = candidate.rewritten
+            candidate.applied = True
+        return selected
+
+    def report(self, selected: list[Candidate]) -> str:
+        applied = sum(c.applied for c in selected)
+        lines = [f"{len(selected)} queries materialized, {applied} reading from their view ({len(self.rejected)} rejected):"]
+        for c in selected:
+            state = 'reads the view' if c.applied else f"view not created: {c.error}" if c.error else 'keeps its SQL'
+            lines.append(f"  {c.query.id} `{c.query.name}` -> {c.view_name} "
+                         f"({c.query.runs_per_day:.0f} runs/day, {len(c.dashboards)} dashboards, score {c.score:.0f}, "
+                         f"{state})")
+        return '\n'.join(lines)
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from redash import RedashClient
+from dbsql import DBXClient
+from transform import transform_query
+from hlog import LOGGER
+
+
+KINDS = ('query', 'dashboard', 'alert')
+
+
+@dataclass
+class Selector:
+    """
+    Objects of one kind to migrate: the given Redash IDs, or else the objects with all the given tags
+    (queries for alerts, which have no tags), into `target_folder` (defaults to the one of the batch)
+    """
+    kind: str
+    ids: list[int] = field(default_factory=list)
+    tags: list[str] = field(default_factory=list)
+    target_folder: str | None = None
+
+    def __post_init__(self):
+        if self.kind not in KINDS:
+            raise ValueError(f"Unknown kind `{self.kind}`, expected one of {', '.join(KINDS)}")
+
+
+@dataclass
+class MigrationResult:
+    """
+    Outcome of migrating one object, with the seconds spent fetching, transforming and creating it
+    """
+    kind: str
+    redash_id: int
+    dbx_id: object = None
+    error: Exception | None = None
+    timings: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def seconds(self) -> float:
+        return sum(self.timings.values())
+
+
+class Migrator:
+    """
+    Library entry point migrating batches of Redash objects, eg from a scheduler, without starting a process
+    per dashboard.
+
+    The Redash and Databricks clients (and so their connections and caches of fetched and migrated queries)
+    are kept across calls, so queries shared by several dashboards of a batch, or of successive batches,
+    are fetched, transformed and created once. Failures are returned with the results instead of being raised.
+    """
+
+    def __init__(self, redash: RedashClient, dbx: DBXClient, target_folder: str | None = None,
+                 source_dialect: str | None = None, transform: bool = True, optimizer=None,
+                 destination_id: str | None = None, warehouse_id: str | None = None, run_as: str | None = None):
+        self.redash = redash
+        self.dbx = dbx
+        self.target_folder = target_folder
+        self.source_dialect = source_dialect
+        self.transform = transform
+        # optional optimize.QueryOptimizer
+        self.optimizer = optimizer
+        # alert settings
+        self.destination_id = destination_id
+        self.warehouse_id = warehouse_id
+        self.run_as = run_as
+
+    @classmethod
+    def connect(cls, redash_url: str, redash_api_key: str, databricks_host: str, databricks_token: str,
+                redash_kwargs: dict | None = None, dbx_kwargs: dict | None = None, **kwargs) -> Migrator:
+        """
+        Creates the clients of a migrator (`redash_kwargs` and `dbx_kwargs` are passed to them, eg `pool_size`)
+        """
+        redash = RedashClient(redash_url, redash_api_key, **(redash_kwargs or {}))
+        dbx = DBXClient(databricks_host, databricks_token, **(dbx_kwargs or {}))
+        return cls(redash, dbx, **kwargs)
+
+    def migrate(self, selectors: list[Selector], target_folder: str | None = None) -> list[MigrationResult]:
+        """
+        Migrates the objects of a batch of selectors, in order
+        """
+        results = []
+        for selector in selectors:
+            folder = selector.target_folder or target_folder or self.target_folder
+            if not folder:
+                raise ValueError(f"No target folder for the {selector.kind}s of {selector}")
+            for redash_id in self._ids(selector):
+                results.append(self._migrate(selector.kind, redash_id, folder))
+        failed = sum(not r.ok for r in results)
+        LOGGER.info(f"Migrated {len(results) - failed} objects, {failed} failed")
+        return results
+
+    def migrate_queries(self, ids=(), tags=(), target_folder: str | None = None) -> list[MigrationResult]:
+        return self.migrate([Selector('query', list(ids), list(tags))], target_folder)
+
+    def migrate_dashboards(self, ids=(), tags=(), target_folder: str | None = None) -> list[MigrationResult]:
+        return self.migrate([Selector('dashboard', list(ids), list(tags))], target_folder)
+
+    def migrate_alerts(self, ids=(), tags=(), target_folder: str | None = None) -> list[MigrationResult]:
+        return self.migrate([Selector('alert', list(ids), list(tags))], target_folder)
+
+    def _ids(self, selector: Selector) -> list[int]:
+        if selector.ids:
+            return selector.ids
+        tags = selector.tags or None
+        if selector.kind == 'query':
+            return self.redash.query_ids(tags=tags)
+        if selector.kind == 'dashboard':
+            return self.redash.dashboard_ids(tags=tags)
+        return self.redash.alert_ids(tags=tags)
+
+    def _migrate(self, kind: str, redash_id: int, target_folder: str) -> MigrationResult:
+        result = MigrationResult(kind, redash_id)
+
+        @contextmanager
+        def timed(step):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                result.timings[step] = result.timings.get(step, 0.0) + time.perf_counter() - start
+
+        try:
+            with timed('fetch'):
+                if kind == 'query':
+                    obj = self.redash.get_query(redash_id)
+                elif kind == 'dashboard':
+                    obj = self.redash.get_dashboard(redash_id)
+                else:
+                    obj = self.redash.get_alert(redash_id)
+            with timed('transform'):
+                if self.transform:
+                    for query in self._queries_of(kind, obj):
+                        transform_query(query, self.source_dialect, self.optimizer)
+            with timed('create'):
+                if kind == 'query':
+                    result.dbx_id = self.dbx.create_query_ex(obj, target_folder)
+                elif kind == 'dashboard':
+                    result.dbx_id = self.dbx.create_dashboard_ex(obj, target_folder)
+                else:
+                    result.dbx_id = self.dbx.create_alert(obj, target_folder, destination_id=self.destination_id,
+                                                          warehouse_id=self.warehouse_id, run_as=self.run_as)
+        except Exception as e:
+            LOGGER.error(f"Failed to migrate {kind} {redash_id}: {e}")
+            result.error = e
+        return result
+
+    @staticmethod
+    def _queries_of(kind: str, obj) -> list:
+        if kind == 'query':
+            return [obj]
+        if kind == 'alert':
+            return [obj.query]
+        return [w.query for w in obj.widgets if w.visualization and w.query]
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import difflib
+import json
+
+import sqlglot.errors
+from sqlglot import exp, parse
+from sqlglot.optimizer.pushdown_predicates import pushdown_predicates
+from sqlglot.optimizer.pushdown_projections import pushdown_projections
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.unnest_subqueries import unnest_subqueries
+from sqlglot.schema import MappingSchema
+
+from redash import Query
+from hlog import LOGGER
+from transform import TARGET_DIALECT, mask_query_params, unmask_query_params
+
+
+# in the order they are applied: predicates are pushed down next to the tables before the partition filters are
+# rewritten, and columns pruned last, once every pass has had a chance to reference them
+PASSES = ('unnest', 'pushdown', 'partitions', 'approx', 'prune')
+DEFAULT_PASSES = ('unnest', 'pushdown', 'partitions', 'prune')
+
+_PLACEHOLDER_PREFIX = '__redash_param_'
+_DATE_TYPES = {exp.DataType.Type.DATE}
+
+
+def load_schema(path: str) -> tuple[dict, dict[str, dict[str, str]]]:
+    """
+    Loads a table schema file:
+        {"catalog.db.table": {"columns": {"id": "bigint", "ts": "timestamp"}, "partitions": ["ts"]}}
+    Every table name must have the same number of parts.
+
+    :return: nested mapping of the column types (as expected by sqlglot), and the partition columns
+             (with their types) by table name
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    mapping: dict = {}
+    partitions: dict[str, dict[str, str]] = {}
+    for table, spec in config.items():
+        columns = {c.lower(): t for c, t in spec.get('columns', {}).items()}
+        node = mapping
+        parts = table.lower().split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = columns
+        partitions[table.lower()] = {c.lower(): columns.get(c.lower(), 'date') for c in spec.get('partitions', [])}
+    return mapping, partitions
+
+
+class QueryOptimizer:
+    """
+    Performance oriented rewrites of transpiled queries, on top of the syntax translation:
+        - partitions: makes filters on partition columns sargable, eg `DATE(ts) = '2024-01-01'` becomes
+          `ts >= CAST('2024-01-01' AS DATE) AND ts < DATEADD(DAY, 1, CAST('2024-01-01' AS DATE))`
+        - approx: `COUNT(DISTINCT x)` becomes `APPROX_COUNT_DISTINCT(x)` (results are estimates, so off by default)
+        - unnest: decorrelates subqueries into joins
+        - pushdown: pushes predicates down into subqueries and CTEs
+        - prune: expands `SELECT *` of known tables and drops the columns unused by outer queries
+
+    Columns are resolved with a schema file (see `load_schema`). Queries which can't be parsed or optimized are left
+    as they are. Every change is kept as a unified diff, for review before migrating.
+    """
+
+    def __init__(self, schema: dict | None = None, partitions: dict[str, dict[str, str]] | None = None,
+                 passes=DEFAULT_PASSES, dialect=TARGET_DIALECT):
+        unknown = set(passes) - set(PASSES)
+        if unknown:
+            raise ValueError(f"Unknown optimizer passes: {', '.join(sorted(unknown))}")
+        self.schema = MappingSchema(schema or {}, dialect=dialect)
+        self.partitions = partitions or {}
+        self.passes = [p for p in PASSES if p in passes]
+        self.dialect = dialect
+        self.diffs: dict[int, str] = {}
+        self.failures: dict[int, str] = {}
+
+    @classmethod
+    def from_file(cls, path: str, passes=DEFAULT_PASSES) -> QueryOptimizer:
+        schema, partitions = load_schema(path)
+        return cls(schema, partitions, passes)
+
+    def optimize(self, query: Query) -> str:
+        """
+        Returns the optimized SQL of a (transformed) query, recording its diff
+        """
+        original = query.query_string
+        try:
+            result = self.optimize_sql(original)
+        except (sqlglot.errors.SqlglotError, ValueError) as e:
+            LOGGER.warning(f"Couldn't optimize query {query.id} `{query.name}`: {e}")
+            self.failures[query.id] = str(e)
+            return original
+
+        if result.strip() != original.strip():
+            self.diffs[query.id] = ''.join(difflib.unified_diff(
+                (original.strip() + '\n').splitlines(keepends=True),
+                (result.strip() + '\n').splitlines(keepends=True),
+                fromfile=f"{query.id}/transpiled", tofile=f"{query.id}/optimized",
+            ))
+        return result
+
+    def optimize_sql(self, sql: str) -> str:
+        masked, mapping = mask_query_params(sql)
+        statements = [s for s in parse(masked, read=self.dialect) if s is not None]
+        if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+            # scripts and non SELECT statements are migrated as they are
+            return sql
+
+        tree = qualify(statements[0], schema=self.schema, dialect=self.dialect, expand_stars='prune' in self.passes,
+                       validate_qualify_columns=False, quote_identifiers=False, identify=False)
+        if 'unnest' in self.passes:
+            tree = unnest_subqueries(tree)
+        if 'pushdown' in self.passes:
+            tree = pushdown_predicates(tree, dialect=self.dialect)
+        if 'partitions' in self.passes:
+            tree = self._rewrite_partition_filters(tree)
+        if 'approx' in self.passes:
+            tree = tree.transform(_approx_count_distinct)
+        if 'prune' in self.passes:
+            tree = pushdown_projections(tree)
+
+        for where in list(tree.find_all(exp.Where)):
+            _drop_true_conditions(where)
+        tree = tree.transform(_restore_placeholders)
+        return unmask_query_params(tree.sql(dialect=self.dialect, pretty=True), mapping)
+
+    def _partition_type(self, column: exp.Column, tables: dict[str, str]) -> str | None:
+        """
+        Returns the type of a partition column, None if the column isn't one
+        """
+        table = tables.get(column.table.lower())
+        if table is None:
+            return None
+        return self.partitions.get(table, {}).get(column.name.lower())
+
+    def _rewrite_partition_filters(self, tree: exp.Expression) -> exp.Expression:
+        if not self.partitions:
+            return tree
+        for select in list(tree.find_all(exp.Select)):
+            tables = {
+                t.alias_or_name.lower(): '.'.join(p.name for p in t.parts).lower()
+                for t in select.find_all(exp.Table) if t.parent_select is select
+            }
+            where = select.args.get('where')
+            if where is None or not tables:
+                continue
+            for predicate in list(where.find_all(exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
+                rewritten = self._sargable(predicate, tables)
+                if rewritten is not None:
+                    predicate.replace(rewritten)
+        return tree
+
+    def _sargable(self, predicate: exp.Binary, tables: dict[str, str]) -> exp.Expression | None:
+        """
+        Rewrites `f(partition column) <op> value` into a range over the partition column itself
+        """
+        op, left, right = type(predicate), predicate.left, predicate.right
+        if _is_constant(left) and not _is_constant(right):
+            op, left, right = _FLIPPED[op], right, left
+        if not _is_constant(right):
+            return None
+
+        if isinstance(left, (exp.Cast, exp.TsOrDsToDate, exp.Date)) and isinstance(left.this, exp.Column) \
+                and (not isinstance(left, exp.Cast) or left.to.this in _DATE_TYPES):
+            column = left.this
+            column_type = self._partition_type(column, tables)
+            if column_type is None:
+                return None
+            if exp.DataType.build(column_type).this in _DATE_TYPES:
+                return op(this=column.copy(), expression=right.copy())
+            start = exp.cast(right.copy(), 'DATE')
+            end = exp.func('DATE_ADD', start.copy(), exp.Literal.number(1))
+        elif isinstance(left, exp.Year) and isinstance(right, exp.Literal) and not right.is_string:
+            column = left.this.this if isinstance(left.this, (exp.TsOrDsToDate, exp.Cast)) else left.this
+            if not isinstance(column, exp.Column) or self._partition_type(column, tables) is None:
+                return None
+            year = int(right.name)
+            start = exp.cast(exp.Literal.string(f"{year:04d}-01-01"), 'DATE')
+            end = exp.cast(exp.Literal.string(f"{year + 1:04d}-01-01"), 'DATE')
+        else:
+            return None
+
+        column = column.copy()
+        if op is exp.EQ:
+            return exp.and_(exp.GTE(this=column, expression=start), exp.LT(this=column.copy(), expression=end))
+        if op is exp.GTE:
+            return exp.GTE(this=column, expression=start)
+        if op is exp.GT:
+            return exp.GTE(this=column, expression=end)
+        if op is exp.LT:
+            return exp.LT(this=column, expression=start)
+        return exp.LT(this=column, expression=end)
+
+    def report(self) -> str:
+        lines = [f"{len(self.diffs)} queries optimized ({len(self.failures)} couldn't be optimized)"]
+        for query_id, reason in self.failures.items():
+            lines.append(f"-- query {query_id} not optimized: {reason}")
+        lines.extend(self.diffs.values())
+        return '\n'.join(lines)
+
+
+_FLIPPED = {exp.EQ: exp.EQ, exp.GT: exp.LT, exp.GTE: exp.LTE, exp.LT: exp.GT, exp.LTE: exp.GTE}
+
+
+def _is_placeholder(node: exp.Expression) -> bool:
+    return isinstance(node, exp.Column) and node.name.startswith(_PLACEHOLDER_PREFIX)
+
+
+def _is_constant(node: exp.Expression) -> bool:
+    """
+    Literals and query params, possibly within function calls or casts
+    """
+    if isinstance(node, (exp.Subquery, exp.Query)):
+        return False
+    return all(_is_placeholder(c) for c in node.find_all(exp.Column))
+
+
+def _drop_true_conditions(where: exp.Where):
+    """
+    Removes the `TRUE` conjuncts left behind by the pushdown passes
+    """
+    conditions = [c for c in where.this.flatten() if not (isinstance(c, exp.Boolean) and c.this)] \
+        if isinstance(where.this, exp.And) else [where.this]
+    if not conditions or conditions == [exp.true()]:
+        where.pop()
+    else:
+        where.set('this', exp.and_(*conditions, copy=False))
+
+
+def _approx_count_distinct(node: exp.Expression) -> exp.Expression:
+    if isinstance(node, exp.Count) and isinstance(node.this, exp.Distinct) and len(node.this.expressions) == 1:
+        return exp.ApproxDistinct(this=node.this.expressions[0].copy())
+    return node
+
+
+def _restore_placeholders(node: exp.Expression) -> exp.Expression:
+    """
+    Undoes the qualification of the query param placeholders, so that they can be unmasked
+    """
+    if _is_placeholder(node):
+        return exp.column(node.name)
+    if isinstance(node, exp.Alias) and node.alias.startswith(_PLACEHOLDER_PREFIX) and _is_placeholder(node.this):
+        return exp.column(node.this.name)
+    return node
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import ast
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from hlog import LOGGER
+
+
+# modules whose functions allocations are attributed to
+TRACKED_FILES = ('redash.py', 'transform.py', 'dbsql.py')
+# time spent outside of the phases (eg listing ids, writing reports)
+OTHER = 'other'
+
+# profiler of the current run, if any
+_active: Profiler | None = None
+
+
+def phase(name: str):
+    """
+    Marks a function as a phase of a run (fetch, transform or create), for the profiler.
+    Nested calls of the same phase (eg fetching the queries of a dashboard) are part of the outer call;
+    without an active profiler the function is called as is.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@functools.lru_cache(maxsize=None)
+def _functions(filename: str) -> list[tuple[int, int, str]]:
+    """
+    (first line, last line, qualified name) of the functions of a source file, inner functions last
+    """
+    try:
+        with open(filename) as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return []
+    functions = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = f"{prefix}{child.name}"
+                if not isinstance(child, ast.ClassDef):
+                    functions.append((child.lineno, child.end_lineno, name))
+                visit(child, f"{name}.")
+            else:
+                visit(child, prefix)
+
+    visit(tree, '')
+    return functions
+
+
+def function_of(filename: str, lineno: int) -> str:
+    """
+    Name of the (innermost) function of a source line, as `module.py:function`
+    """
+    name = '<module>'
+    for first, last, qualname in _functions(filename):
+        if first <= lineno <= last:
+            name = qualname
+    return f"{os.path.basename(filename)}:{name}"
+
+
+class Profiler:
+    """
+    Profiles a run, in two ways:
+        - CPU: the stacks of the threads running a phase (and of the main thread) are sampled every `interval`
+          seconds, and written as folded stacks (`cpu.folded`, one `phase;frame;...;frame count` line per stack),
+          the input of flamegraph.pl, speedscope or inferno
+        - memory: at each phase boundary, the time, peak and net traced memory of the phase which just ended
+          are added up, and a `tracemalloc` snapshot is compared to the previous one: the memory allocated in
+          between is attributed to the innermost function of `tracked_files` in the allocating traceback.
+          The phases and the top `top` functions are written to `memory.txt`.
+
+    Comparing snapshots takes time in proportion to the memory held by the run, so snapshots are skipped at the
+    boundaries coming sooner than `SNAPSHOT_OVERHEAD` allows; the allocations of the skipped phases go to the
+    next snapshot. Allocations of targets migrated concurrently (see `fanout.FanOut`) are traced together.
+    """
+
+    # share of the run spent comparing snapshots, at most
+    SNAPSHOT_OVERHEAD = 0.1
+
+    def __init__(self, output_dir: str, top: int = 25, interval: float = 0.005, frames: int = 32,
+                 tracked_files=TRACKED_FILES):
+        self.output_dir = output_dir
+        self.top = top
+        self.interval = interval
+        self.frames = frames
+        self.tracked_files = tuple(tracked_files)
+        # folded stack -> samples
+        self.stacks: dict[str, int] = {}
+        # function -> [bytes, blocks]
+        self.allocations: dict[str, list[int]] = {}
+        # phase -> [seconds, peak bytes, net bytes]
+        self.phases: dict[str, list[float]] = {}
+        self.snapshots = 0
+        # phases entered by each thread, innermost last
+        self._phases: dict[int, list[str]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._snapshot = None
+        self._next_snapshot = 0.0
+        self._boundary_at = 0.0
+        self._traced = 0
+        # traceback -> function of the tracked files, or None
+        self._functions: dict = {}
+
+    def start(self):
+        global _active
+        tracemalloc.start(self.frames)
+        self._snapshot = tracemalloc.take_snapshot()
+        self._boundary_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        _active = self
+        LOGGER.info(f"Profiling to `{self.output_dir}`")
+
+    def stop(self) -> str:
+        """
+        Stops profiling and writes its files
+
+        :return: summary of the profile
+        """
+        global _active
+        _active = None
+        self._stop.set()
+        self._sampler.join()
+        self._boundary(OTHER, snapshot=True)
+        tracemalloc.stop()
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, 'cpu.folded'), 'w') as f:
+            for stack, samples in sorted(self.stacks.items()):
+                f.write(f"{stack} {samples}\n")
+        report = self.report()
+        with open(os.path.join(self.output_dir, 'memory.txt'), 'w') as f:
+            f.write(report)
+        return f"Profile written to `{self.output_dir}` ({sum(self.stacks.values())} samples)\n{report}"
+
+    @contextmanager
+    def phase(self, name: str):
+        stack = self._phases.setdefault(threading.get_ident(), [])
+        outer = stack[-1] if stack else None
+        if outer != name:
+            self._boundary(outer or OTHER)
+        stack.append(name)
+        try:
+            yield
+        finally:
+            stack.pop()
+            if outer != name:
+                self._boundary(name)
+
+    def _function(self, traceback) -> str | None:
+        function = self._functions.get(traceback, '')
+        if function == '':
+            function = None
+            # tracemalloc tracebacks are ordered from the oldest frame
+            for frame in reversed(traceback):
+                if os.path.basename(frame.filename) in self.tracked_files:
+                    function = function_of(frame.filename, frame.lineno)
+                    break
+            self._functions[traceback] = function
+        return function
+
+    def _boundary(self, ended: str, snapshot: bool = False):
+        """
+        Adds up the phase which just ended, and compares snapshots if it is time to
+        """
+        with self._lock:
+            now = time.perf_counter()
+            traced, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            totals = self.phases.setdefault(ended, [0.0, 0, 0])
+            totals[0] += now - self._boundary_at
+            totals[1] = max(totals[1], peak)
+            totals[2] += traced - self._traced
+            self._traced = traced
+            if snapshot or now >= self._next_snapshot:
+                self._compare_snapshots()
+                # the time taken by the snapshot isn't part of the next phase
+                done = time.perf_counter()
+                self._next_snapshot = done + (done - now) / self.SNAPSHOT_OVERHEAD
+                self._traced = tracemalloc.get_traced_memory()[0]
+            self._boundary_at = time.perf_counter()
+
+    def _compare_snapshots(self):
+        snapshot = tracemalloc.take_snapshot()
+        for diff in snapshot.compare_to(self._snapshot, 'traceback'):
+            if diff.size_diff <= 0:
+                continue
+            function = self._function(diff.traceback)
+            if function is not None:
+                allocated = self.allocations.setdefault(function, [0, 0])
+                allocated[0] += diff.size_diff
+                allocated[1] += max(diff.count_diff, 0)
+        self._snapshot = snapshot
+        self.snapshots += 1
+
+    def _sample(self):
+        sampler = threading.get_ident()
+        main = threading.main_thread().ident
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                phases = self._phases.get(ident)
+                if ident == sampler or (ident != main and not phases):
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    # leaves out the phase wrappers
+                    if code.co_filename != __file__:
+                        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                frames.append(phases[-1] if phases else OTHER)
+                stack = ';'.join(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def report(self) -> str:
+        lines = ['Phases:']
+        for name, (seconds, peak, net) in sorted(self.phases.items(), key=lambda item: item[1][0], reverse=True):
+            lines.append(f"  {name:<12} {seconds:>9.2f}s  peak {peak / 1024:>10.1f} KiB  net {net / 1024:>+10.1f} KiB")
+        lines.append(f"Top {self.top} allocating functions of {', '.join(self.tracked_files)} "
+                     f"({self.snapshots} snapshots):")
+        top = sorted(self.allocations.items(), key=lambda item: item[1][0], reverse=True)[:self.top]
+        for function, (size, blocks) in top:
+            lines.append(f"  {size / 1024:>10.1f} KiB {blocks:>8} blocks  {function}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+import os
+import traceback
+from datetime import datetime
+
+from redash import Query
+from hlog import LOGGER
+
+
+class Quarantine:
+    """
+    Objects which failed to migrate, kept in a JSON lines file with the details of their errors, so that a batch
+    can carry on with independent work and a later run can retry just these objects.
+
+    Objects depending on a quarantined query (queries using it for their parameters, dashboards and alerts showing
+    it) are quarantined along with it, without being attempted.
+
+    Sharded workers (see `shard.LeaseStore`) keep the entries in their shared store instead of the file, one row
+    per object, so that they don't overwrite each other's entries.
+    """
+
+    def __init__(self, path: str, store=None):
+        self.path = path
+        self.store = store
+        self.entries: dict[tuple[str, str], dict] = {}
+        # objects which failed during this run
+        self.failed: set[tuple[str, str]] = set()
+        if store is not None:
+            self._load_store()
+        elif os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[(entry['kind'], entry['id'])] = entry
+
+    def ids(self, kind: str) -> list[str]:
+        """
+        IDs of the quarantined objects of a kind, to retry them
+        """
+        return [item_id for k, item_id in self.entries if k == kind]
+
+    def add(self, kind: str, item_id, error: Exception | None = None, blocked_by: tuple[str, object] | None = None):
+        entry = {
+            'kind': kind,
+            'id': str(item_id),
+            'time': datetime.now().isoformat(timespec='seconds'),
+        }
+        if error is not None:
+            entry['error'] = {
+                'type': type(error).__name__,
+                'message': str(error),
+                'error_code': getattr(error, 'error_code', None),
+                'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__)),
+            }
+            LOGGER.error(f"Quarantined {kind} {item_id}: {error}")
+        if blocked_by is not None:
+            entry['blocked_by'] = {'kind': blocked_by[0], 'id': str(blocked_by[1])}
+            LOGGER.warning(f"Quarantined {kind} {item_id}, as it depends on {blocked_by[0]} {blocked_by[1]}")
+        self.entries[(kind, str(item_id))] = entry
+        self.failed.add((kind, str(item_id)))
+        if self.store is not None:
+            self.store.add_quarantined(entry)
+        else:
+            self._write()
+
+    def mark_failed(self, kind: str, item_id):
+        """
+        Records that an object failed during this run, without quarantining it (eg the query of a failed alert),
+        so that its other dependents are quarantined instead of being attempted
+        """
+        self.failed.add((kind, str(item_id)))
+
+    def release(self, kind: str, item_id):
+        """
+        Removes an object from the quarantine, once it is migrated
+        """
+        if self.store is not None:
+            # the entry may come from another worker
+            self.entries.pop((kind, str(item_id)), None)
+            self.store.remove_quarantined(kind, item_id)
+        elif self.entries.pop((kind, str(item_id)), None) is not None:
+            self._write()
+
+    def blocking(self, query: Query | None) -> Query | None:
+        """
+        Returns the query which failed during this run among the given query and the queries it (transitively)
+        depends on, if any
+        """
+        if query is None:
+            return None
+        if ('query', str(query.id)) in self.failed:
+            return query
+        for q in query.depends_on:
+            blocked = self.blocking(q)
+            if blocked is not None:
+                return blocked
+        return None
+
+    def _load_store(self):
+        self.entries = {(entry['kind'], entry['id']): entry for entry in self.store.quarantined()}
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> str:
+        if self.store is not None:
+            # including the entries of the other workers
+            self._load_store()
+        counts = {}
+        for kind, _ in self.entries:
+            counts[kind] = counts.get(kind, 0) + 1
+        if not counts:
+            return "Nothing quarantined"
+        location = self.store.path if self.store is not None else self.path
+        return (f"Quarantined {', '.join(f'{n} {kind}s' for kind, n in counts.items())} in `{location}`, "
+                f"run again with --retry-quarantine to retry them")
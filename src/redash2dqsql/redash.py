@@ -1,11 +1,19 @@
 from __future__ import annotations
 
 import enum
-from dataclasses import dataclass, field
+import json
+import sys
+import threading
+from contextlib import contextmanager
+from dataclasses import InitVar, dataclass, field
 from functools import lru_cache
 
+from requests.adapters import HTTPAdapter
 from redash_toolbelt import Redash
 
+from httpcache import install_cache
+from profiling import phase
+
 
 class VisualizationType(enum.Enum):
     WORD_CLOUD = "WORD_CLOUD"
@@ -20,62 +28,233 @@ class VisualizationType(enum.Enum):
     DETAILS = "DETAILS"
 
 
-@dataclass
+def _intern_all(values) -> tuple[str, ...]:
+    """
+    Interns repeated strings (tags, names, types) so that all models share a single copy of each
+    """
+    return tuple(sys.intern(v) for v in values or ())
+
+
+def _encode_options(options) -> bytes | None:
+    if options is None or isinstance(options, bytes):
+        return options
+    return json.dumps(options, separators=(',', ':')).encode()
+
+
+def _lazy_options(cls):
+    """
+    Exposes `options` of a model as a property: they are kept as compact JSON bytes,
+    and only decoded (once) when accessed
+    """
+
+    def get_options(self):
+        if self._options is None and self._options_raw is not None:
+            self._options = json.loads(self._options_raw)
+        return self._options
+
+    def set_options(self, options):
+        self._options = None
+        self._options_raw = _encode_options(options)
+
+    cls.options = property(get_options, set_options)
+    return cls
+
+
+# guards the first load of the lazy relations of queries: steps running concurrently for several targets
+# (see fanout.FanOut) may be the first to read a relation. Never held while fetching from Redash.
+_LOAD_LOCK = threading.RLock()
+
+
+def _lazy_relations(cls):
+    """
+    Exposes `depends_on` and `visualizations` of a query as properties, loaded on first access, so that
+    filtering, planning or listing queries doesn't fetch the queries they depend on nor build their visualizations
+    """
+
+    def get_depends_on(self):
+        if self._depends_on is None:
+            # fetched outside the lock; threads racing for the first load get the same (shared) query models
+            loaded = [self._loader.get_query(i) for i in self._depends_on_ids]
+            with _LOAD_LOCK:
+                if self._depends_on is None:
+                    self._depends_on = loaded
+        return self._depends_on
+
+    def set_depends_on(self, queries):
+        self._depends_on = list(queries or [])
+
+    def get_visualizations(self):
+        if self._visualizations is None:
+            with _LOAD_LOCK:
+                if self._visualizations is None:
+                    built = self._visualizations_by_id or {}
+                    visualizations = [built.get(v['id']) or _build_visualization_model(v)
+                                      for v in json.loads(self._visualizations_raw or b'[]')]
+                    # assigned before dropping the raw objects, which readers outside the lock may still use
+                    self._visualizations = visualizations
+                    self._visualizations_raw = self._visualizations_by_id = None
+        return self._visualizations
+
+    def set_visualizations(self, visualizations):
+        self._visualizations = list(visualizations or [])
+        self._visualizations_raw = self._visualizations_by_id = None
+
+    cls.depends_on = property(get_depends_on, set_depends_on)
+    cls.visualizations = property(get_visualizations, set_visualizations)
+    return cls
+
+
+@_lazy_options
+@dataclass(slots=True)
 class Visualization:
     id: int
     type: VisualizationType
     name: str
     description: str
-    options: dict
+    options: InitVar[dict | bytes]
+    _options_raw: bytes | None = field(init=False, default=None, repr=False)
+    _options: dict | None = field(init=False, default=None, repr=False, compare=False)
+
+    def __post_init__(self, options):
+        self._options_raw = _encode_options(options)
 
 
-@dataclass
+def _build_visualization_model(visualization_obj) -> Visualization:
+    return Visualization(
+        id=visualization_obj['id'],
+        type=VisualizationType(visualization_obj['type']),
+        name=visualization_obj['name'],
+        description=visualization_obj['description'],
+        options=visualization_obj['options']
+    )
+
+
+@dataclass(slots=True)
 class Source:
     id: int
     name: str
     type: str
     dialect: str | None = None
 
+    def __post_init__(self):
+        self.type = sys.intern(self.type)
+        if self.dialect:
+            self.dialect = sys.intern(self.dialect)
+
 
-@dataclass
+@_lazy_relations
+@_lazy_options
+@dataclass(slots=True)
 class Query:
     id: int
     name: str
     query_string: str
-    options: dict = field(default_factory=dict)
-    tags: [] = field(default_factory=list)
-    depends_on: [] = field(default_factory=list)
-    visualizations: list[Visualization] = field(default_factory=list)
+    options: InitVar[dict | bytes | None] = None
+    tags: tuple[str, ...] = ()
+    depends_on: InitVar[list[Query] | None] = None
+    visualizations: InitVar[list[Visualization] | None] = None
     source: Source | None = None
+    schedule: dict | None = None
+    latest_query_data_id: int | None = None
+    transformed: bool = field(default=False, repr=False, compare=False)
+    _options_raw: bytes | None = field(init=False, default=None, repr=False)
+    _options: dict | None = field(init=False, default=None, repr=False, compare=False)
+    _depends_on: list[Query] | None = field(init=False, default=None, repr=False, compare=False)
+    _depends_on_ids: tuple[int, ...] = field(init=False, default=(), repr=False, compare=False)
+    _visualizations: list[Visualization] | None = field(init=False, default=None, repr=False, compare=False)
+    _visualizations_raw: bytes | None = field(init=False, default=None, repr=False, compare=False)
+    # visualizations built one at a time (see `visualization`), by id
+    _visualizations_by_id: dict[int, Visualization] | None = field(init=False, default=None, repr=False,
+                                                                   compare=False)
+    # loads the queries this one depends on (the client which fetched it)
+    _loader: object = field(init=False, default=None, repr=False, compare=False)
+
+    def __post_init__(self, options, depends_on, visualizations):
+        self._options_raw = _encode_options(options if options is not None else {})
+        self.tags = _intern_all(self.tags)
+        self._depends_on = list(depends_on or [])
+        self._visualizations = list(visualizations or [])
+
+    @classmethod
+    def lazy(cls, loader, depends_on_ids, visualizations_raw: bytes | None, **kwargs) -> Query:
+        """
+        Returns a query whose dependencies (fetched through `loader.get_query`) and visualizations (built from their
+        raw API objects, as JSON bytes) are only loaded when accessed
+        """
+        query = cls(**kwargs)
+        query._loader = loader
+        query._depends_on = None
+        query._depends_on_ids = tuple(depends_on_ids)
+        query._visualizations = None
+        query._visualizations_raw = visualizations_raw
+        return query
+
+    def visualization(self, visualization_id) -> Visualization | None:
+        """
+        Returns a visualization of the query, by id, only building that one if the others weren't needed yet
+        """
+        with _LOAD_LOCK:
+            if self._visualizations is not None:
+                return next((v for v in self._visualizations if v.id == visualization_id), None)
+            if self._visualizations_by_id is None:
+                self._visualizations_by_id = {}
+            if visualization_id not in self._visualizations_by_id:
+                obj = next((v for v in json.loads(self._visualizations_raw or b'[]') if v['id'] == visualization_id),
+                           None)
+                if obj is None:
+                    return None
+                self._visualizations_by_id[visualization_id] = _build_visualization_model(obj)
+            return self._visualizations_by_id[visualization_id]
 
     @property
     def params(self):
         parameters = self.options.get('parameters', [])
-        return [p['name'] for p in parameters]
+        return [sys.intern(p['name']) for p in parameters]
+
+    @property
+    def runs_per_day(self) -> float:
+        """
+        Number of times a day the query is refreshed by its Redash schedule
+        """
+        if not self.schedule or not self.schedule.get('interval'):
+            return 0.0
+        return 86400 / self.schedule['interval']
 
 
-@dataclass
+@_lazy_options
+@dataclass(slots=True)
 class Alert:
     id: int
     name: str
     query: Query
     schedule: dict | None
-    options: dict
+    options: InitVar[dict | bytes]
     rearm: int | None
+    _options_raw: bytes | None = field(init=False, default=None, repr=False)
+    _options: dict | None = field(init=False, default=None, repr=False, compare=False)
 
+    def __post_init__(self, options):
+        self._options_raw = _encode_options(options)
 
-@dataclass
+
+@_lazy_options
+@dataclass(slots=True)
 class Widget:
     id: int
     text: str | None
     query: Query | None
     visualization: Visualization | None
-    options: dict | None = None
+    options: InitVar[dict | bytes | None] = None
     width: int | None = None
     name: str | None = None
+    _options_raw: bytes | None = field(init=False, default=None, repr=False)
+    _options: dict | None = field(init=False, default=None, repr=False, compare=False)
+
+    def __post_init__(self, options):
+        self._options_raw = _encode_options(options)
 
 
-@dataclass
+@dataclass(slots=True)
 class Dashboard:
     id: int
     name: str
@@ -83,39 +262,129 @@ class Dashboard:
     widgets: list[Widget] | None = None
     dashboard_filters_enabled: bool | None = None
     layout: list | None = None
-    tags: list[str] | None = None
+    tags: tuple[str, ...] | None = None
+
+    def __post_init__(self):
+        if self.tags is not None:
+            self.tags = _intern_all(self.tags)
 
 
 class RedashClient:
-    def __init__(self, url, api_key):
+    def __init__(self, url, api_key, http_cache: str | None = None, cache_max_age: dict[str, float] | None = None,
+                 pool_size: int | None = None):
         self.redash = Redash(url, api_key)
+        # keep up to `pool_size` connections alive, so that as many threads can share the session
+        # without new TLS handshakes (requests already negotiates gzip and keep-alive)
+        pool = {'pool_connections': pool_size, 'pool_maxsize': pool_size} if pool_size else {}
+        # optional on-disk cache of the API responses, revalidated with conditional requests (see httpcache.py)
+        self.http_cache = None
+        if http_cache:
+            self.http_cache = install_cache(self.redash.session, http_cache, cache_max_age, **pool)
+        elif pool:
+            adapter = HTTPAdapter(**pool)
+            self.redash.session.mount('http://', adapter)
+            self.redash.session.mount('https://', adapter)
+        # fully fetched queries, by id: widgets and dependent queries referencing the same query share one model
+        self._queries: dict[int, Query] = {}
+        self._lock = threading.Lock()
+        # snapshot read instead of the API (see `from_snapshot`), its indexes list IDs without decoding the objects
+        self.snapshot = None
+        # runtimes of query results, by result id
+        self._runtimes: dict[int, float | None] = {}
+
+    @classmethod
+    def from_snapshot(cls, path: str) -> RedashClient:
+        """
+        Returns a client reading from a snapshot file (see snapshot.py) instead of the Redash API
+        """
+        from snapshot import SnapshotReader
+
+        client = cls.__new__(cls)
+        client.redash = client.snapshot = SnapshotReader(path)
+        client.http_cache = None
+        client._queries = {}
+        client._lock = threading.Lock()
+        client._runtimes = {}
+        return client
 
     def dashboards(self, tags=None):
         """
         Returns a list of dashboards, optionally filtered by tags
         """
-        dashboards = self.redash.dashboards(tags=tags)
-        return [self.get_dashboard(d['id']) for d in dashboards['results']]
+        return [self.get_dashboard(id) for id in self.dashboard_ids(tags=tags)]
 
+    def dashboard_ids(self, tags=None) -> list[int]:
+        """
+        Returns IDs of dashboards, optionally filtered by tags, without fetching their widgets
+        """
+        if self.snapshot is not None:
+            return self.snapshot.tagged('dashboard', tags)
+        return [d['id'] for d in self.redash.dashboards(tags=tags)['results']]
+
+    @phase('fetch')
     def get_dashboard(self, id):
         """
         Returns a dashboard, by id
         """
         return self._build_dashboard_model(self.redash.get_dashboard(id))
 
+    @phase('fetch')
     def queries(self, tags=None, query_id: int | None = None) -> [Query]:
         """
         Returns a list of queries, optionally filtered by tags
         """
         if query_id:
-            query_objs = [self.redash.get_query(query_id)]
-        else:
-            query_objs = self.redash.queries(tags=tags)['results']
+            return [self.get_query(query_id)]
+        query_objs = self.redash.queries(tags=tags)['results']
         return [
             self._build_query_model(q)
             for q in query_objs
         ]
 
+    def query_ids(self, tags=None) -> list[int]:
+        """
+        Returns IDs of queries, optionally filtered by tags
+        """
+        if self.snapshot is not None:
+            return self.snapshot.tagged('query', tags)
+        return [q['id'] for q in self.redash.queries(tags=tags)['results']]
+
+    @phase('fetch')
+    def get_query(self, id) -> Query:
+        """
+        Returns a query, by id. Queries are fetched once and the same model is returned afterwards.
+        """
+        query = self._queries.get(int(id))
+        if query is None:
+            # fetched without holding the lock, so threads only wait on each other to publish the model;
+            # when two threads fetch the same query, the first model published wins
+            fetched = self._build_query_model(self.redash.get_query(id))
+            with self._lock:
+                query = self._queries.setdefault(fetched.id, fetched)
+        return query
+
+    def forget_query(self, id):
+        """
+        Drops a fetched query, so that the next `get_query` fetches its latest version
+        """
+        with self._lock:
+            self._queries.pop(int(id), None)
+
+    def versions(self, kind: str, tags=None) -> dict[int, str]:
+        """
+        Returns the last update time of the queries, dashboards or alerts (optionally filtered by tags), by ID,
+        to detect the objects changed since a previous call
+        """
+        if kind == 'query':
+            objs = self.redash.queries(tags=tags)['results']
+        elif kind == 'dashboard':
+            objs = self.redash.dashboards(tags=tags)['results']
+        elif kind == 'alert':
+            objs = self._filter_alerts(self.redash.alerts(), tags)
+        else:
+            raise ValueError(f"Unknown kind `{kind}`")
+        return {o['id']: o['updated_at'] for o in objs}
+
     def queries_for(self, dashboard) -> [Query]:
         """
         Returns queries linked to a given dashboard, as a list of Query objects
@@ -131,41 +400,33 @@ class RedashClient:
         Returns a query linked to a given widget, as a Query object
         """
         if 'visualization' in widget and 'query' in widget['visualization']:
-            return self.queries(query_id=widget['visualization']['query']['id'])[0]
+            return self.get_query(widget['visualization']['query']['id'])
         return None
 
     def _build_query_model(self, query_obj) -> Query:
         data_source = self.get_sources()[query_obj['data_source_id']]
-        query = Query(
+        # the queries it depends on are fetched (through this client, so that they are shared) and its
+        # visualizations built when first accessed
+        return Query.lazy(
+            self,
+            self._depends_on_ids(query_obj),
+            _encode_options(query_obj.get('visualizations')),
             id=query_obj['id'],
             name=query_obj['name'],
             query_string=query_obj['query'],
             options=query_obj['options'],
             tags=query_obj['tags'],
-            depends_on=self._depends_on_queries(query_obj),
-            source=data_source
-        )
-        if 'visualizations' in query_obj:
-            query.visualizations.extend([
-                self._build_visualization_model(v)
-                for v in query_obj['visualizations']
-            ])
-        return query
-
-    def _build_visualization_model(self, visualization_obj) -> Visualization:
-        return Visualization(
-            id=visualization_obj['id'],
-            type=VisualizationType(visualization_obj['type']),
-            name=visualization_obj['name'],
-            description=visualization_obj['description'],
-            options=visualization_obj['options']
+            source=data_source,
+            schedule=query_obj.get('schedule'),
+            latest_query_data_id=query_obj.get('latest_query_data_id')
         )
 
-    def _depends_on_queries(self, query) -> [Query]:
+    @staticmethod
+    def _depends_on_ids(query) -> list[int]:
         """
         Redash queries can have parameters that are based on other queries
         (see https://redash.io/help/user-guide/querying/query-parameters#Dropdown-Lists).
-        This method generates a list of Query objects that the given query depends on.
+        This method returns the IDs of the queries that the given query depends on.
         """
         params = query['options'].get('parameters')
         if not params:
@@ -174,11 +435,9 @@ class RedashClient:
         def query_id_exists(x):
             return x.get('queryId') is not None
 
-        return [
-            self._build_query_model(self.redash.get_query(p['queryId']))
-            for p in filter(query_id_exists, params)
-        ]
+        return [p['queryId'] for p in filter(query_id_exists, params)]
 
+    @phase('fetch')
     def alerts(self, tags: list[str] = None, alert_id: int = None) -> list[Alert]:
         """
         Returns a list of alerts
@@ -187,11 +446,34 @@ class RedashClient:
             alerts = [self.redash.get_alert(alert_id)]
         else:
             alerts = self.redash.alerts()
+        return [self._build_alert_model(a) for a in self._filter_alerts(alerts, tags)]
+
+    def alert_ids(self, tags: list[str] = None) -> list[int]:
+        """
+        Returns IDs of alerts, optionally filtered by the tags of their queries
+        """
+        return [a['id'] for a in self._filter_alerts(self.redash.alerts(), tags)]
+
+    def alert_ids_by_query(self, tags: list[str] = None) -> dict[int, list[int]]:
+        """
+        Returns IDs of alerts grouped by the ID of their query, optionally filtered by the tags of their queries
+        """
+        result: dict[int, list[int]] = {}
+        for a in self._filter_alerts(self.redash.alerts(), tags):
+            result.setdefault(a['query']['id'], []).append(a['id'])
+        return result
+
+    @phase('fetch')
+    def get_alert(self, id) -> Alert:
+        """
+        Returns an alert, by id
+        """
+        return self._build_alert_model(self.redash.get_alert(id))
+
+    def _filter_alerts(self, alerts, tags: list[str] = None) -> list:
         if tags:  # alerts it-self don't have tags, but queries do
-            alerts_filtered = [a for a in alerts if set(tags).issubset(a["query"]["tags"])]
-        else:
-            alerts_filtered = alerts
-        return [self._build_alert_model(a) for a in alerts_filtered]
+            return [a for a in alerts if set(tags).issubset(a["query"]["tags"])]
+        return alerts
 
     def _build_alert_model(self, alert_obj) -> Alert:
         return Alert(
@@ -222,7 +504,7 @@ class RedashClient:
         options = widget_obj.get('options')
         if 'visualization' in widget_obj:
             query = self.query_for_widget(widget_obj)
-            visualization = {v.id: v for v in query.visualizations}.get(widget_obj['visualization']['id'])
+            visualization = query.visualization(widget_obj['visualization']['id'])
             return Widget(
                 id=widget_obj['id'],
                 text=widget_obj.get('text'),
@@ -241,6 +523,34 @@ class RedashClient:
             width=widget_obj.get('width')
         )
 
+    def _get_query_result(self, path: str, **kwargs):
+        # redash_toolbelt has no method for cached query results: this is the only call to its private `_get`
+        # (which prefixes the Redash URL and raises on error statuses), to change if the toolbelt grows one
+        return self.redash._get(f"api/query_results/{path}", **kwargs)
+
+    def query_runtime(self, query: Query) -> float | None:
+        """
+        Returns the runtime (in seconds) of the latest execution of a query, from its cached result in Redash
+        """
+        if not query.latest_query_data_id:
+            return None
+        if query.latest_query_data_id not in self._runtimes:
+            result = self._get_query_result(str(query.latest_query_data_id)).json()
+            self._runtimes[query.latest_query_data_id] = result['query_result'].get('runtime')
+        return self._runtimes[query.latest_query_data_id]
+
+    @contextmanager
+    def stream_query_result(self, result_id):
+        """
+        Streams a cached query result, as CSV (the file object reads the response as it is downloaded)
+        """
+        response = self._get_query_result(f"{result_id}.csv", stream=True)
+        try:
+            response.raw.decode_content = True
+            yield response.raw
+        finally:
+            response.close()
+
     @lru_cache
     def get_sources(self):
         """
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from redash import Query
+from hlog import LOGGER
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Exporting results needs pyarrow, install it with `pip install redash2dqsql[results]`")
+    return pyarrow
+
+
+class _MixedTypes(Exception):
+    """
+    Raised when a block of a result doesn't fit the column types inferred from the first one
+    """
+
+    def __init__(self, names: list[str]):
+        self.names = names
+        super().__init__("the values don't fit the column types inferred from the first block")
+
+
+@dataclass
+class ExportedResult:
+    """
+    Cached result of a query, exported to a Parquet file
+    """
+    query: Query
+    path: str | None = None
+    rows: int = 0
+    # the columns had mixed types across the result, they were all exported as strings
+    as_strings: bool = False
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def file_name(self) -> str:
+        return f"redash_result_{self.query.id}.parquet"
+
+
+class ResultExporter:
+    """
+    Exports the cached results of queries (their `latest_query_data_id`) to one Parquet file per query, eg to keep
+    results of decommissioned data sources, which can't be computed again in Databricks.
+
+    Results are downloaded as CSV and streamed to Parquet in blocks of `block_size` bytes, whose column types are
+    inferred from the first block, so memory stays bounded by `block_size` for each of the `parallel` concurrent
+    downloads whatever the size of the results. A result whose later blocks don't fit the inferred types is
+    downloaded again, with all its columns as strings.
+    """
+
+    def __init__(self, redash, output_dir: str, parallel: int = 4, block_size: int = 1 << 20):
+        self.pa = _require_pyarrow()
+        self.redash = redash
+        self.output_dir = output_dir
+        self.parallel = parallel
+        self.block_size = block_size
+        os.makedirs(output_dir, exist_ok=True)
+
+    def export(self, queries: list[Query]) -> list[ExportedResult]:
+        """
+        Exports the cached results of the queries which have one, concurrently
+        """
+        cached = [q for q in queries if q.latest_query_data_id]
+        if len(cached) < len(queries):
+            LOGGER.info(f"Skipping {len(queries) - len(cached)} queries without a cached result")
+        results = []
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            futures = [executor.submit(self._export, ExportedResult(q)) for q in cached]
+            for future in as_completed(futures):
+                results.append(future.result())
+        return sorted(results, key=lambda r: r.query.id)
+
+    def _export(self, result: ExportedResult) -> ExportedResult:
+        path = os.path.join(self.output_dir, result.file_name)
+        try:
+            try:
+                result.rows = self._stream(result.query, path)
+            except _MixedTypes as e:
+                LOGGER.info(f"Result of query {result.query.id} has mixed column types ({e.__cause__}), "
+                            f"exporting strings")
+                result.rows = self._stream(result.query, path, {name: self.pa.string() for name in e.names})
+                result.as_strings = True
+            result.path = path
+        except Exception as e:
+            LOGGER.error(f"Failed to export the result of query {result.query.id}: {e}")
+            result.error = e
+        return result
+
+    def _stream(self, query: Query, path: str, column_types: dict | None = None) -> int:
+        """
+        Streams the cached result of a query to a Parquet file
+
+        :return: number of rows
+        """
+        import pyarrow.csv as csv
+        import pyarrow.parquet as pq
+
+        tmp_path = f"{path}.tmp"
+        rows = 0
+        with self.redash.stream_query_result(query.latest_query_data_id) as stream:
+            reader = csv.open_csv(stream, read_options=csv.ReadOptions(block_size=self.block_size),
+                                  convert_options=csv.ConvertOptions(column_types=column_types or {}))
+            try:
+                with pq.ParquetWriter(tmp_path, reader.schema) as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+                        rows += batch.num_rows
+            except self.pa.ArrowInvalid as e:
+                os.remove(tmp_path)
+                raise _MixedTypes(reader.schema.names) from e
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, path)
+        return rows
+
+
+def copy_into_statements(results: list[ExportedResult], location: str, schema: str) -> str:
+    """
+    SQL loading the exported results into Delta tables (one per query) of the given catalog and schema,
+    from the location the Parquet files were uploaded to (eg a Unity Catalog volume), with one `COPY INTO` each
+    """
+    statements = []
+    for result in results:
+        if not result.ok:
+            continue
+        table = f"{schema}.redash_result_{result.query.id}"
+        statements.append(
+            f"-- Redash query {result.query.id}: {result.query.name} ({result.rows} rows)\n"
+            f"CREATE TABLE IF NOT EXISTS {table};\n"
+            f"COPY INTO {table}\n"
+            f"FROM '{location.rstrip('/')}/{result.file_name}'\n"
+            f"FILEFORMAT = PARQUET\n"
+            f"COPY_OPTIONS ('mergeSchema' = 'true');\n"
+        )
+    return '\n'.join(statements)
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from databricks.sdk.errors import NotFound
+
+from hlog import LOGGER
+from workspace_index import PROVENANCE_TAG, list_workspace, original_id, run_id
+
+
+# objects are deleted before the objects they reference: jobs run alerts and queries, dashboards show
+# visualizations of queries, alerts evaluate queries (visualizations are deleted with their query)
+TEARDOWN_ORDER = ('job', 'dashboard', 'alert', 'query')
+
+
+@dataclass
+class Resource:
+    kind: str
+    id: str
+    name: str
+    redash_id: int | None = None
+    run_id: str | None = None
+    tags: set[str] = field(default_factory=set)
+    # Databricks IDs of the queries (for alerts and dashboards) or of the queries and alerts (for jobs) the object uses
+    references: set[str] = field(default_factory=set)
+
+
+def _query_tags(description: str | None) -> set[str]:
+    """
+    Redash tags of a migrated query, listed at the end of its description
+    """
+    _, found, tags = (description or '').partition('tags: ')
+    return {t for t in tags.split(',') if t} if found else set()
+
+
+def _job_references(job) -> set[str]:
+    settings = job.settings
+    references = set(filter(None, ((settings.tags or {}).get('alert_id') or '').split(',')))
+    for task in settings.tasks or []:
+        sql_task = task.sql_task
+        if sql_task is None:
+            continue
+        if sql_task.alert is not None:
+            references.add(sql_task.alert.alert_id)
+        if sql_task.query is not None:
+            references.add(sql_task.query.query_id)
+    return references
+
+
+def _widget_queries(dashboard) -> set[str]:
+    return {w.visualization.query.id for w in dashboard.widgets or []
+            if w.visualization is not None and w.visualization.query is not None}
+
+
+def migrated_resources(client, page_size: int = 250, workers: int = 8) -> list[Resource]:
+    """
+    Lists the objects of a workspace which were migrated from Redash, with their provenance.
+    The migrated dashboards are fetched again (concurrently) when the listing leaves out their widgets.
+    """
+    queries, dashboards, alerts, jobs = list_workspace(client, page_size, expand_tasks=True)
+    dashboards = [d for d in dashboards if PROVENANCE_TAG in (d.tags or [])]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        dashboards = list(executor.map(lambda d: d if d.widgets is not None else client.dashboards.get(d.id),
+                                       dashboards))
+    resources = []
+    for query in queries:
+        if original_id(query.description) is not None:
+            resources.append(Resource('query', query.id, query.name, original_id(query.description),
+                                      run_id(query.description), _query_tags(query.description)))
+    for dashboard in dashboards:
+        tags = set(dashboard.tags)
+        provenance = {t for t in tags if original_id(t) is not None or run_id(t) is not None}
+        resources.append(Resource('dashboard', dashboard.id, dashboard.name,
+                                  next(filter(None, map(original_id, tags)), None),
+                                  next(filter(None, map(run_id, tags)), None),
+                                  tags - provenance - {PROVENANCE_TAG},
+                                  _widget_queries(dashboard)))
+    for alert in alerts:
+        resources.append(Resource('alert', alert.id, alert.name,
+                                  references={alert.query.id} if alert.query is not None else set()))
+    for job in jobs:
+        tags = (job.settings.tags if job.settings else None) or {}
+        if PROVENANCE_TAG in tags:
+            resources.append(Resource('job', str(job.job_id), job.settings.name,
+                                      int(tags['original_id']) if tags.get('original_id') else None,
+                                      tags.get('run_id'), {t for t, v in tags.items() if v == ""},
+                                      _job_references(job)))
+    return resources
+
+
+def select_resources(resources: list[Resource], run_ids=(), tags=(), query_ids=(), dashboard_ids=()) \
+        -> dict[str, list[Resource]]:
+    """
+    Selects the migrated objects to tear down, by migration run, Redash tag or Redash ID, along with the objects
+    depending on them: alerts on the selected queries, and jobs running the selected queries or alerts.
+    The queries shown by the selected dashboards are selected too, unless another migrated dashboard shows them.
+
+    Migrated alerts don't record their run, so they are only selected through their query; the folders created
+    for the dashboards (and their queries) are left in place.
+
+    :return: selected objects, by kind, in teardown order
+    """
+    if not (run_ids or tags or query_ids or dashboard_ids):
+        raise ValueError("Select the objects to roll back by run, tag or Redash ID")
+    run_ids, tags = set(run_ids), set(tags)
+    query_ids, dashboard_ids = {int(i) for i in query_ids}, {int(i) for i in dashboard_ids}
+
+    def matches(resource: Resource, redash_ids: set[int]) -> bool:
+        return (resource.run_id in run_ids
+                or bool(resource.tags & tags)
+                or resource.redash_id in redash_ids)
+
+    by_kind = {kind: [r for r in resources if r.kind == kind] for kind in TEARDOWN_ORDER}
+    selected = {'dashboard': [r for r in by_kind['dashboard'] if matches(r, dashboard_ids)]}
+    dashboard_dbx_ids = {r.id for r in selected['dashboard']}
+    still_shown = {ref for r in by_kind['dashboard'] if r.id not in dashboard_dbx_ids for ref in r.references}
+    shown = {ref for r in selected['dashboard'] for ref in r.references} - still_shown
+    selected['query'] = [r for r in by_kind['query'] if matches(r, query_ids) or r.id in shown]
+    query_dbx_ids = {r.id for r in selected['query']}
+    selected['alert'] = [r for r in by_kind['alert'] if r.references & query_dbx_ids]
+    used = query_dbx_ids | {r.id for r in selected['alert']}
+    selected['job'] = [r for r in by_kind['job'] if matches(r, query_ids) or r.references & used]
+    return {kind: selected[kind] for kind in TEARDOWN_ORDER}
+
+
+class RateLimiter:
+    """
+    Spaces calls shared by several threads to at most `rate` per second
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Teardown:
+    """
+    Deletes migrated objects with a pool of workers, one kind of object after the other (see `TEARDOWN_ORDER`),
+    keeping the overall request rate under the API limits
+    """
+
+    def __init__(self, client, workers: int = 8, rate: float = 10.0):
+        self.client = client
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.deleted: list[Resource] = []
+        self.failed: list[tuple[Resource, str]] = []
+
+    def _delete(self, resource: Resource):
+        self.limiter.wait()
+        try:
+            if resource.kind == 'job':
+                self.client.jobs.delete(int(resource.id))
+            elif resource.kind == 'dashboard':
+                self.client.dashboards.delete(resource.id)
+            elif resource.kind == 'alert':
+                self.client.alerts.delete(resource.id)
+            else:
+                self.client.queries.delete(resource.id)
+        except NotFound:
+            LOGGER.info(f"{resource.kind} {resource.id} was already deleted")
+        except Exception as e:
+            LOGGER.error(f"Failed to delete {resource.kind} {resource.id} `{resource.name}`: {e}")
+            self.failed.append((resource, str(e)))
+            return
+        self.deleted.append(resource)
+
+    def run(self, selected: dict[str, list[Resource]]):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for kind in TEARDOWN_ORDER:
+                # objects of the next kind are only deleted once nothing references them anymore
+                still_used = {ref for resource, _ in self.failed for ref in resource.references}
+                resources = []
+                for resource in selected.get(kind, []):
+                    if resource.id in still_used:
+                        self.failed.append((resource, "still used by objects which couldn't be deleted"))
+                    else:
+                        resources.append(resource)
+                list(executor.map(self._delete, resources))
+                LOGGER.info(f"Deleted {kind}s")
+
+    def report(self) -> str:
+        counts = {}
+        for resource in self.deleted:
+            counts[resource.kind] = counts.get(resource.kind, 0) + 1
+        lines = [f"Deleted {', '.join(f'{counts.get(k, 0)} {k}s' for k in TEARDOWN_ORDER)}"]
+        for resource, error in self.failed:
+            lines.append(f"  failed to delete {resource.kind} {resource.id} `{resource.name}`: {error}")
+        return '\n'.join(lines)
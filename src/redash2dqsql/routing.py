@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Callable
+
+from redash import Query
+
+
+@dataclass
+class RoutingRule:
+    """
+    Sends the queries matching every given criterion to a warehouse.
+    Empty criteria match everything; `tags` match queries having any of the tags.
+    """
+    warehouse_id: str
+    name: str | None = None
+    source_types: list[str] = field(default_factory=list)
+    source_names: list[str] = field(default_factory=list)
+    tags: list[str] = field(default_factory=list)
+    min_runtime: float | None = None
+    max_runtime: float | None = None
+
+    @property
+    def needs_runtime(self) -> bool:
+        return self.min_runtime is not None or self.max_runtime is not None
+
+    def matches(self, query: Query, runtime: float | None) -> bool:
+        source = query.source
+        if self.source_types and (source is None or source.type not in self.source_types):
+            return False
+        if self.source_names and (source is None or source.name not in self.source_names):
+            return False
+        if self.tags and not set(self.tags).intersection(query.tags):
+            return False
+        if self.min_runtime is not None and (runtime is None or runtime < self.min_runtime):
+            return False
+        if self.max_runtime is not None and (runtime is None or runtime > self.max_runtime):
+            return False
+        return True
+
+
+@dataclass
+class WarehouseLoad:
+    queries: int = 0
+    runs_per_day: float = 0.0
+    seconds_per_day: float = 0.0
+
+
+class WarehouseRouter:
+    """
+    Assigns each migrated query to a warehouse, using the first matching rule (or the default warehouse), and keeps
+    track of the projected daily load of every warehouse.
+
+    Warehouse IDs are used the same way as `--warehouse-id`, ie they are passed as `data_source_id` of the queries.
+    Runtimes come from `runtime_of` (eg `RedashClient.query_runtime`), which is only called for scheduled queries
+    and for rules that need them.
+    """
+
+    def __init__(self, rules: list[RoutingRule], default_warehouse_id: str,
+                 runtime_of: Callable[[Query], float | None] | None = None):
+        self.rules = rules
+        self.default_warehouse_id = default_warehouse_id
+        self.runtime_of = runtime_of
+        self.routes: dict[int, str] = {}
+        self.load: dict[str, WarehouseLoad] = {}
+
+    @classmethod
+    def from_file(cls, path: str, default_warehouse_id: str | None = None,
+                  runtime_of: Callable[[Query], float | None] | None = None) -> WarehouseRouter:
+        """
+        Loads rules from a JSON file:
+            {"default": "<warehouse id>", "rules": [{"warehouse_id": "<id>", "source_types": ["athena"], "min_runtime": 30}]}
+        """
+        with open(path) as f:
+            config = json.load(f)
+        default = config.get('default') or default_warehouse_id
+        if not default:
+            raise ValueError(f"No default warehouse in `{path}`")
+        return cls([RoutingRule(**r) for r in config.get('rules', [])], default, runtime_of)
+
+    def _runtime(self, query: Query) -> float | None:
+        if self.runtime_of is None:
+            return None
+        return self.runtime_of(query)
+
+    def route(self, query: Query) -> str:
+        """
+        Returns the warehouse of a query, the same one every time it is asked for
+        """
+        if query.id in self.routes:
+            return self.routes[query.id]
+
+        runtime = None
+        if query.runs_per_day or any(r.needs_runtime for r in self.rules):
+            runtime = self._runtime(query)
+        warehouse_id = next(
+            (r.warehouse_id for r in self.rules if r.matches(query, runtime)),
+            self.default_warehouse_id
+        )
+
+        load = self.load.setdefault(warehouse_id, WarehouseLoad())
+        load.queries += 1
+        load.runs_per_day += query.runs_per_day
+        load.seconds_per_day += query.runs_per_day * (runtime or 0)
+        self.routes[query.id] = warehouse_id
+        return warehouse_id
+
+    def report(self) -> str:
+        lines = ["Projected load per warehouse:"]
+        for warehouse_id, load in sorted(self.load.items(), key=lambda i: -i[1].seconds_per_day):
+            lines.append(f"  {warehouse_id}: {load.queries} queries, {load.runs_per_day:.0f} scheduled runs/day, "
+                         f"{load.seconds_per_day / 3600:.1f} compute hours/day (known runtimes)")
+        return '\n'.join(lines)
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import math
+
+from hlog import LOGGER
+
+
+MINUTES_PER_DAY = 1440
+
+_DAYS_OF_WEEK = {
+    'sunday': 'SUN', 'monday': 'MON', 'tuesday': 'TUE', 'wednesday': 'WED',
+    'thursday': 'THU', 'friday': 'FRI', 'saturday': 'SAT',
+}
+
+
+def is_fixed_time(schedule: dict) -> bool:
+    """
+    Whether a Redash schedule runs at a given time of the day (daily, every N days or weekly schedules)
+    """
+    return bool(schedule.get('time')) or schedule.get('interval', 0) >= 86400
+
+
+def _parse_time(schedule: dict) -> tuple[int, int]:
+    hours, minutes = (schedule.get('time') or '00:00').split(':')[:2]
+    return int(hours), int(minutes)
+
+
+def fixed_time_quartz_expression(schedule: dict) -> str:
+    """
+    Builds a quartz expression from a Redash daily / every N days / weekly schedule (times are UTC in Redash)
+    """
+    hours, minutes = _parse_time(schedule)
+    days = max(schedule['interval'] // 86400, 1)
+    if schedule.get('until'):
+        LOGGER.warning(f"Schedule end date `{schedule['until']}` isn't migrated")
+
+    if schedule.get('day_of_week'):
+        day_of_week = _DAYS_OF_WEEK.get(schedule['day_of_week'].lower(), schedule['day_of_week'][:3].upper())
+        return f"0 {minutes} {hours} ? * {day_of_week} *"
+    if days % 7 == 0 and days > 1:
+        raise ValueError(f"Weekly schedules need a day of week: {schedule}")
+    if days == 1:
+        return f"0 {minutes} {hours} * * ? *"
+    return f"0 {minutes} {hours} 1/{days} * ? *"
+
+
+def interval_quartz_expression(interval: int) -> str:
+    """
+    Builds a quartz expression from an interval, starting at the top of the period
+    """
+    if interval < 60:
+        seconds = f"*/{interval}"
+        minutes = "*"
+        hours = "*"
+    elif interval < 3600:
+        seconds = f"{interval % 60}"
+        minutes = f"*/{interval // 60}"
+        hours = "*"
+    elif interval < 86400:
+        seconds = f"{interval % 60}"
+        minutes = f"{(interval // 60) % 60}"
+        hours = f"*/{(interval // 60) // 60}"
+    else:
+        raise ValueError("Interval is too large")
+
+    return f"{seconds} {minutes} {hours} ? * * *"
+
+
+def quartz_expression(schedule: dict, planner: SchedulePlanner | None = None, runtime: float | None = None,
+                      query_id: int | None = None) -> str:
+    """
+    Quartz cron expression of a Redash schedule.
+    With a planner, interval schedules are staggered according to the runtime of the query
+    (given, or known to the planner by Redash query id).
+    """
+    if not schedule.get('interval'):
+        raise ValueError("Only interval-based schedules are supported")
+    if planner:
+        return planner.plan(schedule, runtime, query_id)
+    if is_fixed_time(schedule):
+        return fixed_time_quartz_expression(schedule)
+    return interval_quartz_expression(schedule['interval'])
+
+
+class SchedulePlanner:
+    """
+    Spreads migrated schedules over time, instead of starting every N-minute schedule at minute 0.
+
+    The planner keeps a per-minute histogram of the expected warehouse load over a day (number of queries running
+    in each minute, given their runtime). Each new interval schedule gets the phase offset that keeps the peak,
+    then the overall spread, of that histogram lowest. Fixed-time schedules (daily, weekly) keep their time but
+    still count towards the load. Planning is online: schedules can be added one by one, as they are migrated.
+    """
+
+    def __init__(self, default_runtime: float = 60.0, runtimes: dict[int, float] | None = None):
+        self.default_runtime = default_runtime
+        # known runtimes (in seconds), by Redash query id
+        self.runtimes = runtimes or {}
+        self.load = [0.0] * MINUTES_PER_DAY
+
+    def plan(self, schedule: dict, runtime: float | None = None, query_id: int | None = None) -> str:
+        """
+        Returns the quartz expression of a Redash schedule, staggered against the schedules planned so far.
+        The runtime of the scheduled query is either given, or looked up by its Redash query id.
+        """
+        runtime = runtime or self.runtimes.get(query_id) or self.default_runtime
+        duration = max(math.ceil(runtime / 60), 1)
+
+        if is_fixed_time(schedule):
+            hours, minutes = _parse_time(schedule)
+            weight = 1 / max(schedule['interval'] // 86400, 1)
+            self._add([hours * 60 + minutes], duration, weight)
+            return fixed_time_quartz_expression(schedule)
+
+        interval = schedule['interval']
+        if interval < 60 or interval % 60 or (interval >= 3600 and interval % 3600):
+            # sub-minute and non-aligned intervals can't be phase shifted with a quartz expression
+            return interval_quartz_expression(interval)
+
+        period = interval // 60
+        best = min(range(period), key=lambda offset: self._cost(self._starts(period, offset), duration))
+        self._add(self._starts(period, best), duration)
+        return self._quartz_expression(period, best)
+
+    @staticmethod
+    def _starts(period: int, offset: int) -> list[int]:
+        """
+        Minutes of the day at which an interval schedule starts, following quartz semantics
+        (minute increments restart every hour, hour increments restart every day)
+        """
+        if period < 60:
+            return [hour * 60 + minute for hour in range(24) for minute in range(offset, 60, period)]
+        return [hour * 60 + offset % 60 for hour in range(offset // 60, 24, period // 60)]
+
+    @staticmethod
+    def _quartz_expression(period: int, offset: int) -> str:
+        if period < 60:
+            return f"0 {offset}/{period} * ? * * *"
+        return f"0 {offset % 60} {offset // 60}/{period // 60} ? * * *"
+
+    def _cost(self, starts: list[int], duration: int) -> tuple[float, float]:
+        added = {}
+        for start in starts:
+            for minute in range(start, start + duration):
+                minute %= MINUTES_PER_DAY
+                added[minute] = added.get(minute, 0) + 1
+        loads = [self.load[m] + n for m, n in added.items()]
+        return max(loads), sum(x * x for x in loads)
+
+    def _add(self, starts: list[int], duration: int, weight: float = 1.0):
+        for start in starts:
+            for minute in range(start, start + duration):
+                self.load[minute % MINUTES_PER_DAY] += weight
+
+    @property
+    def peak(self) -> float:
+        return max(self.load)
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from hlog import LOGGER
+
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class LeaseStore:
+    """
+    Work queue shared by migration workers, backed by a SQLite database.
+
+    Any number of processes (or machines sharing the database file) can seed the same units of work;
+    each unit is handed out to one worker at a time under a lease. Workers renew their leases with
+    heartbeats, so when a worker crashes its leases expire and the items are claimed by another worker.
+    Units of work belong to a migration run (`run_id`): the workers of a run share its items, and a later run
+    against the same database seeds and migrates its own.
+
+    The store also keeps the mapping of migrated Redash queries, so workers don't re-create queries
+    that another worker has already migrated, and the objects the workers quarantined (see `quarantine.Quarantine`).
+    """
+
+    def __init__(self, path: str, worker_id: str | None = None, lease_seconds: int = 300, max_attempts: int = 3,
+                 run_id: str | None = None):
+        self.path = path
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.run_id = run_id or ''
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS work_items (
+                    run_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    PRIMARY KEY (run_id, kind, item_id)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS id_map (
+                    kind TEXT NOT NULL,
+                    redash_id TEXT NOT NULL,
+                    dbx_data TEXT NOT NULL,
+                    PRIMARY KEY (kind, redash_id)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS quarantine (
+                    kind TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    entry TEXT NOT NULL,
+                    PRIMARY KEY (kind, item_id)
+                )
+            """)
+
+    def close(self):
+        self._conn.close()
+
+    def seed(self, kind: str, item_ids):
+        """
+        Registers units of work; items already known to the store (in any state) are left untouched
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO work_items (run_id, kind, item_id) VALUES (?, ?, ?)",
+                [(self.run_id, kind, str(i)) for i in item_ids]
+            )
+
+    def retry(self, kind: str, item_ids):
+        """
+        Makes the given failed items pending again, with all their attempts, so that workers claim them once more
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE work_items SET status = ?, owner = NULL, lease_expires = NULL, attempts = 0, error = NULL "
+                "WHERE run_id = ? AND kind = ? AND item_id = ? AND status = ?",
+                [(PENDING, self.run_id, kind, str(i), FAILED) for i in item_ids]
+            )
+
+    def claim(self, kind: str) -> str | None:
+        """
+        Leases the next available item of the given kind to this worker.
+        Items whose lease has expired (ie their worker stopped sending heartbeats) are claimed again,
+        until they run out of attempts.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE work_items SET status = ?, owner = NULL, error = ? "
+                    "WHERE run_id = ? AND kind = ? AND status = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, 'lease expired too many times', self.run_id, kind, LEASED, now, self.max_attempts)
+                )
+                row = self._conn.execute(
+                    "SELECT item_id FROM work_items "
+                    "WHERE run_id = ? AND kind = ? AND (status = ? OR (status = ? AND lease_expires < ?)) "
+                    "ORDER BY attempts, item_id LIMIT 1",
+                    (self.run_id, kind, PENDING, LEASED, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE work_items SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE run_id = ? AND kind = ? AND item_id = ?",
+                    (LEASED, self.worker_id, now + self.lease_seconds, self.run_id, kind, row[0])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row[0]
+
+    def heartbeat(self) -> int:
+        """
+        Extends all leases held by this worker, returns the number of renewed leases
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE work_items SET lease_expires = ? WHERE run_id = ? AND status = ? AND owner = ?",
+                (time.time() + self.lease_seconds, self.run_id, LEASED, self.worker_id)
+            )
+        return cursor.rowcount
+
+    def complete(self, kind: str, item_id, result=None):
+        self._finish(kind, item_id, DONE, result=result)
+
+    def fail(self, kind: str, item_id, error):
+        self._finish(kind, item_id, FAILED, error=error)
+
+    def _finish(self, kind: str, item_id, status: str, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE work_items SET status = ?, lease_expires = NULL, result = ?, error = ? "
+                "WHERE run_id = ? AND kind = ? AND item_id = ? AND owner = ?",
+                (status, json.dumps(result) if result is not None else None,
+                 str(error) if error is not None else None, self.run_id, kind, str(item_id), self.worker_id)
+            )
+
+    def counts(self, kind: str) -> dict[str, int]:
+        """
+        Returns the number of items of the given kind per status, in the run
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM work_items WHERE run_id = ? AND kind = ? GROUP BY status",
+                (self.run_id, kind)
+            ).fetchall()
+        return dict(rows)
+
+    def read_mapping(self, kind: str, redash_id) -> tuple | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dbx_data FROM id_map WHERE kind = ? AND redash_id = ?", (kind, str(redash_id))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_mapping(self, kind: str, redash_id, dbx_data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO id_map (kind, redash_id, dbx_data) VALUES (?, ?, ?)",
+                (kind, str(redash_id), json.dumps(dbx_data))
+            )
+
+    def quarantined(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT entry FROM quarantine ORDER BY rowid").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add_quarantined(self, entry: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO quarantine (kind, item_id, entry) VALUES (?, ?, ?)",
+                (entry['kind'], entry['id'], json.dumps(entry))
+            )
+
+    def remove_quarantined(self, kind: str, item_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM quarantine WHERE kind = ? AND item_id = ?", (kind, str(item_id)))
+
+    def forget(self, kind: str, redash_id, mapping_kind: str | None = None):
+        """
+        Drops the mapping and the work items of an object whose migration was rolled back, so it is migrated again.
+        Mappings kept apart per workspace (see `fanout.NamespacedStore`) are stored under their own `mapping_kind`.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM id_map WHERE kind = ? AND redash_id = ?",
+                               (mapping_kind or kind, str(redash_id)))
+            self._conn.execute("DELETE FROM work_items WHERE kind = ? AND item_id = ?", (kind, str(redash_id)))
+
+
+class Heartbeat:
+    """
+    Background thread renewing the leases of a worker while it is busy
+    """
+
+    def __init__(self, store: LeaseStore, interval: float | None = None):
+        self.store = store
+        self.interval = interval or max(store.lease_seconds / 3, 1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-heartbeat', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.store.heartbeat()
+            except sqlite3.Error as e:
+                LOGGER.warning(f"Failed to renew leases of worker {self.store.worker_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class WorkQueue:
+    """
+    Iterates over the IDs of the objects this process should migrate.
+
+    Without a store, all given IDs are yielded. With a store, the IDs are seeded into the shared queue and
+    only the items claimed by this worker are yielded; callers report the outcome via `done` or `failed`.
+    When retrying (e.g. the quarantined objects), the given items which failed before are claimed again.
+    """
+
+    def __init__(self, store: LeaseStore | None, kind: str, item_ids, retry: bool = False):
+        self.store = store
+        self.kind = kind
+        self.item_ids = list(item_ids)
+        self.retry = retry
+
+    def __iter__(self):
+        if self.store is None:
+            yield from self.item_ids
+            return
+
+        self.store.seed(self.kind, self.item_ids)
+        if self.retry:
+            self.store.retry(self.kind, self.item_ids)
+        with Heartbeat(self.store):
+            while (item_id := self.store.claim(self.kind)) is not None:
+                LOGGER.info(f"Worker {self.store.worker_id} claimed {self.kind} {item_id}")
+                yield item_id
+
+    def done(self, item_id, result=None):
+        if self.store is not None:
+            self.store.complete(self.kind, item_id, result)
+
+    def failed(self, item_id, error):
+        if self.store is not None:
+            self.store.fail(self.kind, item_id, error)
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import hashlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import sqlglot.errors
+from sqlglot import Dialect, exp, parse_one
+
+from redash import Query
+from dedup import normalize_sql
+from transform import TARGET_DIALECT, mask_query_params
+
+
+_MAX_HASH = (1 << 64) - 1
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def token_shingles(sql: str, k: int = 5, dialect=TARGET_DIALECT) -> set[int]:
+    """
+    Hashed k-token shingles of the normalized query
+    """
+    normalized = normalize_sql(sql, dialect)
+    try:
+        tokens = [t.text.lower() for t in Dialect.get_or_raise(dialect).tokenize(normalized)]
+    except sqlglot.errors.SqlglotError:
+        tokens = normalized.split()
+    if len(tokens) <= k:
+        return {_hash(' '.join(tokens))}
+    return {_hash(' '.join(tokens[i:i + k])) for i in range(len(tokens) - k + 1)}
+
+
+def ast_shingles(sql: str, depth: int = 4, dialect=TARGET_DIALECT) -> set[int]:
+    """
+    Hashed AST paths: the types of the (up to `depth`) ancestors of every leaf, with the leaf value.
+    Less sensitive to formatting and clause order than token shingles.
+    """
+    masked, _ = mask_query_params(sql)
+    try:
+        tree = parse_one(masked, read=dialect)
+    except sqlglot.errors.SqlglotError:
+        return token_shingles(sql, dialect=dialect)
+    if tree is None:
+        return set()
+
+    result = set()
+    for node in tree.walk():
+        if not isinstance(node, (exp.Identifier, exp.Literal, exp.Star)):
+            continue
+        path = []
+        parent = node.parent
+        while parent is not None and len(path) < depth:
+            path.append(type(parent).__name__)
+            parent = parent.parent
+        result.add(_hash('/'.join(reversed(path)) + ':' + str(node.this).lower()))
+    return result
+
+
+def minhash(shingles: set[int], num_perm: int = 128) -> tuple[int, ...]:
+    """
+    MinHash signature computed with one permutation hashing: every shingle is hashed once into one of `num_perm` bins
+    and each bin keeps its minimum, so the cost is linear in the number of shingles rather than in `num_perm` times that.
+    Empty bins are filled from the next non-empty bin (rotation densification).
+    """
+    bins = [_MAX_HASH] * num_perm
+    for h in shingles:
+        index, value = h % num_perm, h // num_perm
+        if value < bins[index]:
+            bins[index] = value
+    if all(b == _MAX_HASH for b in bins):
+        return tuple(bins)
+
+    for i in range(num_perm):
+        j, offset = i, 0
+        while bins[j] == _MAX_HASH:
+            j = (j + 1) % num_perm
+            offset += 1
+        if offset:
+            bins[i] = (bins[j] + offset * 0x9E3779B97F4A7C15) & _MAX_HASH
+    return tuple(bins)
+
+
+def estimate_similarity(first: tuple[int, ...], second: tuple[int, ...]) -> float:
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+def lsh_parameters(num_perm: int, threshold: float) -> tuple[int, int]:
+    """
+    Picks the (bands, rows) split of a signature whose LSH probability curve `1 - (1 - s^rows)^bands`
+    has its threshold `(1 / bands) ^ (1 / rows)` closest to the requested similarity threshold
+    """
+    candidates = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(candidates, key=lambda c: abs((1 / c[0]) ** (1 / c[1]) - threshold))
+
+
+@dataclass
+class Cluster:
+    queries: list[Query]
+    similarity: float
+    pairs: list[tuple[int, int, float]] = field(default_factory=list)
+
+    @property
+    def runs_per_day(self) -> float:
+        return sum(q.runs_per_day for q in self.queries)
+
+    @property
+    def score(self) -> float:
+        """
+        Redundant warehouse load collapsed by consolidating the cluster: every query but one, weighted by
+        how often they are refreshed (unscheduled queries still count once)
+        """
+        loads = sorted((max(q.runs_per_day, 1.0) for q in self.queries), reverse=True)
+        return sum(loads[1:]) * self.similarity
+
+    def as_dict(self) -> dict:
+        return {
+            'size': len(self.queries),
+            'similarity': round(self.similarity, 3),
+            'runs_per_day': round(self.runs_per_day, 1),
+            'score': round(self.score, 1),
+            'queries': [{'id': q.id, 'name': q.name, 'tags': list(q.tags)} for q in self.queries],
+        }
+
+
+class SimilarityIndex:
+    """
+    Finds clusters of near-duplicate queries with MinHash and locality-sensitive hashing:
+    only queries sharing at least one LSH bucket are compared, so the cost stays sub-quadratic.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 5, ast: bool = False,
+                 dialect=TARGET_DIALECT):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.ast = ast
+        self.dialect = dialect
+        self.bands, self.rows = lsh_parameters(num_perm, threshold)
+
+        self.queries: dict[int, Query] = {}
+        self.signatures: dict[int, tuple[int, ...]] = {}
+        self.buckets: dict[tuple[int, int], list[int]] = defaultdict(list)
+
+    def add(self, query: Query):
+        if query.id in self.queries:
+            return
+        if self.ast:
+            shingles = ast_shingles(query.query_string, dialect=self.dialect)
+        else:
+            shingles = token_shingles(query.query_string, self.shingle_size, self.dialect)
+        signature = minhash(shingles, self.num_perm)
+
+        self.queries[query.id] = query
+        self.signatures[query.id] = signature
+        for band in range(self.bands):
+            key = hash(signature[band * self.rows:(band + 1) * self.rows])
+            self.buckets[(band, key)].append(query.id)
+
+    def clusters(self) -> list[Cluster]:
+        """
+        Returns clusters of similar queries, ranked by the redundant load they represent
+        """
+        parent = {qid: qid for qid in self.queries}
+
+        def find(qid):
+            while parent[qid] != qid:
+                parent[qid] = parent[parent[qid]]
+                qid = parent[qid]
+            return qid
+
+        pairs = {}
+        for members in self.buckets.values():
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    key = (min(first, second), max(first, second))
+                    if key in pairs:
+                        continue
+                    similarity = estimate_similarity(self.signatures[first], self.signatures[second])
+                    pairs[key] = similarity
+                    if similarity >= self.threshold:
+                        parent[find(first)] = find(second)
+
+        groups = defaultdict(list)
+        for qid in self.queries:
+            groups[find(qid)].append(qid)
+        similar_pairs = defaultdict(list)
+        for (first, second), similarity in pairs.items():
+            if similarity >= self.threshold:
+                similar_pairs[find(first)].append((first, second, similarity))
+
+        clusters = []
+        for root, members in groups.items():
+            if len(members) < 2:
+                continue
+            members = sorted(members)
+            cluster_pairs = similar_pairs[root]
+            clusters.append(Cluster(
+                queries=[self.queries[qid] for qid in members],
+                similarity=sum(s for _, _, s in cluster_pairs) / len(cluster_pairs),
+                pairs=cluster_pairs,
+            ))
+        return sorted(clusters, key=lambda c: (-c.score, -len(c.queries)))
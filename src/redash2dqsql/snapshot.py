@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import bisect
+import json
+import mmap
+import os
+import struct
+
+from hlog import LOGGER
+
+
+MAGIC = b'R2DSNAP1'
+KINDS = ('query', 'dashboard', 'alert')
+
+_LENGTH = struct.Struct('<I')
+_FOOTER = struct.Struct('<Q8s')
+# entries of the id indexes: Redash id, offset of its record
+_ENTRY = struct.Struct('<qQ')
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot of a Redash instance: a single file holding the raw API objects (queries, dashboards,
+    alerts and data sources) as length-prefixed JSON records, followed by precomputed indexes:
+
+        MAGIC
+        records                 <u32 length><JSON>, one per object
+        id indexes              per kind, sorted (id, offset) pairs, searched in place
+        tag indexes             per kind, JSON {tag: [ids]}
+        data source index       JSON {data source id: [query ids]}
+        directory               JSON {section: offset}
+        <u64 directory offset> MAGIC
+
+    Objects are streamed to the file as they are added; only their ids and offsets are kept in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(MAGIC)
+        self._offsets: dict[str, list[tuple[int, int]]] = {kind: [] for kind in KINDS}
+        self._tags: dict[str, dict[str, list[int]]] = {kind: {} for kind in KINDS}
+        self._data_sources: dict[str, list[int]] = {}
+        self._directory: dict[str, int] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+    def _record(self, payload: bytes) -> int:
+        offset = self._file.tell()
+        self._file.write(_LENGTH.pack(len(payload)))
+        self._file.write(payload)
+        return offset
+
+    def _json_record(self, obj) -> int:
+        return self._record(json.dumps(obj, separators=(',', ':')).encode())
+
+    def add(self, kind: str, obj: dict):
+        """
+        Adds a raw API object (as returned by `api/queries/<id>`, `api/dashboards/<id>` or `api/alerts/<id>`)
+        """
+        offset = self._json_record(obj)
+        self._offsets[kind].append((obj['id'], offset))
+        # alerts have no tags, they are filtered by the tags of their query
+        tags = obj.get('tags') if kind != 'alert' else obj.get('query', {}).get('tags')
+        for tag in tags or ():
+            self._tags[kind].setdefault(tag, []).append(obj['id'])
+        if kind == 'query' and obj.get('data_source_id') is not None:
+            self._data_sources.setdefault(str(obj['data_source_id']), []).append(obj['id'])
+
+    @property
+    def counts(self) -> dict[str, int]:
+        return {kind: len(offsets) for kind, offsets in self._offsets.items()}
+
+    def add_data_sources(self, data_sources: list[dict]):
+        self._directory['data_sources'] = self._json_record(data_sources)
+
+    def close(self):
+        for kind in KINDS:
+            entries = sorted(self._offsets[kind])
+            self._directory[f"{kind}_ids"] = self._record(b''.join(_ENTRY.pack(i, o) for i, o in entries))
+            self._directory[f"{kind}_tags"] = self._json_record(self._tags[kind])
+        self._directory['query_data_sources'] = self._json_record(self._data_sources)
+        directory_offset = self._json_record(self._directory)
+        self._file.write(_FOOTER.pack(directory_offset, MAGIC))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        LOGGER.info(f"Wrote snapshot `{self.path}`: {self.counts}")
+
+
+class SnapshotReader:
+    """
+    Reads a snapshot written by `SnapshotWriter`, with the methods of the Redash API client used by
+    `RedashClient`, so that `RedashClient.from_snapshot` works offline.
+
+    The file is memory-mapped: opening it only reads the directory, indexes are decoded on first use
+    (id lookups are binary searches over the mapped index), and lookups only decode the records they return.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < len(MAGIC) + _FOOTER.size or self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"`{path}` is not a snapshot")
+        directory_offset, magic = _FOOTER.unpack_from(self._mmap, len(self._mmap) - _FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"Snapshot `{path}` is truncated")
+        self._directory = self._json(directory_offset)
+        self._tags: dict[str, dict[str, list[int]]] = {}
+        self._data_sources: dict[str, list[int]] | None = None
+
+    def close(self):
+        self._mmap.close()
+
+    def _payload(self, offset: int) -> memoryview:
+        (length,) = _LENGTH.unpack_from(self._mmap, offset)
+        start = offset + _LENGTH.size
+        return memoryview(self._mmap)[start:start + length]
+
+    def _json(self, offset: int):
+        with self._payload(offset) as payload:
+            return json.loads(bytes(payload))
+
+    def _index(self, kind: str) -> memoryview:
+        return self._payload(self._directory[f"{kind}_ids"])
+
+    def ids(self, kind: str) -> list[int]:
+        with self._index(kind) as index:
+            return [i for i, _ in _ENTRY.iter_unpack(index)]
+
+    def _offset(self, kind: str, redash_id) -> int:
+        with self._index(kind) as index:
+            entries = len(index) // _ENTRY.size
+            position = bisect.bisect_left(range(entries), int(redash_id),
+                                          key=lambda i: _ENTRY.unpack_from(index, i * _ENTRY.size)[0])
+            if position < entries:
+                found, offset = _ENTRY.unpack_from(index, position * _ENTRY.size)
+                if found == int(redash_id):
+                    return offset
+        raise KeyError(f"No {kind} {redash_id} in snapshot `{self.path}`")
+
+    def get(self, kind: str, redash_id) -> dict:
+        return self._json(self._offset(kind, redash_id))
+
+    def tagged(self, kind: str, tags) -> list[int]:
+        """
+        IDs of the objects having all the given tags (all the objects without tags)
+        """
+        if not tags:
+            return self.ids(kind)
+        if kind not in self._tags:
+            self._tags[kind] = self._json(self._directory[f"{kind}_tags"])
+        selected = set.intersection(*(set(self._tags[kind].get(tag, ())) for tag in tags))
+        return sorted(selected)
+
+    def query_ids_for_data_source(self, data_source_id) -> list[int]:
+        if self._data_sources is None:
+            self._data_sources = self._json(self._directory['query_data_sources'])
+        return self._data_sources.get(str(data_source_id), [])
+
+    # methods of the Redash API client (redash_toolbelt.Redash) used by RedashClient
+
+    def queries(self, tags=None, **kwargs) -> dict:
+        results = [self.get('query', i) for i in self.tagged('query', tags)]
+        return {'results': results, 'count': len(results)}
+
+    def get_query(self, id) -> dict:
+        return self.get('query', id)
+
+    def dashboards(self, tags=None, **kwargs) -> dict:
+        results = [self.get('dashboard', i) for i in self.tagged('dashboard', tags)]
+        return {'results': results, 'count': len(results)}
+
+    def get_dashboard(self, id) -> dict:
+        return self.get('dashboard', id)
+
+    def alerts(self) -> list[dict]:
+        return [self.get('alert', i) for i in self.ids('alert')]
+
+    def get_alert(self, alert_id) -> dict:
+        return self.get('alert', alert_id)
+
+    def get_data_sources(self) -> list[dict]:
+        return self._json(self._directory['data_sources']) if 'data_sources' in self._directory else []
+
+    def _get(self, path: str):
+        # only used for query results (runtimes), which snapshots don't hold
+        return _NoResult()
+
+
+class _NoResult:
+    @staticmethod
+    def json() -> dict:
+        return {'query_result': {}}
+
+
+def write_snapshot(redash_api, path: str, tags=None) -> SnapshotWriter:
+    """
+    Writes a snapshot of the objects (optionally only the ones with the given tags) of a Redash API client.
+    The queries the written objects refer to (widgets of dashboards, queries of alerts, dropdown parameters
+    of queries) are written too, whatever their tags, so that every object of the snapshot can be read back.
+    """
+    with SnapshotWriter(path) as writer:
+        written: set[int] = set()
+        referenced: list[int] = []
+
+        def add_query(query: dict):
+            writer.add('query', query)
+            written.add(query['id'])
+            referenced.extend(p['queryId'] for p in query['options'].get('parameters') or ()
+                              if p.get('queryId') is not None)
+
+        writer.add_data_sources(redash_api.get_data_sources())
+        for q in redash_api.queries(tags=tags)['results']:
+            add_query(redash_api.get_query(q['id']))
+        for d in redash_api.dashboards(tags=tags)['results']:
+            dashboard = redash_api.get_dashboard(d['id'])
+            writer.add('dashboard', dashboard)
+            referenced.extend(w['visualization']['query']['id'] for w in dashboard['widgets']
+                              if 'query' in w.get('visualization', {}))
+        for a in redash_api.alerts():
+            if not tags or set(tags).issubset(a['query']['tags']):
+                alert = redash_api.get_alert(a['id'])
+                writer.add('alert', alert)
+                referenced.append(alert['query']['id'])
+        while referenced:
+            query_id = referenced.pop()
+            if query_id not in written:
+                add_query(redash_api.get_query(query_id))
+    return writer
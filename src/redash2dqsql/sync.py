@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from databricks.sdk.errors import NotFound
+
+from redash import RedashClient
+from dbsql import DBXClient
+from transform import transform_query
+from hlog import LOGGER
+
+
+# queries first, so that alerts and dashboards find them migrated
+KINDS = ('query', 'alert', 'dashboard')
+PHASES = ('poll', 'fetch', 'transform', 'push')
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _labels(labels: dict) -> str:
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}' if labels else ''
+
+
+class Histogram:
+    """
+    Cumulative histogram, rendered in the Prometheus text format
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name: str, labels: dict) -> list[str]:
+        lines = [f"{name}_bucket{_labels({**labels, 'le': bound})} {n}" for bound, n in zip(self.buckets, self.counts)]
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {self.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+class SyncMetrics:
+    """
+    Metrics of a sync daemon:
+        - sync lag: seconds since the start of the last cycle which synced every change
+        - latency of each phase (polling Redash for changes, fetching, transforming and pushing an object)
+        - synced and failed objects, and errors by phase (`fetch` errors are Redash API errors, `push` errors
+          Databricks API errors)
+        - queue depth: changes left to sync in the current cycle
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {phase: Histogram() for phase in PHASES}
+        self.objects: dict[tuple[str, str], int] = {}
+        self.errors: dict[tuple[str, str], int] = {}
+        self.cycles = 0
+        self.queue_depth = 0
+        self.synced_at: float | None = None
+        self.started_at = time.time()
+
+    @contextmanager
+    def timed(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.latency[phase].observe(time.perf_counter() - start)
+
+    def count(self, kind: str, outcome: str):
+        with self._lock:
+            self.objects[(kind, outcome)] = self.objects.get((kind, outcome), 0) + 1
+
+    def error(self, kind: str, phase: str):
+        with self._lock:
+            self.errors[(kind, phase)] = self.errors.get((kind, phase), 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            lag = time.time() - (self.synced_at or self.started_at)
+            lines = [
+                '# HELP redash2dqsql_sync_lag_seconds Seconds since the start of the last fully synced cycle',
+                '# TYPE redash2dqsql_sync_lag_seconds gauge',
+                f'redash2dqsql_sync_lag_seconds {lag}',
+                '# HELP redash2dqsql_sync_queue_depth Changes left to sync in the current cycle',
+                '# TYPE redash2dqsql_sync_queue_depth gauge',
+                f'redash2dqsql_sync_queue_depth {self.queue_depth}',
+                '# HELP redash2dqsql_sync_cycles_total Completed sync cycles',
+                '# TYPE redash2dqsql_sync_cycles_total counter',
+                f'redash2dqsql_sync_cycles_total {self.cycles}',
+                '# HELP redash2dqsql_sync_phase_seconds Latency of the sync phases',
+                '# TYPE redash2dqsql_sync_phase_seconds histogram',
+            ]
+            for phase, histogram in self.latency.items():
+                lines.extend(histogram.render('redash2dqsql_sync_phase_seconds', {'phase': phase}))
+            lines += ['# HELP redash2dqsql_sync_objects_total Synced objects, by kind and outcome',
+                      '# TYPE redash2dqsql_sync_objects_total counter']
+            lines += [f"redash2dqsql_sync_objects_total{_labels({'kind': k, 'outcome': o})} {n}"
+                      for (k, o), n in sorted(self.objects.items())]
+            lines += ['# HELP redash2dqsql_sync_errors_total Errors by kind and phase (fetch: Redash API, '
+                      'push: Databricks API)',
+                      '# TYPE redash2dqsql_sync_errors_total counter']
+            lines += [f"redash2dqsql_sync_errors_total{_labels({'kind': k, 'phase': p})} {n}"
+                      for (k, p), n in sorted(self.errors.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(metrics: SyncMetrics, port: int, host: str = '') -> ThreadingHTTPServer:
+    """
+    Serves the metrics on `http://host:port/metrics`, from a background thread
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    LOGGER.info(f"Serving metrics on port {server.server_port}")
+    return server
+
+
+class SyncDaemon:
+    """
+    Keeps a workspace in sync with Redash: every `interval` seconds, polls the update times of the queries,
+    alerts and dashboards, and pushes the changed (or new) ones through the Databricks client.
+
+    The clients are kept for the life of the daemon, so their connections and caches stay warm; only the changed
+    queries are fetched again. Changed queries and alerts are updated in place, changed dashboards are created
+    again. Schedule changes are applied to the jobs refreshing the queries and evaluating the alerts, which are
+    found through the workspace index of the client. Failed objects are retried on the next cycle.
+    The versions seen and the Databricks ids of the queries, dashboards and alerts are kept in `state_path`
+    (if given), so that a restarted daemon updates the objects it created instead of creating them again.
+    Objects migrated by other runs are found through the workspace index of the client, if it has one
+    (see `DBXClient.index`).
+    """
+
+    def __init__(self, redash: RedashClient, dbx: DBXClient, target_folder: str, interval: float = 300,
+                 tags=None, kinds=KINDS, source_dialect: str | None = None, transform: bool = True, optimizer=None,
+                 destination_id: str | None = None, warehouse_id: str | None = None, run_as: str | None = None,
+                 metrics: SyncMetrics | None = None, state_path: str | None = None):
+        self.redash = redash
+        self.dbx = dbx
+        self.target_folder = target_folder
+        self.interval = interval
+        self.tags = tags or None
+        self.kinds = [k for k in KINDS if k in kinds]
+        self.source_dialect = source_dialect
+        self.transform = transform
+        self.optimizer = optimizer
+        self.destination_id = destination_id
+        self.warehouse_id = warehouse_id
+        self.run_as = run_as
+        self.metrics = metrics or SyncMetrics()
+        self.state_path = state_path
+        # last synced update time, by kind and ID
+        self.versions: dict[str, dict[str, str]] = {kind: {} for kind in KINDS}
+        # Databricks ids of the synced alerts and dashboards (queries are in the id map of the client)
+        self.synced: dict[str, dict[str, str]] = {'alert': {}, 'dashboard': {}}
+        # last synced schedule (as JSON) of the queries and alerts, by ID
+        self.schedules: dict[str, dict[str, str]] = {'query': {}, 'alert': {}}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            self.versions.update(state['versions'])
+            self.synced.update(state['synced'])
+            self.schedules.update(state.get('schedules', {}))
+            for redash_id, (dbx_id, viz_id_map) in state.get('queries', {}).items():
+                self.dbx.cache.setdefault(int(redash_id), (dbx_id, {int(k): v for k, v in viz_id_map.items()}))
+
+    def changes(self) -> list[tuple[str, int, str]]:
+        """
+        Polls Redash for the objects changed since they were last synced
+
+        :return: (kind, ID, update time) of the changed objects
+        """
+        changed = []
+        with self.metrics.timed('poll'):
+            for kind in self.kinds:
+                for redash_id, updated_at in self.redash.versions(kind, self.tags).items():
+                    if self.versions[kind].get(str(redash_id)) != updated_at:
+                        changed.append((kind, redash_id, updated_at))
+        return changed
+
+    def cycle(self) -> int:
+        """
+        Syncs the current changes
+
+        :return: number of objects which failed to sync
+        """
+        started = time.time()
+        changed = self.changes()
+        self.metrics.queue_depth = len(changed)
+        if changed:
+            LOGGER.info(f"Syncing {len(changed)} changed objects")
+        failed = 0
+        for kind, redash_id, updated_at in changed:
+            if self._sync(kind, redash_id):
+                self.versions[kind][str(redash_id)] = updated_at
+            else:
+                failed += 1
+            self.metrics.queue_depth -= 1
+        self._save()
+        self.metrics.cycles += 1
+        if not failed:
+            self.metrics.synced_at = started
+        return failed
+
+    def run(self, stop: threading.Event):
+        """
+        Syncs every `interval` seconds, until `stop` is set
+        """
+        while not stop.is_set():
+            try:
+                self.cycle()
+            except Exception as e:
+                # eg Redash being unavailable, the next cycle tries again
+                LOGGER.error(f"Sync cycle failed: {e}")
+                self.metrics.error('all', 'poll')
+            stop.wait(self.interval)
+
+    def _sync(self, kind: str, redash_id: int) -> bool:
+        phase = 'fetch'
+        try:
+            with self.metrics.timed(phase):
+                obj = self._fetch(kind, redash_id)
+            phase = 'transform'
+            with self.metrics.timed(phase):
+                if self.transform:
+                    for query in self._queries_of(kind, obj):
+                        transform_query(query, self.source_dialect, self.optimizer)
+            phase = 'push'
+            with self.metrics.timed(phase):
+                self._push(kind, obj)
+        except Exception as e:
+            LOGGER.error(f"Failed to sync {kind} {redash_id} ({phase}): {e}")
+            self.metrics.error(kind, phase)
+            self.metrics.count(kind, 'failed')
+            return False
+        self.metrics.count(kind, 'synced')
+        return True
+
+    def _fetch(self, kind: str, redash_id: int):
+        if kind == 'query':
+            self.redash.forget_query(redash_id)
+            return self.redash.get_query(redash_id)
+        if kind == 'alert':
+            return self.redash.get_alert(redash_id)
+        return self.redash.get_dashboard(redash_id)
+
+    @staticmethod
+    def _queries_of(kind: str, obj) -> list:
+        if kind == 'query':
+            return [obj]
+        if kind == 'alert':
+            return [obj.query]
+        return [w.query for w in obj.widgets if w.visualization and w.query]
+
+    def _push(self, kind: str, obj):
+        if kind == 'query':
+            self.dbx.update_query(obj, self.target_folder)
+            if self._schedule_changed(kind, obj):
+                self.dbx.update_query_schedule(obj)
+                self._schedule_synced(kind, obj)
+            return
+
+        key = str(obj.id)
+        existing = self.synced[kind].get(key)
+        if kind == 'alert':
+            if existing:
+                self.dbx.update_alert(obj, existing, self.target_folder)
+                if self._schedule_changed(kind, obj):
+                    self.dbx.update_alert_schedule(obj, existing, self.destination_id, self.warehouse_id, self.run_as)
+            else:
+                self.synced[kind][key] = self.dbx.create_alert(obj, self.target_folder, self.destination_id,
+                                                               self.warehouse_id, self.run_as)
+            self._schedule_synced(kind, obj)
+            return
+
+        # legacy dashboards can't be updated in place: the dashboard is created again, reusing the synced queries
+        # (which only get the visualizations added since)
+        for widget in obj.widgets:
+            if widget.query and widget.visualization:
+                cached = self.dbx.read_cache(widget.query.id)
+                if cached and widget.visualization.id not in cached[1]:
+                    self.dbx.update_query(widget.query, self.target_folder)
+        if existing:
+            try:
+                self.dbx.client.dashboards.delete(existing)
+            except NotFound:
+                # deleted by hand, or by a cycle which then failed to create the dashboard again
+                pass
+            # forgotten right away, so that a failed creation doesn't leave the id of a deleted dashboard behind
+            del self.synced[kind][key]
+        self.synced[kind][key] = self.dbx.create_dashboard_ex(obj, self.target_folder)
+
+    def _schedule_changed(self, kind: str, obj) -> bool:
+        return self.schedules[kind].get(str(obj.id)) != json.dumps(obj.schedule, sort_keys=True)
+
+    def _schedule_synced(self, kind: str, obj):
+        self.schedules[kind][str(obj.id)] = json.dumps(obj.schedule, sort_keys=True)
+
+    def _save(self):
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            # the id map of the queries, which the client only keeps in memory (without an id store)
+            queries = {str(k): [dbx_id, {str(v): i for v, i in viz_id_map.items()}]
+                       for k, (dbx_id, viz_id_map) in self.dbx.cache.items()}
+            json.dump({'versions': self.versions, 'synced': self.synced, 'schedules': self.schedules,
+                       'queries': queries}, f)
+        os.replace(tmp_path, self.state_path)
@@ -5,6 +5,7 @@ from sqlglot import transpile, parse_one, exp
 
 from redash import Query
 from hlog import LOGGER
+from profiling import phase
 
 
 TARGET_DIALECT = 'databricks'
@@ -65,15 +66,22 @@ def org_specific_post_transformations(query: Query, from_dialect='presto'):
     return query
 
 
-def transform_query(query: Query, from_dialect=None):
+@phase('transform')
+def transform_query(query: Query, from_dialect=None, optimizer=None):
     """
     Transforms the query from the given dialect to Databricks dialect.
     Also, applies post-processing steps on the transformed results:
         1. qualifies table names with catalog
         2. fixes query params, messed up by sqlglot
+        3. applies the performance rewrites of the optimizer, if given (see `optimize.QueryOptimizer`)
+
+    Query models are shared (eg by all widgets of a query), so a query is only transformed once.
     """
+    if query.transformed:
+        return
+
     for q in query.depends_on:
-        transform_query(q, from_dialect)
+        transform_query(q, from_dialect, optimizer)
 
     if from_dialect is None:
         from_dialect = query.source.dialect
@@ -98,6 +106,9 @@ def transform_query(query: Query, from_dialect=None):
 
     query.query_string = result
     org_specific_post_transformations(query, from_dialect=from_dialect)
+    if optimizer is not None:
+        query.query_string = optimizer.optimize(query)
+    query.transformed = True
 
 
 def fix_query_params(query: str, params) -> str:
@@ -112,6 +123,52 @@ def fix_query_params(query: str, params) -> str:
     return result
 
 
+_PARAM_PATTERN = re.compile(r'\{\{\s*(.+?)\s*\}\}')
+
+
+def mask_query_params(query: str) -> tuple[str, dict[str, str]]:
+    """
+    Replaces Redash query params (`{{param}}`) with plain identifiers, so that the query can be parsed by sqlglot.
+    Returns the masked query and the mapping needed to restore the params (see `unmask_query_params`).
+    """
+    mapping: dict[str, str] = {}
+
+    def mask(match):
+        param = match.group(1)
+        for placeholder, name in mapping.items():
+            if name == param:
+                return placeholder
+        placeholder = f"__redash_param_{len(mapping)}__"
+        mapping[placeholder] = param
+        return placeholder
+
+    return _PARAM_PATTERN.sub(mask, query), mapping
+
+
+def parse_error(query: str, dialect: str) -> str | None:
+    """
+    Returns the error of strictly parsing a query (its params masked), or None if it parses.
+    `transform_query` ignores parse errors, to migrate the queries sqlglot can't parse as they are.
+    """
+    masked, _ = mask_query_params(query.strip().rstrip(';'))
+    try:
+        sqlglot.parse(masked, read=dialect, error_level=sqlglot.errors.ErrorLevel.RAISE)
+    except sqlglot.errors.SqlglotError as e:
+        # the first line of the first error, without the highlighted SQL
+        return f"{type(e).__name__}: {str(e).splitlines()[0]}"
+    return None
+
+
+def unmask_query_params(query: str, mapping: dict[str, str]) -> str:
+    """
+    Restores the Redash query params masked by `mask_query_params`
+    """
+    result = query
+    for placeholder, param in mapping.items():
+        result = re.sub(rf"[`\"]?{placeholder}[`\"]?", f"{{{{{param}}}}}", result)
+    return result
+
+
 def qualify_tables_with_catalog(query: str, dialect, catalog) -> str:
     """
     Prefix table names with the catalog name
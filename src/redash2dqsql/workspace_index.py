@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from hlog import LOGGER
+
+
+PROVENANCE_TAG = "migrated_from_redash"
+
+_ORIGINAL_ID = re.compile(r'original_id:\s*(\d+)')
+_RUN_ID = re.compile(r'run_id:\s*([\w.-]+)')
+
+
+def original_id(text: str | None) -> int | None:
+    """
+    Extracts the Redash ID embedded as `original_id:<id>` in a description or tag
+    """
+    match = _ORIGINAL_ID.search(text or '')
+    return int(match.group(1)) if match else None
+
+
+def run_id(text: str | None) -> str | None:
+    """
+    Extracts the ID of the migration run embedded as `run_id:<id>` in a description or tag
+    """
+    match = _RUN_ID.search(text or '')
+    return match.group(1) if match else None
+
+
+def list_workspace(client, page_size: int = 250, expand_tasks: bool = False) -> tuple[list, list, list, list]:
+    """
+    Pages through the queries, dashboards, alerts and jobs of a workspace (`client` is a `WorkspaceClient`),
+    the four listings running concurrently
+    """
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        listings = [
+            executor.submit(lambda: list(client.queries.list(page_size=page_size))),
+            executor.submit(lambda: list(client.dashboards.list(page_size=page_size))),
+            executor.submit(lambda: list(client.alerts.list())),
+            # pages of jobs with their tasks are limited to 25 jobs
+            executor.submit(lambda: list(client.jobs.list(expand_tasks=expand_tasks, limit=25 if expand_tasks else 100))),
+        ]
+        queries, dashboards, alerts, jobs = (listing.result() for listing in listings)
+    return queries, dashboards, alerts, jobs
+
+
+@dataclass
+class IndexedQuery:
+    id: str
+    # visualizations of the query, as listed: (name, type) -> Databricks visualization ID
+    visualizations: dict[tuple[str, str], str] = field(default_factory=dict)
+
+
+class WorkspaceIndex:
+    """
+    In-memory index of the objects a previous run already migrated to a Databricks workspace, keyed by Redash ID.
+
+    It is built once, at startup, by paging through the queries, dashboards, alerts and jobs of the workspace
+    (the four listings run concurrently), and relies on the provenance embedded in the migrated objects:
+        - queries: `original_id:<id>` in their description
+        - dashboards: `migrated_from_redash` and `original_id:<id>` tags
+        - alerts: the name of the alert, on a query of the index
+        - jobs: `migrated_from_redash` tag, with `original_id` (query schedules) or `alert_id` (alert schedules) tags;
+          as the `alert_id` tag of batched alert schedules may not fit all their alerts, alert jobs are also indexed
+          by the alerts of their tasks
+    Lookups are then dictionary lookups, instead of one GET per object.
+    """
+
+    def __init__(self):
+        self.queries: dict[int, IndexedQuery] = {}
+        self.dashboards: dict[int, str] = {}
+        # (Databricks query ID, alert name) -> Databricks alert ID
+        self.alerts: dict[tuple[str, str], str] = {}
+        # Redash query ID -> ID of the job refreshing it
+        self.query_jobs: dict[int, int] = {}
+        # Databricks alert ID -> ID of the job evaluating it
+        self.alert_jobs: dict[str, int] = {}
+
+    @classmethod
+    def build(cls, client, page_size: int = 250) -> WorkspaceIndex:
+        """
+        Lists the objects of a workspace (`client` is a `WorkspaceClient`)
+        """
+        index = cls()
+        queries, dashboards, alerts, jobs = list_workspace(client, page_size, expand_tasks=True)
+        for query in queries:
+            index.add_query(query)
+        for dashboard in dashboards:
+            index.add_dashboard(dashboard)
+        for alert in alerts:
+            index.add_alert(alert)
+        for job in jobs:
+            index.add_job(job)
+
+        LOGGER.info(f"Indexed {len(index.queries)} queries, {len(index.dashboards)} dashboards, "
+                    f"{len(index.alerts)} alerts and {len(index.query_jobs) + len(index.alert_jobs)} jobs "
+                    f"migrated from Redash")
+        return index
+
+    def add_query(self, query):
+        redash_id = original_id(query.description)
+        if redash_id is None:
+            return
+        visualizations = {
+            (v.name, str(v.type)): v.id for v in (query.visualizations or [])
+        }
+        self.queries[redash_id] = IndexedQuery(query.id, visualizations)
+
+    def add_dashboard(self, dashboard):
+        tags = dashboard.tags or []
+        if PROVENANCE_TAG not in tags:
+            return
+        for tag in tags:
+            redash_id = original_id(tag)
+            if redash_id is not None:
+                self.dashboards[redash_id] = dashboard.id
+
+    def add_alert(self, alert):
+        if alert.query is not None:
+            self.alerts[(alert.query.id, alert.name)] = alert.id
+
+    def add_job(self, job):
+        tags = (job.settings.tags if job.settings else None) or {}
+        if PROVENANCE_TAG not in tags:
+            return
+        if tags.get('original_id'):
+            self.query_jobs[int(tags['original_id'])] = job.job_id
+        alert_ids = set(filter(None, (tags.get('alert_id') or '').split(',')))
+        for task in job.settings.tasks or []:
+            if task.sql_task is not None and task.sql_task.alert is not None:
+                alert_ids.add(task.sql_task.alert.alert_id)
+        for alert_id in alert_ids:
+            self.alert_jobs[alert_id] = job.job_id
+
+    def query(self, redash_id: int) -> IndexedQuery | None:
+        return self.queries.get(redash_id)
+
+    def dashboard(self, redash_id: int) -> str | None:
+        return self.dashboards.get(redash_id)
+
+    def alert(self, query_id: str, name: str) -> str | None:
+        return self.alerts.get((query_id, name))
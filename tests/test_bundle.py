@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from bundle import BundleWriter
+from fanout import Target
+from redash import Alert, Query
+
+
+def _export(root):
+    writer = BundleWriter(root, warehouse_id='wh', destination_id='dest')
+    writer.write_config([Target('dev', 'https://dev', 'token'), Target('prod', 'https://prod', 'token', warehouse_id='wh2')])
+    query = Query(id=4, name='Daily Orders', query_string="SELECT * FROM orders WHERE country = '{{ country }}'",
+                  options={'parameters': [{'name': 'country', 'type': 'text', 'value': 'NZ'}]},
+                  schedule={'interval': 3600})
+    writer.add_query(query)
+    writer.add_query(Query(id=5, name='adhoc', query_string='SELECT 1'))
+    writer.add_alert(Alert(id=9, name='too many orders', query=query, schedule=None, rearm=600,
+                           options={'column': 'orders', 'op': 'greater than', 'value': 100}))
+    return writer
+
+
+class TestBundleWriter(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _read(self, path):
+        with open(os.path.join(self.root, path)) as f:
+            return json.load(f)
+
+    def test_layout(self):
+        _export(self.root)
+
+        config = self._read('databricks.yml')
+        self.assertEqual(config['variables']['warehouse_id']['default'], 'wh')
+        self.assertEqual(config['targets']['prod'], {'workspace': {'host': 'https://prod'},
+                                                     'variables': {'warehouse_id': 'wh2'}})
+        with open(os.path.join(self.root, 'src/queries/daily_orders_4.sql')) as f:
+            self.assertIn('WHERE country = :country', f.read())
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'src/queries/adhoc_5.sql')))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'resources/jobs'))), ['query_4.yml'])
+
+        task = self._read('resources/jobs/query_4.yml')['resources']['jobs']['query_4']['tasks'][0]['sql_task']
+        self.assertEqual(task['file']['path'], '../../src/queries/daily_orders_4.sql')
+        self.assertEqual(task['parameters'], {'country': 'NZ'})
+
+        alert = self._read('resources/alerts/alert_9.yml')['resources']['alerts']['alert_9']
+        self.assertEqual(alert['evaluation']['comparison_operator'], 'GREATER_THAN')
+        self.assertEqual(alert['evaluation']['threshold'], {'value': {'double_value': 100.0}})
+        self.assertEqual(alert['evaluation']['notification'],
+                         {'retrigger_seconds': 600, 'subscriptions': [{'destination_id': 'dest'}]})
+
+    def test_idempotent(self):
+        self.assertEqual(_export(self.root).counts, {'written': 5, 'unchanged': 0, 'removed': 0})
+        self.assertEqual(_export(self.root).counts, {'written': 0, 'unchanged': 5, 'removed': 0})
+
+    def test_removes_stale_files(self):
+        _export(self.root).close()
+        writer = BundleWriter(self.root, warehouse_id='wh')
+        writer.add_query(Query(id=4, name='Orders per day', query_string='SELECT 1', schedule={'interval': 3600}))
+        writer.close()
+
+        # the renamed query, and the query and alert which weren't exported again
+        self.assertEqual(writer.counts, {'written': 2, 'unchanged': 0, 'removed': 3})
+        self.assertEqual(os.listdir(os.path.join(self.root, 'src/queries')), ['orders_per_day_4.sql'])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'resources/jobs')), ['query_4.yml'])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'resources/alerts')), [])
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'databricks.yml')))
@@ -30,3 +30,195 @@ class TestDBXClient(TestCase):
         self.subject.client.workspace.get_status.return_value = MagicMock(object_type=ObjectType.NOTEBOOK, object_id=1234)
         with self.assertRaisesRegex(ValueError, "Path `/some/path/` is not a directory"):
             self.subject.get_path_object_id('/some/path/')
+
+
+class TestDBXClientAlerts(TestCase):
+
+    def setUp(self):
+        import dbsql
+        dbsql.WorkspaceClient = MagicMock()
+        self.subject = dbsql.DBXClient('host', 'token', warehouse_id='wh')
+        self.subject.client.workspace.get_status.return_value = MagicMock(object_type=ObjectType.DIRECTORY, object_id=1)
+        self.subject.client.queries.create.return_value = MagicMock(id='q1')
+        self.subject.client.alerts.create.side_effect = [MagicMock(id=f'a{i}') for i in range(3)]
+
+    def test_reuses_indexed_objects(self):
+        from redash import Query
+        from workspace_index import IndexedQuery, WorkspaceIndex
+
+        index = WorkspaceIndex()
+        index.queries[10] = IndexedQuery('existing')
+        index.alerts[('existing', 'alert 1')] = 'existing-alert'
+        index.alert_jobs['existing-alert'] = 7
+        self.subject.index = index
+
+        query = Query(id=10, name='q', query_string='select 1')
+        alert_id = self.subject.create_alert(self._alert(1, query, {'interval': 300}), '/folder',
+                                             destination_id='dest', warehouse_id='wh')
+
+        self.assertEqual(alert_id, 'existing-alert')
+        self.subject.client.queries.create.assert_not_called()
+        self.subject.client.alerts.create.assert_not_called()
+        self.subject.client.jobs.create.assert_not_called()
+
+    def test_cached_queries_get_their_merged_visualizations(self):
+        from redash import Query, Visualization, VisualizationType
+
+        query = Query(id=10, name='q', query_string='select 1',
+                      visualizations=[Visualization(1, VisualizationType.TABLE, 'Table', '', {}),
+                                      Visualization(2, VisualizationType.TABLE, 'Merged', '', {})])
+        self.subject.update_cache(10, ('existing', {1: 'v1'}))
+        self.subject.client.query_visualizations.create.return_value = MagicMock(id='v2')
+
+        self.assertEqual(self.subject.create_query(query, 'folders/1'), ('existing', {1: 'v1', 2: 'v2'}))
+        self.assertEqual(self.subject.create_query(query, 'folders/1'), ('existing', {1: 'v1', 2: 'v2'}))
+        self.subject.client.query_visualizations.create.assert_called_once()
+        self.subject.client.queries.create.assert_not_called()
+
+    def test_alerts_run_on_the_routed_warehouse(self):
+        from redash import Query
+        from routing import RoutingRule, WarehouseRouter
+
+        self.subject.router = WarehouseRouter([RoutingRule('finance', tags=['finance'])], 'wh')
+        query = Query(id=10, name='q', query_string='select 1', tags=['finance'])
+        self.subject.create_alert(self._alert(1, query, {'interval': 300}), '/folder',
+                                  destination_id='dest', warehouse_id='wh')
+
+        self.assertEqual(self.subject.client.queries.create.call_args.kwargs['data_source_id'], 'finance')
+        task = self.subject.client.jobs.create.call_args.kwargs['tasks'][0]
+        self.assertEqual(task.sql_task.warehouse_id, 'finance')
+
+    def _alert(self, id, query, schedule):
+        from redash import Alert
+        return Alert(id=id, name=f'alert {id}', query=query, schedule=schedule, options={'op': '>', 'value': 1}, rearm=None)
+
+    def test_create_alert_group(self):
+        from redash import Query
+        query = Query(id=10, name='q', query_string='select 1', tags=['finance'])
+        alerts = [
+            self._alert(1, query, {'interval': 300}),
+            self._alert(2, query, {'interval': 300}),
+            self._alert(3, query, {'interval': 3600}),
+        ]
+        created = self.subject.create_alert_group(alerts, '/folder', destination_id='dest', warehouse_id='wh')
+
+        self.assertEqual(created, {1: 'a0', 2: 'a1', 3: 'a2'})
+        self.subject.client.queries.create.assert_called_once()
+        self.assertEqual(self.subject.client.jobs.create.call_count, 2)
+
+        shared_job = self.subject.client.jobs.create.call_args_list[0].kwargs
+        self.assertEqual([t.task_key for t in shared_job['tasks']], ['alert_0', 'alert_1'])
+        self.assertEqual(shared_job['tasks'][1].depends_on[0].task_key, 'alert_0')
+        self.assertEqual(shared_job['tags']['alert_id'], 'a0,a1')
+        self.assertEqual(shared_job['tags']['finance'], '')
+
+    def test_create_alert_group_rejects_different_queries(self):
+        from redash import Query
+        alerts = [
+            self._alert(1, Query(id=10, name='q', query_string='select 1'), None),
+            self._alert(2, Query(id=11, name='q', query_string='select 1'), None),
+        ]
+        with self.assertRaises(ValueError):
+            self.subject.create_alert_group(alerts, '/folder')
+
+    def test_flush_alert_schedules(self):
+        from redash import Query
+        self.subject.max_alerts_per_job = 2
+        self.subject.client.alerts.create.side_effect = [MagicMock(id=f'a{i}') for i in range(4)]
+        self.subject.client.jobs.create.side_effect = [MagicMock(job_id=i) for i in range(3)]
+        for i in range(3):
+            query = Query(id=10 + i, name=f'q{i}', query_string='select 1')
+            self.subject.create_alert(self._alert(i, query, {'interval': 300}), '/folder',
+                                      destination_id='dest', warehouse_id='wh')
+        self.subject.create_alert(self._alert(3, Query(id=20, name='q', query_string='select 1'), {'interval': 60}),
+                                  '/folder', destination_id='dest', warehouse_id='wh')
+        self.subject.client.jobs.create.assert_not_called()
+
+        self.assertEqual(self.subject.flush_alert_schedules(), [0, 1, 2])
+        batched = self.subject.client.jobs.create.call_args_list[0].kwargs
+        self.assertEqual(len(batched['tasks']), 2)
+        self.assertIsNone(batched['tasks'][1].depends_on)
+        self.assertEqual(self.subject.pending_alert_schedules, {})
+
+    def test_update_alert_schedule(self):
+        from databricks.sdk.service.jobs import JobSettings
+        from redash import Query
+        from workspace_index import WorkspaceIndex
+
+        self.subject.index = WorkspaceIndex()
+        self.subject.index.alert_jobs.update({'a0': 1, 'a1': 2, 'a2': 2})
+        self.subject.client.jobs.create.return_value = MagicMock(job_id=3)
+        query = Query(id=10, name='q', query_string='select 1')
+
+        # a job of its own is rescheduled
+        self.subject.client.jobs.get.return_value = MagicMock(settings=JobSettings(tasks=[self._task('alert', 'a0')]))
+        self.assertEqual(self.subject.update_alert_schedule(self._alert(0, query, {'interval': 60}), 'a0'), 1)
+        self.assertIsNotNone(self.subject.client.jobs.update.call_args.kwargs['new_settings'].schedule)
+
+        # a shared job drops the task of the alert, which gets its own job
+        tasks = [self._task('alert_0', 'a1'), self._task('alert_1', 'a2', depends_on='alert_0')]
+        self.subject.client.jobs.get.return_value = MagicMock(settings=JobSettings(tasks=tasks, tags={'alert_id': 'a1,a2'}))
+        self.assertEqual(self.subject.update_alert_schedule(self._alert(1, query, {'interval': 60}), 'a1', 'dest', 'wh'), 3)
+        update = self.subject.client.jobs.update.call_args.kwargs
+        self.assertEqual(update['fields_to_remove'], ['tasks/alert_0'])
+        self.assertEqual(update['new_settings'].tags, {'alert_id': 'a2'})
+        self.assertEqual([(t.task_key, t.depends_on) for t in update['new_settings'].tasks], [('alert_1', None)])
+        self.assertEqual(self.subject.index.alert_jobs, {'a0': 1, 'a1': 3, 'a2': 2})
+
+    def _task(self, task_key, alert_id, depends_on=None):
+        from databricks.sdk.service.jobs import SqlTask, SqlTaskAlert, Task, TaskDependency
+        return Task(task_key=task_key, depends_on=[TaskDependency(task_key=depends_on)] if depends_on else None,
+                    sql_task=SqlTask(alert=SqlTaskAlert(alert_id=alert_id), warehouse_id='wh'))
+
+    def test_update_query_schedule(self):
+        from databricks.sdk.service.jobs import CronSchedule, JobSettings, PauseStatus
+        from redash import Query
+        from workspace_index import WorkspaceIndex
+
+        query = Query(id=10, name='q', query_string='select 1', schedule={'interval': 60})
+        self.assertIsNone(self.subject.update_query_schedule(query))
+
+        self.subject.index = WorkspaceIndex()
+        self.subject.index.query_jobs[10] = 5
+        self.assertEqual(self.subject.update_query_schedule(query), 5)
+        self.assertIsNone(self.subject.client.jobs.update.call_args.kwargs['new_settings'].schedule.pause_status)
+
+        query.schedule = None
+        self.subject.client.jobs.get.return_value = MagicMock(settings=JobSettings(
+            schedule=CronSchedule(quartz_cron_expression='0 * * * * ?', timezone_id='UTC')))
+        self.assertEqual(self.subject.update_query_schedule(query), 5)
+        self.assertEqual(self.subject.client.jobs.update.call_args.kwargs['new_settings'].schedule.pause_status,
+                         PauseStatus.PAUSED)
+
+
+class TestDBXClientStatements(TestCase):
+
+    def setUp(self):
+        import dbsql
+        dbsql.WorkspaceClient = MagicMock()
+        self.subject = dbsql.DBXClient('host', 'token', warehouse_id='wh')
+        self.api = self.subject.client.statement_execution
+
+    def _response(self, state, error=None):
+        from databricks.sdk.service.sql import StatementState
+        return MagicMock(statement_id='s1', status=MagicMock(state=StatementState[state], error=error))
+
+    def test_waits_for_the_statement(self):
+        self.api.execute_statement.return_value = self._response('PENDING')
+        self.api.get_statement.side_effect = [self._response('RUNNING'), self._response('SUCCEEDED')]
+
+        self.assertEqual(self.subject.execute_statement('CREATE VIEW v AS SELECT 1', poll_interval=0), 's1')
+        self.assertEqual(self.api.execute_statement.call_args.args, ('CREATE VIEW v AS SELECT 1', 'wh'))
+        self.assertEqual(self.api.get_statement.call_count, 2)
+
+    def test_failures(self):
+        self.api.execute_statement.return_value = self._response('FAILED', MagicMock(message='no such table'))
+        with self.assertRaisesRegex(ValueError, 'failed: no such table'):
+            self.subject.execute_statement('CREATE VIEW v AS SELECT * FROM t')
+
+        self.api.execute_statement.return_value = self._response('RUNNING')
+        self.api.get_statement.side_effect = None
+        self.api.get_statement.return_value = self._response('RUNNING')
+        with self.assertRaisesRegex(ValueError, "didn't finish"):
+            self.subject.execute_statement('CREATE VIEW v AS SELECT 1', timeout=0, poll_interval=0)
+        self.api.cancel_execution.assert_called_once_with('s1')
@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+from dedup import find_duplicates, merge_duplicates, normalize_sql
+from redash import Query, Source, Visualization, VisualizationType
+
+
+def _query(id, sql, params=(), interval=None, viz_id=None, source=None):
+    return Query(
+        id=id,
+        name=f'q{id}',
+        query_string=sql,
+        options={'parameters': [{'name': p, 'type': 'text'} for p in params]},
+        schedule={'interval': interval} if interval else None,
+        visualizations=[Visualization(viz_id, VisualizationType.TABLE, 'Table', '', {})] if viz_id else [],
+        source=source,
+    )
+
+
+class TestDedup(TestCase):
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql('SELECT A.x FROM Foo a -- comment\n WHERE a.d > {{ day }}'),
+            normalize_sql('select  b.x\nfrom foo AS b where b.d > {{day}}'),
+        )
+        self.assertNotEqual(normalize_sql('select x from foo'), normalize_sql('select y from foo'))
+
+    def test_find_duplicates(self):
+        report = find_duplicates([
+            _query(3, 'select x from foo f where f.d = {{day}}', params=['day'], interval=300),
+            _query(1, 'SELECT x FROM foo WHERE d = {{day}}', params=['day']),
+            _query(2, 'select x from foo t where t.d = {{day}}', params=['day']),
+            _query(4, 'select x from foo where d = {{day}}', params=['other']),
+        ])
+        self.assertEqual(report.total, 4)
+        self.assertEqual(report.removed, 2)
+        self.assertEqual(report.groups[0].canonical.id, 1)
+        self.assertEqual([q.id for q in report.groups[0].duplicates], [2, 3])
+        self.assertEqual(report.runs_per_day_saved, 288)
+
+    def test_merge_duplicates(self):
+        report = find_duplicates([
+            _query(1, 'select 1', viz_id=10),
+            _query(2, 'SELECT 1', viz_id=20),
+        ])
+        aliases = merge_duplicates(report)
+        self.assertEqual(list(aliases), [2])
+        self.assertEqual([v.id for v in aliases[2].visualizations], [10, 20])
+
+    def test_swapped_params_are_not_duplicates(self):
+        report = find_duplicates([
+            _query(1, 'select * from foo where x = {{a}} and y = {{b}}', params=['a', 'b']),
+            _query(2, 'select * from foo where x = {{b}} and y = {{a}}', params=['a', 'b']),
+        ])
+        self.assertEqual(report.removed, 0)
+
+    def test_different_sources_are_not_duplicates(self):
+        report = find_duplicates([
+            _query(1, 'select x from foo', source=Source(1, 'athena', 'athena', 'presto')),
+            _query(2, 'select x from foo', source=Source(2, 'mysql', 'rds_mysql', 'mysql')),
+        ])
+        self.assertEqual(report.removed, 0)
+
+    def test_unparseable_queries_keep_the_case_of_literals(self):
+        self.assertEqual(normalize_sql("SELECT  FROM ((( WHERE x = 'A'"), normalize_sql("select from ((( where x = 'A'"))
+        self.assertNotEqual(normalize_sql("select from ((( where x = 'A'"), normalize_sql("select from ((( where x = 'a'"))
+
+    def test_different_param_defaults_are_not_duplicates(self):
+        queries = [_query(i, 'select * from foo where x = {{a}}', params=['a']) for i in (1, 2, 3)]
+        queries[1].options['parameters'][0]['value'] = 'eu'
+        queries[2].options['parameters'][0].update(type='enum', enumOptions='eu\nus')
+        self.assertEqual(find_duplicates(queries).removed, 0)
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from fanout import FanOut, FanOutError, NamespacedStore, Target, load_targets
+from shard import LeaseStore
+
+
+class TestFanOut(TestCase):
+
+    def test_single_target(self):
+        dbx = MagicMock()
+        fanout = FanOut([(Target('default', 'host', 'token'), dbx)])
+        self.assertEqual(fanout.run(lambda target, dbx: dbx.create_query()), dbx.create_query.return_value)
+        self.assertEqual(fanout.label(fanout.clients[0][0]), '')
+
+    def test_runs_concurrently(self):
+        targets = [Target(name, 'host', 'token') for name in ('dev', 'staging', 'prod')]
+        barrier = threading.Barrier(len(targets), timeout=5)
+
+        def step(target, dbx):
+            # every target must be running at the same time to get past the barrier
+            barrier.wait()
+            return target.name.upper()
+
+        fanout = FanOut([(t, MagicMock()) for t in targets])
+        try:
+            self.assertEqual(fanout.run(step), {'dev': 'DEV', 'staging': 'STAGING', 'prod': 'PROD'})
+
+            def failing(target, dbx):
+                if target.name == 'prod':
+                    raise ValueError('boom')
+                return target.name
+
+            with self.assertRaises(FanOutError) as raised:
+                fanout.run(failing)
+            self.assertEqual(list(raised.exception.errors), ['prod'])
+        finally:
+            fanout.close()
+
+    def test_load_targets(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'targets.json')
+            with open(path, 'w') as f:
+                json.dump([{'name': 'dev', 'host': 'https://dev', 'token_env': 'FANOUT_TEST_TOKEN'}], f)
+            os.environ['FANOUT_TEST_TOKEN'] = 'secret'
+            try:
+                self.assertEqual(load_targets(path)[0].token, 'secret')
+            finally:
+                del os.environ['FANOUT_TEST_TOKEN']
+            with self.assertRaises(ValueError):
+                load_targets(path)
+
+    def test_namespaced_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = LeaseStore(os.path.join(tmp_dir, 'state.db'))
+            dev, prod = NamespacedStore(store, 'dev'), NamespacedStore(store, 'prod')
+            dev.write_mapping('query', 1, ['dev-query', {}])
+            self.assertEqual(dev.read_mapping('query', 1), ['dev-query', {}])
+            self.assertIsNone(prod.read_mapping('query', 1))
+
+            prod.write_mapping('query', 1, ['prod-query', {}])
+            dev.forget('query', 1)
+            self.assertIsNone(dev.read_mapping('query', 1))
+            self.assertEqual(prod.read_mapping('query', 1), ['prod-query', {}])
+            store.close()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+import requests
+
+from httpcache import install_cache, parse_max_age
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/api/queries/1' and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = b'{"id": 1}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/api/queries/1':
+            self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCachingAdapter(TestCase):
+
+    def setUp(self):
+        _Handler.requests_seen = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.session = requests.Session()
+        self.adapter = install_cache(self.session, os.path.join(self.tmp_dir.name, 'cache.db'),
+                                     parse_max_age(['api/data_sources=3600']))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.adapter.cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_streamed_responses_are_not_stored(self):
+        for _ in range(2):
+            with self.session.get(f"{self.url}/api/queries/1", stream=True) as response:
+                self.assertEqual(response.raw.read(), b'{"id": 1}')
+        self.assertEqual(_Handler.requests_seen, [('/api/queries/1', None), ('/api/queries/1', None)])
+        self.assertEqual(self.adapter.stats, {'fresh': 0, 'revalidated': 0, 'miss': 0})
+
+    def test_conditional_requests(self):
+        first = self.session.get(f"{self.url}/api/queries/1")
+        second = self.session.get(f"{self.url}/api/queries/1")
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertTrue(second.from_cache)
+        self.assertEqual(_Handler.requests_seen, [('/api/queries/1', None), ('/api/queries/1', '"v1"')])
+        self.assertEqual(self.adapter.stats, {'fresh': 0, 'revalidated': 1, 'miss': 1})
+
+    def test_max_age_override(self):
+        self.session.get(f"{self.url}/api/data_sources")
+        self.assertEqual(self.session.get(f"{self.url}/api/data_sources").json(), {'id': 1})
+        # responses without validators are only cached for overridden URLs
+        self.session.get(f"{self.url}/api/dashboards")
+        self.session.get(f"{self.url}/api/dashboards")
+
+        self.assertEqual([path for path, _ in _Handler.requests_seen],
+                         ['/api/data_sources', '/api/dashboards', '/api/dashboards'])
+        self.assertEqual(self.adapter.stats['fresh'], 1)
+
+    def test_parse_max_age(self):
+        self.assertEqual(parse_max_age(['api/data_sources=60']), {'api/data_sources': 60.0})
+        with self.assertRaises(ValueError):
+            parse_max_age(['3600'])
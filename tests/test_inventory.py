@@ -0,0 +1,87 @@
+import importlib.util
+import os
+import tempfile
+from unittest import TestCase, skipUnless
+from unittest.mock import MagicMock
+
+from inventory import Inventory, InventoryWriter, dashboard_rows, dependency_depth
+from redash import Dashboard, Query, Source, Visualization, VisualizationType, Widget
+
+
+def _queries():
+    source = Source(id=1, name='athena', type='athena', dialect='presto')
+    countries = Query(id=1, name='countries', query_string='SELECT country FROM users', source=source)
+    cities = Query(id=2, name='cities', query_string="SELECT city FROM users WHERE country = '{{ country }}'",
+                   options={'parameters': [{'name': 'country', 'queryId': 1}]}, depends_on=[countries], source=source)
+    report = Query(id=3, name='report', query_string="SELECT * FROM orders WHERE city = '{{ city }}'",
+                   options={'parameters': [{'name': 'city', 'queryId': 2}]}, depends_on=[cities], source=source,
+                   tags=('finance',), schedule={'interval': 3600})
+    return {q.id: q for q in (countries, cities, report)}
+
+
+class _Writer:
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, table, row):
+        self.rows.setdefault(table, []).append(row)
+
+
+class TestInventory(TestCase):
+
+    def setUp(self):
+        self.queries = _queries()
+        self.redash = MagicMock()
+        # like RedashClient, a query fetched again after being forgotten is a new model
+        self.redash.get_query.side_effect = lambda i: _queries()[i]
+        viz = Visualization(id=9, type=VisualizationType.CHART, name='chart', description='', options={})
+        self.dashboard = Dashboard(id=5, name='Sales', widgets=[
+            Widget(id=1, text='# title', query=None, visualization=None),
+            Widget(id=2, text='', query=self.queries[3], visualization=viz, width=1),
+        ])
+        self.redash.get_dashboard.return_value = self.dashboard
+
+    def test_rows(self):
+        writer = _Writer()
+        inventory = Inventory(self.redash, writer)
+        # the report is transformed first, along with its dependencies
+        inventory.add_queries([3, 1, 2])
+        inventory.add_dashboards([5])
+
+        rows = {r['id']: r for r in writer.rows['queries']}
+        self.assertEqual(rows[3]['dependency_depth'], 2)
+        self.assertEqual(rows[3]['runs_per_day'], 24.0)
+        self.assertEqual(rows[1]['sql_bytes'], len('SELECT country FROM users'))
+        self.assertTrue(all(r['transform_seconds'] is not None for r in rows.values()))
+        self.assertTrue(all(r['transform_error'] is None for r in rows.values()))
+        self.assertEqual(writer.rows['dashboards'][0]['text_widget_count'], 1)
+        self.assertEqual([w['visualization_type'] for w in writer.rows['widgets']], [None, 'CHART'])
+        self.assertEqual(dependency_depth(self.queries[1]), 0)
+        # written queries are dropped from the client's cache
+        self.assertEqual({c.args[0] for c in self.redash.forget_query.call_args_list}, {1, 2, 3})
+
+    def test_unparseable_queries_are_transform_errors(self):
+        writer = _Writer()
+        self.redash.get_query.side_effect = lambda i: Query(id=i, name='garbage', query_string='SELECT FROM WHERE ((( ,,',
+                                                            source=Source(id=1, name='athena', type='athena',
+                                                                          dialect='presto'))
+        Inventory(self.redash, writer).add_queries([7])
+        self.assertTrue(writer.rows['queries'][0]['transform_error'].startswith('ParseError: '))
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = InventoryWriter(tmp_dir, batch_size=2)
+            inventory = Inventory(self.redash, writer, transform=False)
+            inventory.add_queries([1, 2, 3])
+            row, widget_rows = dashboard_rows(self.dashboard)
+            writer.add('dashboards', row)
+            writer.close()
+
+            queries = pq.read_table(os.path.join(tmp_dir, 'queries.parquet'))
+            self.assertEqual(queries.column('id').to_pylist(), [1, 2, 3])
+            self.assertEqual(queries.column('tags').to_pylist(), [[], [], ['finance']])
+            self.assertEqual(pq.read_table(os.path.join(tmp_dir, 'alerts.parquet')).num_rows, 0)
+            self.assertEqual(writer.counts, {'queries': 3, 'dashboards': 1, 'widgets': 0, 'alerts': 0})
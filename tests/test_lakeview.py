@@ -0,0 +1,73 @@
+import base64
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import dbsql
+from lakeview import dashboard_document, dataset, write_dashboard
+from redash import Dashboard, Query, Visualization, VisualizationType, Widget
+
+
+def _dashboard():
+    query = Query(id=7, name='orders', query_string="SELECT day, country, orders\nFROM sales\nWHERE day >= '{{ since }}'",
+                  options={'parameters': [{'name': 'since', 'type': 'date', 'value': '2024-01-01'}]})
+    chart = Visualization(id=1, type=VisualizationType.CHART, name='Orders by day', description='',
+                          options={'globalSeriesType': 'column',
+                                   'columnMapping': {'day': 'x', 'orders': 'y', 'country': 'series'}})
+    table = Visualization(id=2, type=VisualizationType.TABLE, name='Orders', description='',
+                          options={'columns': [{'name': 'day'}, {'name': 'country', 'visible': False}, {'name': 'orders'}]})
+    cohort = Visualization(id=3, type=VisualizationType.COHORT, name='Retention', description='', options={})
+    query.visualizations = [chart, table, cohort]
+    widgets = [
+        Widget(id=10, text='# Sales', query=None, visualization=None,
+               options={'position': {'col': 0, 'row': 0, 'sizeX': 6, 'sizeY': 2}}),
+        Widget(id=11, text='', query=query, visualization=chart,
+               options={'position': {'col': 0, 'row': 2, 'sizeX': 3, 'sizeY': 8}}),
+        Widget(id=12, text='', query=query, visualization=table,
+               options={'position': {'col': 3, 'row': 2, 'sizeX': 3, 'sizeY': 8}}),
+        Widget(id=13, text='', query=query, visualization=cohort, options={}),
+    ]
+    return Dashboard(id=3, name='Sales Overview', slug='sales-overview', widgets=widgets)
+
+
+class TestLakeview(TestCase):
+
+    def test_dataset_parameters(self):
+        result = dataset(_dashboard().widgets[1].query)
+        self.assertEqual(''.join(result['queryLines']), "SELECT day, country, orders\nFROM sales\nWHERE day >= :since")
+        self.assertEqual(result['parameters'][0]['dataType'], 'DATE')
+        self.assertEqual(result['parameters'][0]['defaultSelection']['values']['values'], [{'value': '2024-01-01'}])
+
+    def test_dashboard_document(self):
+        document = dashboard_document(_dashboard())
+        self.assertEqual([d['name'] for d in document['datasets']], ['q7'])
+        layout = document['pages'][0]['layout']
+        self.assertEqual([item['widget']['name'] for item in layout], ['w10', 'w11', 'w12', 'w13'])
+        self.assertEqual(layout[0]['widget']['multilineTextboxSpec']['lines'], ['# Sales'])
+
+        chart = layout[1]['widget']
+        self.assertEqual(chart['spec']['widgetType'], 'bar')
+        self.assertEqual(chart['spec']['encodings']['color']['fieldName'], 'country')
+        self.assertEqual([f['name'] for f in chart['queries'][0]['query']['fields']], ['day', 'orders', 'country'])
+        self.assertEqual(layout[1]['position'], {'x': 0, 'y': 2, 'width': 3, 'height': 8})
+
+        table = layout[2]['widget']
+        self.assertEqual([c['fieldName'] for c in table['spec']['encodings']['columns']], ['day', 'orders'])
+        # unsupported visualizations are replaced by a note, below the other widgets
+        self.assertIn('multilineTextboxSpec', layout[3]['widget'])
+        self.assertEqual(layout[3]['position']['y'], 10)
+
+    def test_write_and_import(self):
+        dbsql.WorkspaceClient = MagicMock()
+        dbx = dbsql.DBXClient('host', 'token', warehouse_id='wh')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = write_dashboard(_dashboard(), tmp_dir)
+            self.assertEqual(os.path.basename(path), 'sales_overview_3.lvdash.json')
+
+            self.assertEqual(dbx.import_lakeview_dashboard(path, '/Shared/redash/'),
+                             '/Shared/redash/sales_overview_3.lvdash.json')
+        dbx.client.workspace.import_.assert_called_once()
+        content = dbx.client.workspace.import_.call_args.kwargs['content']
+        self.assertEqual(json.loads(base64.b64decode(content))['pages'][0]['displayName'], 'Sales Overview')
@@ -0,0 +1,64 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from materialize import MaterializationAdvisor
+from redash import Query
+
+
+def _query(id, sql, interval=300, params=()):
+    return Query(id=id, name=f'q{id}', query_string=sql, schedule={'interval': interval} if interval else None,
+                 options={'parameters': [{'name': p} for p in params]})
+
+
+class TestMaterializationAdvisor(TestCase):
+
+    def setUp(self):
+        self.advisor = MaterializationAdvisor('main.redash', runtime_of=lambda q: 30.0)
+
+    def test_rejections(self):
+        self.advisor.add(_query(1, 'SELECT a FROM t', interval=86400))
+        self.advisor.add(_query(2, 'SELECT a FROM t WHERE d = {{day}}', params=['day']))
+        self.advisor.add(_query(3, 'SELECT a FROM t WHERE d > CURRENT_DATE()'))
+        self.advisor.add(_query(4, 'SELECT a FROM t LIMIT 10'))
+        self.advisor.add(_query(5, 'SELECT a FROM t ORDER BY b'))
+        self.assertEqual(self.advisor.candidates, {})
+        self.assertEqual(set(self.advisor.rejected), {1, 2, 3, 4, 5})
+
+    def test_apply(self):
+        hot = _query(1, 'SELECT region, COUNT(*) AS orders FROM lakehouse_production.kafka_cdc.shop_orders '
+                        'GROUP BY region ORDER BY orders DESC')
+        self.advisor.add(hot, dashboard_id=10)
+        self.advisor.add(hot, dashboard_id=11)
+        other = _query(2, 'SELECT 1 AS x', interval=3600)
+        self.advisor.add(other)
+
+        def create_view(ddl):
+            if 'mv_redash_2' in ddl:
+                raise ValueError('no permission')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'views.sql')
+            selected = self.advisor.apply(path, create_view)
+            with open(path) as f:
+                ddl = f.read()
+
+        self.assertEqual([c.query.id for c in selected], [1, 2])
+        self.assertEqual(selected[0].score, 288 * 30 * 2)
+        self.assertIn("CREATE OR REPLACE MATERIALIZED VIEW main.redash.mv_redash_1\nSCHEDULE CRON '0 */5 * ? * * *'", ddl)
+        self.assertNotIn('ORDER BY', ddl.split('mv_redash_2')[0])
+        self.assertEqual(hot.query_string, 'SELECT\n  *\nFROM main.redash.mv_redash_1\nORDER BY\n  orders DESC')
+        # the view couldn't be created
+        self.assertEqual(other.query_string, 'SELECT 1 AS x')
+        self.assertEqual([c.applied for c in selected], [True, False])
+        self.assertIn('view not created: no permission', self.advisor.report(selected))
+
+    def test_queries_keep_their_sql_until_views_exist(self):
+        query = _query(1, 'SELECT a FROM t')
+        self.advisor.add(query)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'views.sql')
+            self.advisor.apply(path)
+            self.assertEqual(query.query_string, 'SELECT a FROM t')
+            self.advisor.apply(path, rewrite=True)
+            self.assertEqual(query.query_string, 'SELECT\n  *\nFROM main.redash.mv_redash_1')
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from migrator import Migrator, Selector
+from redash import Dashboard, Query, Visualization, VisualizationType, Widget
+
+
+class TestMigrator(TestCase):
+
+    def setUp(self):
+        self.redash = MagicMock()
+        self.dbx = MagicMock()
+        self.query = Query(id=1, name='orders', query_string='select 1')
+        viz = Visualization(id=2, type=VisualizationType.TABLE, name='table', description='', options={})
+        self.redash.get_query.return_value = self.query
+        self.redash.dashboard_ids.return_value = [10, 11]
+        self.redash.get_dashboard.side_effect = lambda i: Dashboard(
+            id=i, name=f"d{i}", widgets=[Widget(id=i, text='', query=self.query, visualization=viz)])
+        self.dbx.create_query_ex.return_value = ('q1', {2: 'v2'})
+        self.dbx.create_dashboard_ex.side_effect = lambda d, folder: f"dbx-{d.id}"
+        self.migrator = Migrator(self.redash, self.dbx, target_folder='folders/1', transform=False)
+
+    def test_batch(self):
+        results = self.migrator.migrate([Selector('dashboard', tags=['finance']), Selector('query', ids=[1])])
+
+        self.redash.dashboard_ids.assert_called_once_with(tags=['finance'])
+        self.assertEqual([(r.kind, r.redash_id, r.dbx_id) for r in results],
+                         [('dashboard', 10, 'dbx-10'), ('dashboard', 11, 'dbx-11'), ('query', 1, ('q1', {2: 'v2'}))])
+        self.assertEqual(set(results[0].timings), {'fetch', 'transform', 'create'})
+        self.dbx.create_query_ex.assert_called_once_with(self.query, 'folders/1')
+
+    def test_failures_are_returned(self):
+        self.dbx.create_dashboard_ex.side_effect = ValueError('boom')
+        results = self.migrator.migrate_dashboards(ids=[10], target_folder='folders/2')
+
+        self.assertFalse(results[0].ok)
+        self.assertEqual(str(results[0].error), 'boom')
+        with self.assertRaises(ValueError):
+            Selector('notebook')
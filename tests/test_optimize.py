@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from optimize import QueryOptimizer, load_schema
+from redash import Query
+
+
+SCHEMA = {
+    'main.shop.orders': {
+        'columns': {'id': 'bigint', 'region': 'string', 'amount': 'double', 'created_at': 'timestamp', 'day': 'date'},
+        'partitions': ['created_at', 'day'],
+    },
+    'main.shop.customers': {
+        'columns': {'id': 'bigint', 'name': 'string'},
+    },
+}
+
+
+class TestQueryOptimizer(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, 'schema.json')
+        with open(path, 'w') as f:
+            json.dump(SCHEMA, f)
+        self.schema, self.partitions = load_schema(path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _optimizer(self, passes):
+        return QueryOptimizer(self.schema, self.partitions, passes=passes)
+
+    def test_partition_filters(self):
+        optimizer = self._optimizer(['partitions'])
+        sql = optimizer.optimize_sql("SELECT id FROM main.shop.orders "
+                                     "WHERE CAST(created_at AS DATE) = '{{ day }}' AND CAST(day AS DATE) >= '2024-01-01'")
+        self.assertIn("orders.created_at >= CAST('{{day}}' AS DATE)", sql)
+        self.assertIn("orders.created_at < DATEADD(DAY, 1, CAST('{{day}}' AS DATE))", sql)
+        self.assertIn("orders.day >= '2024-01-01'", sql)
+        self.assertNotIn("CAST(orders.created_at", sql)
+
+    def test_pushdown_and_pruning(self):
+        optimizer = self._optimizer(['pushdown', 'prune'])
+        sql = optimizer.optimize_sql("SELECT o.region, SUM(o.amount) FROM (SELECT * FROM main.shop.orders) AS o "
+                                     "WHERE o.region = {{region}} GROUP BY o.region")
+        inner = sql[sql.index('FROM (') + 1:sql.index(') AS o')]
+        self.assertIn("{{region}} = orders.region", inner)
+        self.assertNotIn("created_at", inner)
+
+    def test_approx_count_distinct(self):
+        sql = self._optimizer(['approx']).optimize_sql("SELECT COUNT(DISTINCT id) FROM main.shop.customers")
+        self.assertIn("APPROX_COUNT_DISTINCT(customers.id)", sql)
+        sql = self._optimizer([]).optimize_sql("SELECT COUNT(DISTINCT id) FROM main.shop.customers")
+        self.assertIn("COUNT(DISTINCT customers.id)", sql)
+
+    def test_diff_report(self):
+        optimizer = self._optimizer(['partitions'])
+        query = Query(id=7, name='orders', query_string="SELECT id FROM main.shop.orders WHERE DATE(created_at) = '2024-01-01'")
+        result = optimizer.optimize(query)
+        self.assertIn("orders.created_at >= CAST('2024-01-01' AS DATE)", result)
+        self.assertIn('+++ 7/optimized', optimizer.report())
+
+        unparsable = Query(id=8, name='script', query_string="SELECT 1; SELECT 2")
+        self.assertEqual(optimizer.optimize(unparsable), "SELECT 1; SELECT 2")
+        self.assertNotIn(8, optimizer.diffs)
+
+    def test_unknown_pass(self):
+        with self.assertRaises(ValueError):
+            self._optimizer(['vectorize'])
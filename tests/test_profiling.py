@@ -0,0 +1,52 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from profiling import Profiler, function_of, phase
+
+
+@phase('fetch')
+def fetch(n):
+    return [str(i) * 10 for i in range(n)]
+
+
+@phase('transform')
+def transform(rows):
+    # a phase within another one ends it until it returns
+    return [s.upper() for s in rows] + fetch(10)
+
+
+class TestProfiler(TestCase):
+
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiler = Profiler(tmp_dir, top=5, interval=0.001, tracked_files=('test_profiling.py',))
+            # a snapshot at every boundary
+            profiler.SNAPSHOT_OVERHEAD = float('inf')
+            profiler.start()
+            kept = []
+            for _ in range(3):
+                kept.append(transform(fetch(500)))
+            summary = profiler.stop()
+
+            self.assertEqual(set(profiler.phases), {'other', 'fetch', 'transform'})
+            self.assertGreater(profiler.phases['fetch'][2], 0)
+            self.assertEqual(profiler.snapshots, 19)
+            self.assertIn('test_profiling.py:fetch', profiler.allocations)
+            self.assertIn('test_profiling.py:transform', profiler.allocations)
+            self.assertNotIn('test_profiling.py:<module>', profiler.allocations)
+            self.assertIn('Top 5 allocating functions', summary)
+            with open(os.path.join(tmp_dir, 'cpu.folded')) as f:
+                for line in f:
+                    stack, samples = line.rsplit(' ', 1)
+                    self.assertTrue(stack.split(';')[0] in ('other', 'fetch', 'transform'))
+                    self.assertNotIn('profiling.py:wrapper', stack)
+                    self.assertGreater(int(samples), 0)
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'memory.txt')))
+
+        # without a profiler, phases are plain calls
+        self.assertEqual(len(fetch(3)), 3)
+
+    def test_function_of(self):
+        self.assertEqual(function_of(__file__, fetch.__wrapped__.__code__.co_firstlineno + 1), 'test_profiling.py:fetch')
+        self.assertEqual(function_of(__file__, 1), 'test_profiling.py:<module>')
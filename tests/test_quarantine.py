@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from quarantine import Quarantine
+from redash import Query
+
+
+class TestQuarantine(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'quarantine.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_entries_are_persisted(self):
+        quarantine = Quarantine(self.path)
+        try:
+            raise ValueError('bad visualization')
+        except ValueError as e:
+            quarantine.add('query', 1, e)
+        quarantine.add('query', 2, blocked_by=('query', 1))
+        quarantine.add('dashboard', 3, ValueError('boom'))
+
+        with open(self.path) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(entries[0]['error']['type'], 'ValueError')
+        self.assertIn('bad visualization', entries[0]['error']['traceback'])
+        self.assertEqual(entries[1]['blocked_by'], {'kind': 'query', 'id': '1'})
+
+        retry = Quarantine(self.path)
+        self.assertEqual(retry.ids('query'), ['1', '2'])
+        retry.release('query', 1)
+        self.assertEqual(Quarantine(self.path).ids('query'), ['2'])
+        self.assertEqual(Quarantine(self.path).ids('dashboard'), ['3'])
+
+    def test_blocking(self):
+        quarantine = Quarantine(self.path)
+        parameters = Query(id=1, name='parameters', query_string='select 1')
+        report = Query(id=2, name='report', query_string='select 2', depends_on=[parameters])
+        self.assertIsNone(quarantine.blocking(report))
+
+        quarantine.mark_failed('query', 1)
+        self.assertIs(quarantine.blocking(report), parameters)
+        self.assertEqual(quarantine.ids('query'), [])
+
+    def test_sharded_workers_share_entries(self):
+        from shard import LeaseStore
+
+        db_path = os.path.join(self.tmp_dir.name, 'state.db')
+        store_a, store_b = LeaseStore(db_path, worker_id='a'), LeaseStore(db_path, worker_id='b')
+        worker_a, worker_b = Quarantine(self.path, store=store_a), Quarantine(self.path, store=store_b)
+        worker_a.add('query', 1, ValueError('boom'))
+        worker_b.add('query', 2, ValueError('boom'))
+        worker_b.add('dashboard', 3, blocked_by=('query', 2))
+
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIn('2 querys, 1 dashboards', worker_a.summary())
+        retry = Quarantine(self.path, store=store_a)
+        self.assertEqual(retry.ids('query'), ['1', '2'])
+        # released by a worker which didn't quarantine it
+        retry.release('query', 2)
+        self.assertEqual(Quarantine(self.path, store=store_b).ids('query'), ['1'])
+        store_a.close()
+        store_b.close()
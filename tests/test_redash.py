@@ -38,3 +38,107 @@ class TestRedashClient(TestCase):
         self.assertEqual(results[0].query.query_string, 'select 1 as c')
         self.assertEqual(results[0].query.name, '[Data Platform] Redash is working?')
         self.assertEqual(results[0].schedule['interval'], 300)
+
+    def test_widgets_share_query_models(self):
+        self.client.redash.get_data_sources.return_value = [{'id': 1, 'name': 'athena', 'type': 'athena'}]
+        self.client.redash.get_query.return_value = {
+            'id': 3804, 'name': 'q', 'query': 'select 1 as c', 'data_source_id': 1, 'tags': ['a'],
+            'options': {'parameters': []},
+            'visualizations': [{'id': 7, 'type': 'TABLE', 'name': 'Table', 'description': '', 'options': {}}]
+        }
+        self.client.redash.get_dashboard.return_value = {
+            'id': 1, 'name': 'd', 'slug': 'd', 'tags': [],
+            'widgets': [
+                {'id': i, 'options': {}, 'visualization': {'id': 7, 'query': {'id': 3804}}} for i in range(3)
+            ]
+        }
+        dashboard = self.client.get_dashboard(1)
+        self.client.redash.get_query.assert_called_once_with(3804)
+        self.assertIs(dashboard.widgets[0].query, dashboard.widgets[2].query)
+        self.assertEqual(dashboard.widgets[1].visualization.name, 'Table')
+
+    def test_relations_are_loaded_on_access(self):
+        self.client.redash.get_data_sources.return_value = [{'id': 1, 'name': 'athena', 'type': 'athena'}]
+        queries = {
+            1: {'id': 1, 'name': 'countries', 'query': 'select country', 'data_source_id': 1, 'tags': [],
+                'options': {'parameters': []}},
+            2: {'id': 2, 'name': 'report', 'query': 'select 2', 'data_source_id': 1, 'tags': [],
+                'options': {'parameters': [{'name': 'country', 'queryId': 1}]},
+                'visualizations': [{'id': i, 'type': 'TABLE', 'name': f'Table {i}', 'description': '', 'options': {}}
+                                   for i in (7, 8)]},
+        }
+        self.client.redash.get_query.side_effect = queries.get
+        report = self.client.get_query(2)
+        self.client.redash.get_query.assert_called_once_with(2)
+        self.assertIsNone(report._depends_on)
+
+        table = report.visualization(8)
+        self.assertEqual(table.name, 'Table 8')
+        self.assertIsNone(report._visualizations)
+        self.assertEqual([v.id for v in report.visualizations], [7, 8])
+        self.assertIs(report.visualizations[1], table)
+
+        self.assertIs(report.depends_on[0], self.client.get_query(1))
+        self.assertEqual(self.client.redash.get_query.call_count, 2)
+
+    def test_relations_are_loaded_once_across_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from redash import Query, _encode_options
+
+        raw = _encode_options([{'id': i, 'type': 'TABLE', 'name': f'Table {i}', 'description': '', 'options': {}}
+                               for i in range(50)])
+        for _ in range(20):
+            query = Query.lazy(self.client, [], raw, id=1, name='q', query_string='select 1')
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                seen = list(executor.map(lambda _: query.visualizations, range(8)))
+            self.assertTrue(all(v is seen[0] for v in seen))
+            self.assertEqual(len(seen[0]), 50)
+
+    def test_queries_are_fetched_concurrently(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.client.redash.get_data_sources.return_value = [{'id': 1, 'name': 'athena', 'type': 'athena'}]
+        released = threading.Event()
+
+        def get_query(id):
+            # the fetch of query 1 only returns once query 2 was fetched by another thread
+            if id == 1:
+                self.assertTrue(released.wait(timeout=5))
+            return {'id': id, 'name': f'q{id}', 'query': 'select 1', 'data_source_id': 1, 'tags': [],
+                    'options': {'parameters': []}}
+
+        self.client.redash.get_query.side_effect = get_query
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(self.client.get_query, 1)
+            self.assertEqual(self.client.get_query(2).id, 2)
+            released.set()
+            self.assertEqual(first.result().id, 1)
+        self.assertIs(self.client.get_query(1), first.result())
+
+    def test_connection_pool(self):
+        client = RedashClient(self.api_endpoint, self.api_key, pool_size=32)
+        adapter = client.redash.session.get_adapter(self.api_endpoint)
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertIsNone(client.http_cache)
+
+
+class TestModels(TestCase):
+
+    def test_options_are_kept_as_json_until_accessed(self):
+        from redash import Query
+        query = Query(id=1, name='q', query_string='select {{day}}', options={'parameters': [{'name': 'day'}]})
+        self.assertIsNone(query._options)
+        self.assertIsInstance(query._options_raw, bytes)
+        self.assertEqual(query.params, ['day'])
+        self.assertIsNotNone(query._options)
+
+        query.options = {'parameters': []}
+        self.assertEqual(query.params, [])
+        self.assertFalse(hasattr(query, '__dict__'))
+
+    def test_tags_are_interned(self):
+        from redash import Query
+        first = Query(id=1, name='a', query_string='', tags=[''.join(['fin', 'ance'])])
+        second = Query(id=2, name='b', query_string='', tags=[''.join(['fina', 'nce'])])
+        self.assertIs(first.tags[0], second.tags[0])
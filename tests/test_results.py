@@ -0,0 +1,56 @@
+import importlib.util
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+from unittest import TestCase, skipUnless
+
+from redash import Query
+
+
+class _Redash:
+    def __init__(self, results):
+        self.results = results
+        self.downloads = []
+
+    @contextmanager
+    def stream_query_result(self, result_id):
+        self.downloads.append(result_id)
+        yield io.BytesIO(self.results[result_id])
+
+
+@skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+class TestResultExporter(TestCase):
+
+    def test_export(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from results import ResultExporter, copy_into_statements
+
+        mixed = b'code,n\n' + b''.join(b'%d,%d\n' % (i, i) for i in range(2000)) + b'A1,1\n'
+        redash = _Redash({10: b'day,users\n2024-01-01,3\n2024-01-02,5\n', 20: mixed})
+        queries = [Query(id=1, name='daily users', query_string='', latest_query_data_id=10),
+                   Query(id=2, name='codes', query_string='', latest_query_data_id=20),
+                   Query(id=3, name='never ran', query_string='')]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            exporter = ResultExporter(redash, tmp_dir, parallel=2, block_size=1024)
+            exported = exporter.export(queries)
+
+            self.assertEqual([r.query.id for r in exported], [1, 2])
+            self.assertTrue(all(r.ok for r in exported))
+            daily = pq.read_table(exported[0].path)
+            self.assertEqual(daily.schema.field('users').type, pa.int64())
+            self.assertEqual(daily.column('users').to_pylist(), [3, 5])
+
+            # the last block doesn't fit the integer inferred from the first one
+            self.assertTrue(exported[1].as_strings)
+            self.assertEqual(redash.downloads.count(20), 2)
+            codes = pq.read_table(exported[1].path)
+            self.assertEqual(codes.num_rows, 2001)
+            self.assertEqual(codes.schema.field('code').type, pa.string())
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['redash_result_1.parquet', 'redash_result_2.parquet'])
+
+        sql = copy_into_statements(exported, '/Volumes/main/redash/results/', 'main.redash')
+        self.assertIn("CREATE TABLE IF NOT EXISTS main.redash.redash_result_1;\nCOPY INTO main.redash.redash_result_1\n"
+                      "FROM '/Volumes/main/redash/results/redash_result_1.parquet'\nFILEFORMAT = PARQUET", sql)
+        self.assertEqual(sql.count('COPY INTO'), 2)
@@ -0,0 +1,82 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from rollback import Resource, Teardown, TEARDOWN_ORDER, migrated_resources, select_resources
+
+
+RESOURCES = [
+    Resource('query', 'q1', 'orders', redash_id=1, run_id='r1', tags={'finance'}),
+    Resource('query', 'q2', 'users', redash_id=2, run_id='r2', tags={'growth'}),
+    Resource('dashboard', 'd1', 'sales', redash_id=1, run_id='r1', references={'q1', 'q2'}),
+    Resource('dashboard', 'd2', 'growth', redash_id=2, run_id='r2', references={'q2'}),
+    Resource('alert', 'a1', 'too many orders', references={'q1'}),
+    Resource('alert', 'a2', 'too few users', references={'q2'}),
+    Resource('job', '10', 'alert schedule', run_id='r1', references={'a1'}),
+    Resource('job', '11', 'query schedule', redash_id=2, run_id='r2', references={'q2'}),
+]
+
+
+def _ids(selected):
+    return {kind: [r.id for r in resources] for kind, resources in selected.items()}
+
+
+class TestSelectResources(TestCase):
+
+    def test_by_run(self):
+        selected = select_resources(RESOURCES, run_ids=['r1'])
+        self.assertEqual(list(selected), list(TEARDOWN_ORDER))
+        self.assertEqual(_ids(selected), {'job': ['10'], 'dashboard': ['d1'], 'alert': ['a1'], 'query': ['q1']})
+
+    def test_by_tag_and_id(self):
+        self.assertEqual(_ids(select_resources(RESOURCES, tags=['growth'])),
+                         {'job': ['11'], 'dashboard': [], 'alert': ['a2'], 'query': ['q2']})
+
+    def test_dashboard_queries(self):
+        # q2 is still shown by d2
+        self.assertEqual(_ids(select_resources(RESOURCES, dashboard_ids=[1])),
+                         {'job': ['10'], 'dashboard': ['d1'], 'alert': ['a1'], 'query': ['q1']})
+        self.assertEqual(_ids(select_resources(RESOURCES, dashboard_ids=[1, 2])),
+                         {'job': ['10', '11'], 'dashboard': ['d1', 'd2'], 'alert': ['a1', 'a2'], 'query': ['q1', 'q2']})
+
+    def test_requires_selection(self):
+        with self.assertRaises(ValueError):
+            select_resources(RESOURCES)
+
+
+class TestMigratedResources(TestCase):
+
+    def test_dashboard_widgets(self):
+        client = MagicMock()
+        client.queries.list.return_value = []
+        client.alerts.list.return_value = []
+        client.jobs.list.return_value = []
+        listed = MagicMock(id='d1', tags=['migrated_from_redash', 'original_id:1', 'run_id:r1'], widgets=None)
+        listed.name = 'sales'
+        client.dashboards.list.return_value = [listed, MagicMock(tags=['manual'])]
+        widget = MagicMock()
+        widget.visualization.query.id = 'q1'
+        client.dashboards.get.return_value = MagicMock(id='d1', tags=listed.tags, widgets=[widget, MagicMock(visualization=None)])
+
+        (dashboard,) = migrated_resources(client)
+
+        client.dashboards.get.assert_called_once_with('d1')
+        self.assertEqual((dashboard.redash_id, dashboard.run_id, dashboard.references), (1, 'r1', {'q1'}))
+
+
+class TestTeardown(TestCase):
+
+    def test_deletes_in_dependency_order(self):
+        client = MagicMock()
+        calls = []
+        for api in ('jobs', 'dashboards', 'alerts', 'queries'):
+            getattr(client, api).delete.side_effect = lambda id, api=api: calls.append(api)
+        client.alerts.delete.side_effect = Exception('boom')
+
+        teardown = Teardown(client, workers=4, rate=0)
+        teardown.run(select_resources(RESOURCES, run_ids=['r1', 'r2']))
+
+        # queries of the alerts which couldn't be deleted are kept
+        self.assertEqual(calls, ['jobs', 'jobs', 'dashboards', 'dashboards'])
+        self.assertEqual(len(teardown.deleted), 4)
+        self.assertEqual({r.id for r, _ in teardown.failed}, {'a1', 'a2', 'q1', 'q2'})
+        self.assertIn('failed to delete alert', teardown.report())
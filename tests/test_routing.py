@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from redash import Query, Source
+from routing import RoutingRule, WarehouseRouter
+
+
+ATHENA = Source(id=1, name='athena prod', type='athena', dialect='presto')
+MYSQL = Source(id=2, name='hip', type='rds_mysql', dialect='mysql')
+
+
+class TestWarehouseRouter(TestCase):
+
+    def setUp(self):
+        self.runtimes = {1: 120.0, 2: 5.0, 3: 2.0}
+        self.router = WarehouseRouter(
+            [
+                RoutingRule('heavy', source_types=['athena'], min_runtime=60),
+                RoutingRule('finance', tags=['finance']),
+            ],
+            'default',
+            runtime_of=lambda q: self.runtimes.get(q.id),
+        )
+
+    def test_route(self):
+        heavy = Query(id=1, name='a', query_string='', source=ATHENA, schedule={'interval': 3600})
+        light = Query(id=2, name='b', query_string='', source=ATHENA)
+        finance = Query(id=3, name='c', query_string='', source=MYSQL, tags=['finance'])
+        self.assertEqual(self.router.route(heavy), 'heavy')
+        self.assertEqual(self.router.route(light), 'default')
+        self.assertEqual(self.router.route(finance), 'finance')
+
+        # routes are stable, and the load is only counted once
+        self.runtimes[1] = 1.0
+        self.assertEqual(self.router.route(heavy), 'heavy')
+        self.assertEqual(self.router.load['heavy'].queries, 1)
+        self.assertEqual(self.router.load['heavy'].seconds_per_day, 24 * 120)
+        self.assertIn('heavy: 1 queries, 24 scheduled runs/day', self.router.report())
+
+    def test_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'rules.json')
+            with open(path, 'w') as f:
+                json.dump({'rules': [{'warehouse_id': 'mysql', 'source_types': ['rds_mysql']}]}, f)
+            router = WarehouseRouter.from_file(path, default_warehouse_id='fallback')
+        self.assertEqual(router.route(Query(id=1, name='a', query_string='', source=MYSQL)), 'mysql')
+        self.assertEqual(router.route(Query(id=2, name='b', query_string='', source=ATHENA)), 'fallback')
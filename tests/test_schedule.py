@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from schedule import SchedulePlanner, fixed_time_quartz_expression, interval_quartz_expression
+
+
+class TestQuartzExpressions(TestCase):
+
+    def test_interval(self):
+        self.assertEqual(interval_quartz_expression(30), "*/30 * * ? * * *")
+        self.assertEqual(interval_quartz_expression(900), "0 */15 * ? * * *")
+        self.assertEqual(interval_quartz_expression(7200), "0 0 */2 ? * * *")
+        with self.assertRaises(ValueError):
+            interval_quartz_expression(86400)
+
+    def test_fixed_time(self):
+        self.assertEqual(fixed_time_quartz_expression({'interval': 86400, 'time': '07:30'}), "0 30 7 * * ? *")
+        self.assertEqual(fixed_time_quartz_expression({'interval': 172800, 'time': '00:05'}), "0 5 0 1/2 * ? *")
+        self.assertEqual(
+            fixed_time_quartz_expression({'interval': 604800, 'time': '23:00', 'day_of_week': 'Monday'}),
+            "0 0 23 ? * MON *"
+        )
+
+
+class TestSchedulePlanner(TestCase):
+
+    def test_staggers_identical_intervals(self):
+        planner = SchedulePlanner()
+        expressions = [planner.plan({'interval': 900}) for _ in range(15)]
+        self.assertEqual(len(set(expressions)), 15)
+        self.assertEqual(expressions[0], "0 0/15 * ? * * *")
+        self.assertEqual(planner.peak, 1)
+
+    def test_runtime_spreads_load(self):
+        planner = SchedulePlanner(runtimes={1: 600})
+        first = planner.plan({'interval': 3600}, query_id=1)
+        second = planner.plan({'interval': 3600})
+        self.assertEqual(first, "0 0 0/1 ? * * *")
+        self.assertEqual(second, "0 10 0/1 ? * * *")
+
+    def test_fixed_time_schedules_count_towards_load(self):
+        planner = SchedulePlanner()
+        self.assertEqual(planner.plan({'interval': 86400, 'time': '00:00'}), "0 0 0 * * ? *")
+        self.assertEqual(planner.plan({'interval': 7200}), "0 1 0/2 ? * * *")
+        # sub-minute schedules are kept as they are
+        self.assertEqual(planner.plan({'interval': 30}), "*/30 * * ? * * *")
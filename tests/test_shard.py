@@ -0,0 +1,91 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from shard import LeaseStore, WorkQueue
+
+
+class TestLeaseStore(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'state.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_items_are_claimed_once(self):
+        worker_a = LeaseStore(self.path, worker_id='a')
+        worker_b = LeaseStore(self.path, worker_id='b')
+        worker_a.seed('dashboard', [1, 2])
+        worker_b.seed('dashboard', [1, 2])
+
+        claimed = {worker_a.claim('dashboard'), worker_b.claim('dashboard')}
+        self.assertEqual(claimed, {'1', '2'})
+        self.assertIsNone(worker_a.claim('dashboard'))
+        self.assertEqual(worker_a.counts('dashboard'), {'leased': 2})
+
+    def test_expired_leases_are_reclaimed(self):
+        crashed = LeaseStore(self.path, worker_id='crashed', lease_seconds=-1)
+        crashed.seed('query', [42])
+        self.assertEqual(crashed.claim('query'), '42')
+
+        survivor = LeaseStore(self.path, worker_id='survivor')
+        self.assertEqual(survivor.claim('query'), '42')
+        survivor.complete('query', '42', ['dbx-id', {}])
+        self.assertEqual(survivor.counts('query'), {'done': 1})
+
+        # the crashed worker can't overwrite the outcome once its lease is gone
+        crashed.fail('query', '42', 'boom')
+        self.assertEqual(survivor.counts('query'), {'done': 1})
+
+    def test_runs_have_their_own_items(self):
+        first = LeaseStore(self.path, worker_id='a', run_id='r1')
+        first.seed('query', [1])
+        self.assertEqual(first.claim('query'), '1')
+        first.complete('query', '1')
+
+        second = LeaseStore(self.path, worker_id='a', run_id='r2')
+        second.seed('query', [1, 2])
+        self.assertEqual({second.claim('query'), second.claim('query')}, {'1', '2'})
+        self.assertEqual(first.counts('query'), {'done': 1})
+        self.assertEqual(second.counts('query'), {'leased': 2})
+
+    def test_mapping(self):
+        store = LeaseStore(self.path)
+        self.assertIsNone(store.read_mapping('query', 1))
+        store.write_mapping('query', 1, ['abc', {'10': 'def'}])
+        self.assertEqual(store.read_mapping('query', 1), ['abc', {'10': 'def'}])
+
+
+class TestWorkQueue(TestCase):
+
+    def test_without_store(self):
+        work = WorkQueue(None, 'alert', [1, 2, 3])
+        self.assertEqual(list(work), [1, 2, 3])
+
+    def test_with_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = LeaseStore(os.path.join(tmp_dir, 'state.db'), worker_id='w')
+            work = WorkQueue(store, 'alert', [1, 2])
+            for item_id in work:
+                if item_id == '1':
+                    work.done(item_id)
+                else:
+                    work.failed(item_id, ValueError('bad alert'))
+            self.assertEqual(store.counts('alert'), {'done': 1, 'failed': 1})
+            store.close()
+
+    def test_retry(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = LeaseStore(os.path.join(tmp_dir, 'state.db'), worker_id='w')
+            work = WorkQueue(store, 'alert', [1, 2])
+            for item_id in work:
+                work.failed(item_id, ValueError('bad alert'))
+            self.assertEqual(list(WorkQueue(store, 'alert', [1, 2])), [])
+
+            retried = WorkQueue(store, 'alert', [2], retry=True)
+            for item_id in retried:
+                retried.done(item_id)
+            self.assertEqual(store.counts('alert'), {'done': 1, 'failed': 1})
+            store.close()
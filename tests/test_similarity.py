@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from redash import Query
+from similarity import SimilarityIndex, estimate_similarity, lsh_parameters, minhash, token_shingles
+
+
+REPORT = """
+SELECT o.day, o.region, COUNT(*) AS orders, SUM(o.amount) AS revenue, AVG(o.amount) AS basket
+FROM lakehouse_production.kafka_cdc.shop_orders AS o
+JOIN lakehouse_production.kafka_cdc.shop_customers AS c ON c.id = o.customer_id
+WHERE o.status = 'complete' AND c.is_test = FALSE AND o.day >= {}
+GROUP BY o.day, o.region
+ORDER BY o.day
+"""
+
+
+class TestSimilarity(TestCase):
+
+    def test_minhash_estimates_jaccard(self):
+        first = token_shingles(REPORT.format("'2023-01-01'"))
+        second = token_shingles(REPORT.format("'2024-01-01'"))
+        exact = len(first & second) / len(first | second)
+        estimate = estimate_similarity(minhash(first, 256), minhash(second, 256))
+        self.assertAlmostEqual(estimate, exact, delta=0.1)
+        self.assertEqual(estimate_similarity(minhash(first), minhash(first)), 1.0)
+
+    def test_lsh_parameters(self):
+        bands, rows = lsh_parameters(128, 0.8)
+        self.assertEqual(bands * rows, 128)
+        self.assertAlmostEqual((1 / bands) ** (1 / rows), 0.8, delta=0.1)
+
+    def test_clusters(self):
+        index = SimilarityIndex(threshold=0.7)
+        index.add(Query(id=1, name='a', query_string=REPORT.format("'2023-01-01'")))
+        index.add(Query(id=2, name='b', query_string=REPORT.format("'2024-01-01'"),
+                        schedule={'interval': 3600}))
+        index.add(Query(id=3, name='c', query_string=REPORT.format("DATE_SUB(CURRENT_DATE(), 7)")))
+        index.add(Query(id=4, name='d', query_string='SELECT name, email FROM lakehouse_production.kafka_cdc.users'))
+
+        clusters = index.clusters()
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual([q.id for q in clusters[0].queries], [1, 2, 3])
+        self.assertGreater(clusters[0].score, 0)
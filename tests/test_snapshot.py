@@ -0,0 +1,101 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from redash import RedashClient
+from snapshot import SnapshotReader, write_snapshot
+
+
+def _query(query_id, tags, data_source_id=1):
+    return {'id': query_id, 'name': f"query {query_id}", 'query': f"select {query_id}", 'options': {},
+            'tags': tags, 'data_source_id': data_source_id, 'visualizations': [
+                {'id': query_id * 10, 'type': 'TABLE', 'name': 'Table', 'description': '', 'options': {}}]}
+
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'redash.snap')
+        api = MagicMock()
+        queries = {i: _query(i, ['finance'] if i % 2 else ['growth'], data_source_id=1 if i < 50 else 2)
+                   for i in range(1, 101)}
+        api.get_data_sources.return_value = [{'id': 1, 'name': 'athena', 'type': 'athena'},
+                                             {'id': 2, 'name': 'mysql', 'type': 'rds_mysql'}]
+        api.queries.return_value = {'results': [{'id': i} for i in reversed(queries)]}
+        api.get_query.side_effect = queries.get
+        api.dashboards.return_value = {'results': [{'id': 7}]}
+        api.get_dashboard.return_value = {
+            'id': 7, 'name': 'Sales', 'slug': 'sales', 'tags': ['finance'], 'widgets': [
+                {'id': 1, 'text': '', 'width': 1, 'options': {},
+                 'visualization': {**_query(3, [])['visualizations'][0], 'query': {'id': 3}}}]}
+        api.alerts.return_value = [{'id': 5, 'query': {'tags': ['growth']}}]
+        api.get_alert.return_value = {'id': 5, 'name': 'alert', 'query': _query(4, ['growth']), 'options': {}}
+        self.counts = write_snapshot(api, self.path).counts
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_indexes(self):
+        self.assertEqual(self.counts, {'query': 100, 'dashboard': 1, 'alert': 1})
+        reader = SnapshotReader(self.path)
+        self.assertEqual(reader.ids('query'), list(range(1, 101)))
+        self.assertEqual(reader.get_query(42)['query'], 'select 42')
+        with self.assertRaises(KeyError):
+            reader.get_query(101)
+        self.assertEqual([q['id'] for q in reader.queries(tags=['growth'])['results']][:3], [2, 4, 6])
+        self.assertEqual(reader.queries(tags=['growth', 'finance'])['results'], [])
+        self.assertEqual(len(reader.query_ids_for_data_source(2)), 51)
+        reader.close()
+
+    def test_redash_client(self):
+        redash = RedashClient.from_snapshot(self.path)
+        query = redash.get_query(3)
+        self.assertEqual(query.source.dialect, 'presto')
+        self.assertEqual(len(redash.query_ids(tags=['finance'])), 50)
+        self.assertEqual(redash.dashboard_ids(tags=['finance']), [7])
+        dashboard = redash.get_dashboard(7)
+        self.assertIs(dashboard.widgets[0].query, query)
+        self.assertEqual(redash.alert_ids(tags=['growth']), [5])
+        self.assertIsNone(redash.query_runtime(query))
+
+    def test_ids_are_listed_without_decoding_the_objects(self):
+        redash = RedashClient.from_snapshot(self.path)
+        redash.snapshot.get = MagicMock(side_effect=AssertionError('decoded'))
+        self.assertEqual(redash.query_ids(tags=['growth'])[:3], [2, 4, 6])
+        self.assertEqual(len(redash.query_ids()), 100)
+        self.assertEqual(redash.dashboard_ids(), [7])
+
+    def test_tagged_objects_refer_to_untagged_queries(self):
+        api = MagicMock()
+        queries = {i: _query(i, []) for i in range(1, 5)}
+        # the query shown by the dashboard has a dropdown parameter listing the values of query 2
+        queries[1]['options'] = {'parameters': [{'name': 'country', 'type': 'query', 'queryId': 2}]}
+        api.get_data_sources.return_value = [{'id': 1, 'name': 'athena', 'type': 'athena'}]
+        api.queries.return_value = {'results': []}
+        api.get_query.side_effect = queries.get
+        api.dashboards.return_value = {'results': [{'id': 7}]}
+        api.get_dashboard.return_value = {
+            'id': 7, 'name': 'Sales', 'slug': 'sales', 'tags': ['finance'], 'widgets': [
+                {'id': 1, 'text': '', 'width': 1, 'options': {},
+                 'visualization': {**queries[1]['visualizations'][0], 'query': {'id': 1}}},
+                {'id': 2, 'text': 'notes', 'width': 1, 'options': {}}]}
+        api.alerts.return_value = [{'id': 5, 'query': {'tags': ['finance']}}]
+        api.get_alert.return_value = {'id': 5, 'name': 'alert', 'query': queries[3], 'options': {}}
+
+        counts = write_snapshot(api, self.path, tags=['finance']).counts
+
+        self.assertEqual(counts, {'query': 3, 'dashboard': 1, 'alert': 1})
+        redash = RedashClient.from_snapshot(self.path)
+        dashboard = redash.get_dashboard(7)
+        self.assertEqual([q.id for q in dashboard.widgets[0].query.depends_on], [2])
+        self.assertEqual(redash.query_ids(tags=['finance']), [])
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 4)
+        with self.assertRaises(ValueError):
+            SnapshotReader(self.path)
+        with self.assertRaises(ValueError):
+            SnapshotReader(__file__)
@@ -0,0 +1,140 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+from urllib.request import urlopen
+
+from redash import Alert, Query
+from sync import SyncDaemon, SyncMetrics, serve_metrics
+
+
+class TestSyncDaemon(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmp_dir.name, 'state.json')
+        self.versions = {'query': {1: 't1', 2: 't1'}, 'alert': {5: 't1'}, 'dashboard': {}}
+        self.redash = MagicMock()
+        self.redash.versions.side_effect = lambda kind, tags: dict(self.versions[kind])
+        self.redash.get_query.side_effect = lambda i: Query(id=i, name=f"q{i}", query_string='select 1')
+        self.redash.get_alert.side_effect = lambda i: Alert(id=i, name='alert', query=Query(id=1, name='q1', query_string='select 1'),
+                                                            schedule=None, options={}, rearm=None)
+        self.dbx = MagicMock()
+        self.dbx.cache = {}
+        self.dbx.create_alert.return_value = 'a5'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _daemon(self):
+        return SyncDaemon(self.redash, self.dbx, '/Shared/redash', transform=False, state_path=self.state_path)
+
+    def test_pushes_deltas(self):
+        daemon = self._daemon()
+        self.assertEqual(daemon.cycle(), 0)
+        self.assertEqual(self.dbx.update_query.call_count, 2)
+        self.dbx.create_alert.assert_called_once()
+
+        # nothing changed
+        self.assertEqual(daemon.cycle(), 0)
+        self.assertEqual(self.dbx.update_query.call_count, 2)
+
+        # a restarted daemon only pushes the changes
+        self.versions['query'][2] = 't2'
+        self.versions['alert'][5] = 't2'
+        daemon = self._daemon()
+        daemon.cycle()
+        self.assertEqual(self.dbx.update_query.call_args.args[0].id, 2)
+        self.redash.forget_query.assert_called_with(2)
+        self.dbx.update_alert.assert_called_once()
+        self.assertEqual(self.dbx.update_alert.call_args.args[1], 'a5')
+
+    def test_query_ids_survive_restarts(self):
+        daemon = self._daemon()
+        self.dbx.cache[1] = ('dbx-1', {7: 'viz-7'})
+        daemon.cycle()
+
+        self.dbx.cache = {}
+        self._daemon()
+        self.assertEqual(self.dbx.cache, {1: ('dbx-1', {7: 'viz-7'})})
+
+    def test_failures_are_retried(self):
+        self.dbx.update_query.side_effect = [Exception('boom'), None, None]
+        daemon = self._daemon()
+        self.assertEqual(daemon.cycle(), 1)
+        self.assertIsNone(daemon.metrics.synced_at)
+        self.assertEqual(daemon.metrics.errors, {('query', 'push'): 1})
+
+        self.assertEqual(daemon.cycle(), 0)
+        self.assertEqual(self.dbx.update_query.call_count, 3)
+        self.assertIsNotNone(daemon.metrics.synced_at)
+        self.assertEqual(daemon.metrics.queue_depth, 0)
+
+    def test_schedule_changes_are_pushed(self):
+        schedules = {1: {'interval': 300}}
+        self.redash.get_query.side_effect = lambda i: Query(id=i, name=f"q{i}", query_string='select 1',
+                                                           schedule=schedules.get(i))
+        daemon = self._daemon()
+        daemon.cycle()
+        self.assertEqual(self.dbx.update_query_schedule.call_count, 2)
+
+        # a new version of the query, with the same schedule
+        self.versions['query'][1] = 't2'
+        daemon.cycle()
+        self.assertEqual(self.dbx.update_query_schedule.call_count, 2)
+
+        schedules[1] = {'interval': 3600}
+        self.versions['query'][1] = 't3'
+        self.versions['alert'][5] = 't2'
+        self._daemon().cycle()
+        self.assertEqual(self.dbx.update_query_schedule.call_args.args[0].schedule, {'interval': 3600})
+        # the schedule of the alert didn't change
+        self.dbx.update_alert_schedule.assert_not_called()
+
+    def test_failed_dashboard_creations_forget_the_deleted_dashboard(self):
+        from databricks.sdk.errors import NotFound
+
+        self.versions = {'query': {}, 'alert': {}, 'dashboard': {3: 't1'}}
+        self.redash.get_dashboard.side_effect = lambda i: MagicMock(id=i, widgets=[])
+        self.dbx.create_dashboard_ex.side_effect = ['d1', Exception('boom'), 'd2', 'd3']
+        daemon = self._daemon()
+        daemon.cycle()
+        self.assertEqual(daemon.synced['dashboard'], {'3': 'd1'})
+
+        self.versions['dashboard'][3] = 't2'
+        self.assertEqual(daemon.cycle(), 1)
+        self.dbx.client.dashboards.delete.assert_called_once_with('d1')
+        self.assertEqual(daemon.synced['dashboard'], {})
+
+        self.assertEqual(daemon.cycle(), 0)
+        self.assertEqual(self.dbx.client.dashboards.delete.call_count, 1)
+        self.assertEqual(daemon.synced['dashboard'], {'3': 'd2'})
+
+        # deleted by hand
+        self.dbx.client.dashboards.delete.side_effect = NotFound('gone')
+        self.versions['dashboard'][3] = 't3'
+        self.assertEqual(daemon.cycle(), 0)
+        self.assertEqual(daemon.synced['dashboard'], {'3': 'd3'})
+
+
+class TestMetrics(TestCase):
+
+    def test_endpoint(self):
+        metrics = SyncMetrics()
+        with metrics.timed('push'):
+            pass
+        metrics.count('query', 'synced')
+        metrics.error('query', 'fetch')
+        server = serve_metrics(metrics, 0, '127.0.0.1')
+        try:
+            with urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+                body = response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertIn('redash2dqsql_sync_phase_seconds_count{phase="push"} 1', body)
+        self.assertIn('redash2dqsql_sync_phase_seconds_bucket{phase="push",le="+Inf"} 1', body)
+        self.assertIn('redash2dqsql_sync_objects_total{kind="query",outcome="synced"} 1', body)
+        self.assertIn('redash2dqsql_sync_errors_total{kind="query",phase="fetch"} 1', body)
+        self.assertIn('redash2dqsql_sync_lag_seconds ', body)
@@ -0,0 +1,55 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from workspace_index import WorkspaceIndex, original_id
+
+
+def _visualization(id, name, type):
+    visualization = MagicMock(id=id, type=type)
+    visualization.name = name
+    return visualization
+
+
+def _alert(id, name, query_id):
+    alert = MagicMock(id=id, query=MagicMock(id=query_id))
+    alert.name = name
+    return alert
+
+
+class TestWorkspaceIndex(TestCase):
+
+    def setUp(self):
+        client = MagicMock()
+        client.queries.list.return_value = [
+            MagicMock(id='q1', description='Migrated from Redash on 2024-01-01 10:00:00, original_id:12, tags: a',
+                      visualizations=[_visualization('v1', 'Chart', 'CHART')]),
+            MagicMock(id='q2', description='Hand written', visualizations=[]),
+        ]
+        client.dashboards.list.return_value = [
+            MagicMock(id='d1', tags=['migrated_from_redash', 'original_id:3', 'finance']),
+            MagicMock(id='d2', tags=['original_id:4']),
+        ]
+        client.alerts.list.return_value = [_alert('a1', 'too high', 'q1')]
+        client.jobs.list.return_value = [
+            MagicMock(job_id=100, settings=MagicMock(tags={'migrated_from_redash': 'true', 'original_id': '12'})),
+            MagicMock(job_id=101, settings=MagicMock(tags={'migrated_from_redash': 'true', 'alert_id': 'a1,a2'})),
+            MagicMock(job_id=102, settings=MagicMock(tags={})),
+            # batched schedule whose alerts don't fit in its `alert_id` tag
+            MagicMock(job_id=103, settings=MagicMock(tags={'migrated_from_redash': 'true', 'type': 'alert'}, tasks=[
+                MagicMock(sql_task=MagicMock(alert=MagicMock(alert_id=f'b{i}'))) for i in range(2)
+            ])),
+        ]
+        self.index = WorkspaceIndex.build(client)
+
+    def test_original_id(self):
+        self.assertEqual(original_id('tags: x, original_id: 42'), 42)
+        self.assertIsNone(original_id(None))
+
+    def test_index(self):
+        self.assertEqual(self.index.query(12).id, 'q1')
+        self.assertEqual(self.index.query(12).visualizations, {('Chart', 'CHART'): 'v1'})
+        self.assertEqual(set(self.index.queries), {12})
+        self.assertEqual(self.index.dashboards, {3: 'd1'})
+        self.assertEqual(self.index.alert('q1', 'too high'), 'a1')
+        self.assertEqual(self.index.query_jobs, {12: 100})
+        self.assertEqual(self.index.alert_jobs, {'a1': 101, 'a2': 101, 'b0': 103, 'b1': 103})